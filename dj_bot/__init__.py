@@ -2,8 +2,14 @@
 BASE_DIR = "./"
 
 SAVE_FILE = BASE_DIR + ".save"
+JOURNAL_FILE = BASE_DIR + ".journal"
 CACHE_FILE = BASE_DIR + ".song_cache"
+INDEX_FILE = BASE_DIR + ".song_index.db"
+SEARCH_CACHE_FILE = BASE_DIR + ".search_cache"
+VIDEO_CACHE_FILE = BASE_DIR + ".video_cache"
+QUOTA_FILE = BASE_DIR + ".quota"
 DOWNLOAD_DIR = BASE_DIR + ".songs/"
+LOCK_DIR = BASE_DIR + ".locks/"
 FFMPEG_DIR = BASE_DIR + "ffmpeg/"
 
 LOGGER_NAME = "dj_bot_log"
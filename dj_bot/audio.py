@@ -0,0 +1,748 @@
+from dj_bot import LOGGER_NAME, FFMPEG_DIR
+
+import discord
+import collections
+import subprocess
+import threading
+import logging
+import struct
+import time
+import mmap
+import os
+
+# ----- Discord audio parameters -----
+
+OPUS_EXTENSION: str = ".opus"
+SAMPLING_RATE: int = 48000
+CHANNELS: int = 2
+FRAME_DURATION: int = 20
+SAMPLES_PER_FRAME: int = SAMPLING_RATE * FRAME_DURATION // 1000
+
+# ----- Ogg format -----
+
+OGG_PAGE_HEADER: struct.Struct = struct.Struct("<4sBBqIIIB")
+OGG_CONTINUED_FLAG: int = 0x01
+
+
+class FFmpegError(OSError):
+    """
+    FFmpegError class.
+
+    This exception is raised when the ffmpeg binary cannot be run at all, as opposed to ffmpeg failing on a file
+    """
+    pass
+
+
+def run_ffmpeg(args: list) -> bool:
+    """
+    Run the ffmpeg binary with the wanted arguments and wait for it
+
+    params :
+        - args: list = The ffmpeg arguments
+    return -> bool = True if ffmpeg succeeded, False else
+    """
+
+    try:
+        res = subprocess.run(
+            [FFMPEG_DIR + "ffmpeg", "-y", "-v", "error"] + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    except OSError as e:
+        raise FFmpegError("Cannot run ffmpeg : " + str(e))
+    return res.returncode == 0
+
+
+def has_opus_head(path: str) -> bool:
+    """
+    Get if the first packet of an Ogg file is an Opus identification header, the Ogg muxer also accepts Vorbis
+    and FLAC streams
+
+    params :
+        - path: str = The Ogg file path
+    return -> bool = True if the file holds an Opus stream, False else
+    """
+
+    try:
+        with open(path, mode="rb") as ogg_file:
+            header: bytes = ogg_file.read(OGG_PAGE_HEADER.size)
+            if len(header) < OGG_PAGE_HEADER.size:
+                return False
+            capture, _, _, _, _, _, _, segment_count = OGG_PAGE_HEADER.unpack(header)
+            if capture != b"OggS":
+                return False
+            ogg_file.seek(segment_count, os.SEEK_CUR)
+            return ogg_file.read(8) == b"OpusHead"
+    except OSError as _:
+        return False
+
+
+def remove_file(path: str) -> None:
+    """
+    Remove a file if it exists
+
+    params :
+        - path: str = The file path
+    """
+
+    try:
+        os.remove(path)
+    except FileNotFoundError as _:
+        pass
+
+
+def encode_opus(src_path: str, bitrate: int) -> str:
+    """
+    Store a song file as an Ogg Opus file with the discord parameters and remove the source file, an Opus
+    stream is copied and any other stream is encoded
+
+    params :
+        - src_path: str = The path of the downloaded song file
+        - bitrate: int = The bitrate in kbps used when the stream needs to be encoded
+    return -> str = The path of the Ogg Opus file or None if ffmpeg cannot read the file, FFmpegError is raised
+              when ffmpeg cannot be run and the source file is kept
+    """
+
+    # Verify the file isn't already converted
+    dst_path: str = os.path.splitext(src_path)[0] + OPUS_EXTENSION
+    if src_path == dst_path:
+        return dst_path
+    tmp_path: str = dst_path + ".tmp"
+
+    # Try to copy the stream and encode it if this is not an Opus stream
+    copy_args: list = ["-i", src_path, "-vn", "-map_metadata", "-1", "-c:a", "copy", "-f", "ogg", tmp_path]
+    encode_args: list = [
+        "-i", src_path, "-vn", "-map_metadata", "-1",
+        "-c:a", "libopus", "-b:a", str(bitrate) + "k", "-ar", str(SAMPLING_RATE), "-ac", str(CHANNELS),
+        "-frame_duration", str(FRAME_DURATION), "-application", "audio",
+        "-f", "ogg", tmp_path
+    ]
+
+    try:
+        # A copied Vorbis or FLAC stream is muxed without error, only keep the copy of an Opus stream
+        copied: bool = run_ffmpeg(copy_args) and has_opus_head(tmp_path)
+        if not copied and not run_ffmpeg(encode_args):
+            logging.getLogger(LOGGER_NAME).error("Cannot encode " + src_path + " to Opus")
+            remove_file(tmp_path)
+            return None
+    except FFmpegError as _:
+        logging.getLogger(LOGGER_NAME).error("Cannot run ffmpeg to encode " + src_path + " to Opus")
+        remove_file(tmp_path)
+        raise
+
+    # Replace the source file
+    os.replace(tmp_path, dst_path)
+    os.remove(src_path)
+    return dst_path
+
+
+def is_opus_file(path: str) -> bool:
+    """
+    Get if a song file is a pre-encoded Ogg Opus file
+
+    params :
+        - path: str = The song file path
+    return -> bool = True if the file can be sent to discord without encoding, False else
+    """
+
+    return path is not None and path.endswith(OPUS_EXTENSION)
+
+
+def get_opus_packet_duration(packet) -> float:
+    """
+    Get the duration of an Opus packet from its TOC byte (RFC 6716 section 3.1)
+
+    params :
+        - packet = The Opus packet
+    return -> float = The packet duration in milliseconds
+    """
+
+    # Get the frame duration from the configuration number
+    config: int = packet[0] >> 3
+    if config < 12:
+        frame_duration: float = (10, 20, 40, 60)[config % 4]
+    elif config < 16:
+        frame_duration: float = (10, 20)[config % 2]
+    else:
+        frame_duration: float = (2.5, 5, 10, 20)[config % 4]
+
+    # Get the number of frames in the packet
+    code: int = packet[0] & 0x03
+    if code == 0:
+        frame_count: int = 1
+    elif code < 3:
+        frame_count: int = 2
+    else:
+        frame_count: int = packet[1] & 0x3F
+
+    return frame_duration * frame_count
+
+
+class OggError(ValueError):
+    """
+    OggError class.
+
+    This exception is raised when an Ogg Opus file cannot be read by the native reader
+    """
+    pass
+
+
+class OggOpusAudio(discord.AudioSource):
+    """
+    OggOpusAudio class.
+
+    This class is an audio source reading the Opus packets of an Ogg Opus file without ffmpeg, the file is
+    memory mapped and the packets are sent as views on the mapped pages
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, path: str):
+        """
+        Open an Ogg Opus file and read its headers
+
+        params :
+            - path: str = The Ogg Opus file path
+        """
+
+        # Map the file in memory
+        try:
+            self.file = open(path, mode="rb")
+        except OSError as e:
+            raise OggError("Cannot open " + path + " : " + str(e))
+        try:
+            self.map: mmap.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.file.close()
+            raise OggError("Cannot map " + path + " : " + str(e))
+        self.data: memoryview = memoryview(self.map)
+
+        # Prepare the reading state
+        self.path: str = path
+        self.offset: int = 0
+        self.serial: int = None
+        self.packets: collections.deque = collections.deque()
+        self.partial: list = list()
+        self.skip_partial: bool = False
+        self.granule: int = 0
+        self.pre_skip: int = 0
+        self.audio_start: int = 0
+
+        try:
+            self.read_headers()
+        except (OggError, struct.error, IndexError) as e:
+            self.cleanup()
+            raise OggError("Cannot read " + path + " : " + str(e))
+
+    # ----- Class methods -----
+
+    def read_headers(self) -> None:
+        """
+        Read the identification and comment headers and verify the packets fit the discord frames
+        """
+
+        # Read the identification header
+        head = self.next_packet()
+        if head is None or bytes(head[:8]) != b"OpusHead":
+            raise OggError("not an Opus stream")
+        self.pre_skip = struct.unpack_from("<H", head, 10)[0]
+
+        # Skip the comment header, the audio always starts on a new page
+        tags = self.next_packet()
+        if tags is None or bytes(tags[:8]) != b"OpusTags":
+            raise OggError("missing Opus comment header")
+        self.audio_start = self.offset
+        self.packets.clear()
+
+        # Verify the first audio packet duration
+        first = self.next_packet()
+        if first is None or len(first) == 0:
+            raise OggError("no audio packet")
+        if get_opus_packet_duration(first) != FRAME_DURATION:
+            raise OggError("packets are not " + str(FRAME_DURATION) + " ms long")
+        self.seek(0)
+
+    def read_page(self) -> bool:
+        """
+        Read the next page of the stream and split it in packets
+
+        return -> bool = True if a page was read, False at the end of the file
+        """
+
+        while self.offset + OGG_PAGE_HEADER.size <= len(self.data):
+            # Read the page header
+            capture, version, header_type, granule, serial, _, _, segment_count = \
+                OGG_PAGE_HEADER.unpack_from(self.data, self.offset)
+            if capture != b"OggS" or version != 0:
+                raise OggError("invalid page at " + str(self.offset))
+            lacing = self.data[self.offset + OGG_PAGE_HEADER.size:self.offset + OGG_PAGE_HEADER.size + segment_count]
+            body: int = self.offset + OGG_PAGE_HEADER.size + segment_count
+            self.offset = body + sum(lacing)
+            if self.offset > len(self.data):
+                raise OggError("truncated page at " + str(body))
+
+            # Only read the first logical stream
+            if self.serial is None:
+                self.serial = serial
+            elif serial != self.serial:
+                continue
+
+            # Drop the packet end if its start was skipped by a seek
+            if not header_type & OGG_CONTINUED_FLAG:
+                self.partial.clear()
+
+            # Split the page body in packets, a packet ends with a lacing value lower than 255
+            start: int = body
+            size: int = 0
+            for lacing_value in lacing:
+                size += lacing_value
+                if lacing_value < 255:
+                    self.add_packet(start, size)
+                    start += size
+                    size = 0
+            if size > 0 or (len(lacing) > 0 and lacing[-1] == 255):
+                self.partial.append(self.data[start:start + size])
+
+            if granule != -1:
+                self.granule = granule
+            return True
+
+        return False
+
+    def add_packet(self, start: int, size: int) -> None:
+        """
+        Add a complete packet of the current page to the packets to send
+
+        params :
+            - start: int = The packet start offset in the file
+            - size: int = The packet size in the current page
+        """
+
+        if len(self.partial) > 0:
+            # Join the packet parts spread over several pages
+            parts: list = self.partial + [self.data[start:start + size]]
+            self.partial = list()
+            if self.skip_partial:
+                self.skip_partial = False
+            else:
+                self.packets.append(b"".join(parts))
+        elif self.skip_partial:
+            self.skip_partial = False
+        elif size > 0:
+            self.packets.append(self.data[start:start + size])
+
+    def next_packet(self):
+        """
+        Get the next packet of the stream
+
+        return -> The packet view or None at the end of the stream
+        """
+
+        while len(self.packets) == 0:
+            if not self.read_page():
+                return None
+        return self.packets.popleft()
+
+    def seek(self, granule: int) -> None:
+        """
+        Move the reading to the first page ending after a granule position
+
+        params :
+            - granule: int = The wanted granule position (48 kHz samples including the pre skip)
+        """
+
+        # Reset the reading state
+        self.offset = self.audio_start
+        self.packets.clear()
+        self.partial.clear()
+        self.skip_partial = False
+        self.granule = 0
+        if granule <= 0:
+            return
+
+        # Scan the page headers without reading the packets
+        page_offset: int = self.audio_start
+        while page_offset + OGG_PAGE_HEADER.size <= len(self.data):
+            _, _, header_type, page_granule, serial, _, _, segment_count = \
+                OGG_PAGE_HEADER.unpack_from(self.data, page_offset)
+            body: int = page_offset + OGG_PAGE_HEADER.size + segment_count
+            if serial == self.serial and page_granule != -1 and page_granule >= granule:
+                self.offset = page_offset
+                self.skip_partial = bool(header_type & OGG_CONTINUED_FLAG)
+                return
+            self.granule = page_granule
+            page_offset = body + sum(self.data[page_offset + OGG_PAGE_HEADER.size:body])
+
+        # The granule is after the end of the stream
+        self.offset = len(self.data)
+
+    def seek_time(self, seconds: float) -> None:
+        """
+        Move the reading to a time position
+
+        params :
+            - seconds: float = The wanted position in seconds
+        """
+
+        self.seek(int(seconds * SAMPLING_RATE) + self.pre_skip)
+
+    def read(self):
+        """
+        Get the next 20 ms Opus packet
+
+        return -> The Opus packet or an empty bytes object at the end of the stream
+        """
+
+        try:
+            packet = self.next_packet()
+        except (OggError, struct.error) as e:
+            logging.getLogger(LOGGER_NAME).warning("Stop reading " + self.path + " : " + str(e))
+            packet = None
+        if packet is None:
+            return b""
+        return packet
+
+    def is_opus(self) -> bool:
+        """
+        Get if the source gives Opus packets
+
+        return -> bool = Always True
+        """
+
+        return True
+
+    def cleanup(self) -> None:
+        """
+        Release the memory map and the file
+        """
+
+        if self.data is not None:
+            self.packets.clear()
+            self.partial.clear()
+            self.data.release()
+            self.data = None
+            self.file.close()
+
+            # The map is closed by the garbage collector if the player still holds the last packet
+            try:
+                self.map.close()
+            except BufferError as _:
+                pass
+
+
+class GrowingFile:
+    """
+    GrowingFile class.
+
+    This class is a file-like object reading a file that is still downloading, it waits for new bytes at the
+    end of the file until the download is done
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, path: str, done_event: threading.Event, poll_delay: float = 0.05):
+        """
+        Open a downloading file
+
+        params :
+            - path: str = The path of the downloading file
+            - done_event: threading.Event = The event set when the download is done or failed
+            - poll_delay: float = The delay in seconds between two checks of the file end
+        """
+
+        # Assign the attributes, the file is opened now to keep reading it after youtube dl renames it
+        self.file = open(path, mode="rb")
+        self.done_event: threading.Event = done_event
+        self.poll_delay: float = poll_delay
+
+    # ----- Class methods -----
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read bytes from the file and wait for them if the download isn't done
+
+        params :
+            - size: int = The maximum number of bytes to read
+
+        return -> bytes = The read bytes, empty when the download is done and the file is completely read
+        """
+
+        while True:
+            # Verify the download state before reading to never miss the last bytes
+            done: bool = self.done_event.is_set()
+            data: bytes = self.file.read(size)
+            if len(data) > 0 or done:
+                if len(data) == 0:
+                    self.file.close()
+                return data
+            self.done_event.wait(self.poll_delay)
+
+
+class JitterMeter:
+    """
+    JitterMeter class.
+
+    This class measures the time between two frame reads of the voice player thread, a starved thread reads
+    the frames later than the discord frame duration
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, max_samples: int = 3000, pause_delay: float = 1):
+        """
+        Create a new meter
+
+        params :
+            - max_samples: int = The number of the last intervals kept for the statistics
+            - pause_delay: float = The interval in seconds above which the player is considered paused
+        """
+
+        # Assign the attributes
+        self.pause_delay: float = pause_delay
+        self.intervals: collections.deque = collections.deque(maxlen=max_samples)
+
+    # ----- Class methods -----
+
+    def add(self, interval: float) -> None:
+        """
+        Record the interval between two frame reads
+
+        params :
+            - interval: float = The interval in seconds
+        """
+
+        if interval < self.pause_delay:
+            self.intervals.append(interval)
+
+    def stats(self) -> dict:
+        """
+        Get the deviation of the read intervals from the frame duration
+
+        return -> dict = The number of intervals, the average and maximum deviations in milliseconds and the
+                         number of intervals longer than two frames
+        """
+
+        intervals: list = list(self.intervals)
+        if len(intervals) == 0:
+            return {"count": 0, "average": None, "max": None, "late": 0}
+
+        deviations: list = [abs(interval * 1000 - FRAME_DURATION) for interval in intervals]
+        return {
+            "count": len(intervals),
+            "average": sum(deviations) / len(deviations),
+            "max": max(deviations),
+            "late": sum(1 for interval in intervals if interval * 1000 > 2 * FRAME_DURATION)
+        }
+
+
+class MeteredAudioSource(discord.AudioSource):
+    """
+    MeteredAudioSource class.
+
+    This class wraps an audio source to report when its first frame is read, to count the read frames to know
+    the playing position and to measure the regularity of the reads
+    """
+
+    # ----- Constructor -----
+
+    def __init__(
+            self,
+            source: discord.AudioSource,
+            first_frame_func=None,
+            start_offset: float = 0,
+            jitter_meter: JitterMeter = None
+    ):
+        """
+        Wrap an audio source
+
+        params :
+            - source: discord.AudioSource = The wrapped audio source
+            - first_frame_func = The function to call with the time.monotonic() of the first frame, it is called
+                                 on the voice thread and must not block
+            - start_offset: float = The position in seconds the source starts at
+            - jitter_meter: JitterMeter = The meter recording the intervals between two reads
+        """
+
+        # Assign the attributes
+        self.source: discord.AudioSource = source
+        self.first_frame_func = first_frame_func
+        self.start_offset: float = start_offset
+        self.jitter_meter: JitterMeter = jitter_meter
+        self.frame_count: int = 0
+        self.last_read_time: float = None
+
+        # The source and its start offset waiting to replace the wrapped source
+        self.pending: tuple = None
+        self.pending_lock: threading.Lock = threading.Lock()
+        self.cleaned: bool = False
+
+    # ----- Class methods -----
+
+    def replace(self, source: discord.AudioSource, start_offset: float) -> None:
+        """
+        Replace the wrapped source without stopping the player, the swap is made by the player thread at its next
+        read because it can be reading the old source now
+
+        params :
+            - source: discord.AudioSource = The new source
+            - start_offset: float = The position in seconds the new source starts at
+        """
+
+        with self.pending_lock:
+            # The player already stopped, the new source is never read
+            if self.cleaned:
+                source.cleanup()
+                return
+            # A replaced pending source was never read and can be cleaned here
+            if self.pending is not None:
+                self.pending[0].cleanup()
+            self.pending = (source, start_offset)
+
+    def swap_pending(self) -> None:
+        """
+        Swap the wrapped source with the pending one and clean the old one, only the player thread calls it
+        """
+
+        with self.pending_lock:
+            pending: tuple = self.pending
+            self.pending = None
+        if pending is None:
+            return
+
+        old_source: discord.AudioSource = self.source
+        self.source, self.start_offset = pending
+        self.frame_count = 0
+        self.first_frame_func = None
+        old_source.cleanup()
+
+    def read(self):
+        """
+        Read a frame from the wrapped source
+
+        return -> The frame data
+        """
+
+        # Measure the interval since the previous read
+        if self.jitter_meter is not None:
+            read_time: float = time.perf_counter()
+            if self.last_read_time is not None:
+                self.jitter_meter.add(read_time - self.last_read_time)
+            self.last_read_time = read_time
+
+        self.swap_pending()
+        data = self.source.read()
+        if self.frame_count == 0 and data and self.first_frame_func is not None:
+            self.first_frame_func(time.monotonic())
+        self.frame_count += 1
+        return data
+
+    def get_position(self) -> float:
+        """
+        Get the playing position from the number of read frames
+
+        return -> float = The position in seconds
+        """
+
+        pending: tuple = self.pending
+        if pending is not None:
+            return pending[1]
+        return self.start_offset + self.frame_count * FRAME_DURATION / 1000
+
+    def is_opus(self) -> bool:
+        """
+        Get if the wrapped source gives Opus packets
+
+        return -> bool = True if the frames are Opus packets, False if they are PCM
+        """
+
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        """
+        Clean the wrapped source and the pending one
+        """
+
+        with self.pending_lock:
+            self.cleaned = True
+            pending: tuple = self.pending
+            self.pending = None
+        if pending is not None:
+            pending[0].cleanup()
+        self.source.cleanup()
+
+
+class PrimedAudioSource(discord.AudioSource):
+    """
+    PrimedAudioSource class.
+
+    This class wraps an audio source opened before its turn, its first frames are read in advance so the
+    playing starts without waiting for the decoder
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, source: discord.AudioSource, frame_count: int = 10):
+        """
+        Wrap an audio source and start reading its first frames in a thread
+
+        params :
+            - source: discord.AudioSource = The wrapped audio source
+            - frame_count: int = The number of frames to read in advance
+        """
+
+        # Assign the attributes
+        self.source: discord.AudioSource = source
+        self.frame_count: int = frame_count
+        self.frames: collections.deque = collections.deque()
+        self.lock: threading.Lock = threading.Lock()
+        self.cleaned: bool = False
+
+        # Start the priming
+        threading.Thread(target=self.prime, name="dj_prime", daemon=True).start()
+
+    # ----- Class methods -----
+
+    def prime(self) -> None:
+        """
+        Read the first frames of the wrapped source
+        """
+
+        for _ in range(self.frame_count):
+            with self.lock:
+                if self.cleaned:
+                    return
+                data = self.source.read()
+                self.frames.append(data)
+                if not data:
+                    return
+
+    def read(self):
+        """
+        Read a frame from the primed frames or from the wrapped source
+
+        return -> The frame data
+        """
+
+        with self.lock:
+            if len(self.frames) > 0:
+                return self.frames.popleft()
+            return self.source.read()
+
+    def is_opus(self) -> bool:
+        """
+        Get if the wrapped source gives Opus packets
+
+        return -> bool = True if the frames are Opus packets, False if they are PCM
+        """
+
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        """
+        Clean the wrapped source and stop the priming
+        """
+
+        with self.lock:
+            self.cleaned = True
+            self.frames.clear()
+            self.source.cleanup()
@@ -0,0 +1,182 @@
+from dj_bot import LOGGER_NAME
+
+import concurrent.futures
+import threading
+import logging
+import time
+
+
+class BatchFailure:
+    """
+    BatchFailure class.
+
+    This class is the result given to the keys of a batch that cannot be fetched
+    """
+
+    __slots__ = ("error",)
+
+    # ----- Constructor -----
+
+    def __init__(self, error: Exception):
+        """
+        Create a new failure result
+
+        params :
+            - error: Exception = The error raised by the batch request
+        """
+
+        # Assign the attributes
+        self.error: Exception = error
+
+
+class LookupBatcher:
+    """
+    LookupBatcher class.
+
+    This class merges the key lookups of concurrent callers, the keys asked during a short window are fetched
+    together with one request per batch and each caller waits for its own keys. A key already waiting or
+    fetched for another caller is not asked twice. A failed batch only fails its own keys and the callers get
+    them as failed keys instead of an error
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, fetch_func, batch_size: int = 50, window: float = 0.05, name: str = "dj_batch"):
+        """
+        Create a new batcher and start its thread
+
+        params :
+            - fetch_func = The function fetching a list of keys in one request, it returns the values by key and
+              the absent keys have no value
+            - batch_size: int = The maximum number of keys fetched together
+            - window: float = The time in seconds to wait for other keys after the first one
+            - name: str = The name of the batcher thread
+        """
+
+        # Assign the attributes
+        self.fetch_func = fetch_func
+        self.batch_size: int = batch_size
+        self.window: float = window
+        self.condition: threading.Condition = threading.Condition()
+        self.running: bool = True
+
+        # The futures of the asked keys and the keys waiting for their batch
+        self.pending: dict = dict()
+        self.waiting: list = list()
+
+        # The statistics
+        self.request_count: int = 0
+        self.key_count: int = 0
+        self.failure_count: int = 0
+
+        self.thread: threading.Thread = threading.Thread(target=self.batch_loop, name=name, daemon=True)
+        self.thread.start()
+
+    # ----- Class methods -----
+
+    def get(self, keys: list) -> tuple:
+        """
+        Get the values of keys, this method blocks until their batches are fetched
+
+        params :
+            - keys: list = The keys
+
+        return -> tuple = The values by key, the keys without value are absent, and the set of the keys whose
+                          batch failed
+        """
+
+        # Share the futures of the keys already asked and queue the others
+        futures: dict = dict()
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("The batcher is stopped")
+            for key in keys:
+                future: concurrent.futures.Future = self.pending.get(key, None)
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self.pending[key] = future
+                    self.waiting.append(key)
+                futures[key] = future
+            self.condition.notify()
+
+        # Wait for the values
+        values: dict = dict()
+        failed_keys: set = set()
+        for key, future in futures.items():
+            value = future.result()
+            if isinstance(value, BatchFailure):
+                failed_keys.add(key)
+            elif value is not None:
+                values[key] = value
+        return values, failed_keys
+
+    def next_batch(self) -> list:
+        """
+        Wait for keys and for the batching window and take the next batch
+
+        return -> list = The keys to fetch or None if the batcher is stopped
+        """
+
+        with self.condition:
+            while self.running and len(self.waiting) == 0:
+                self.condition.wait()
+
+            # Let the other callers add their keys until the batch is full
+            end_time: float = time.monotonic() + self.window
+            while self.running and len(self.waiting) < self.batch_size and time.monotonic() < end_time:
+                self.condition.wait(end_time - time.monotonic())
+            if not self.running:
+                return None
+
+            batch: list = self.waiting[:self.batch_size]
+            del self.waiting[:self.batch_size]
+            return batch
+
+    def batch_loop(self) -> None:
+        """
+        The batcher thread function, it fetches the batches one after another and gives the values to the callers
+        """
+
+        while True:
+            batch: list = self.next_batch()
+            if batch is None:
+                return
+
+            failure: BatchFailure = None
+            try:
+                values: dict = self.fetch_func(batch)
+                self.request_count += 1
+                self.key_count += len(batch)
+            except Exception as e:
+                logging.getLogger(LOGGER_NAME).warning(
+                    "Cannot fetch a batch of " + str(len(batch)) + " keys : " + str(e))
+                failure = BatchFailure(e)
+                self.failure_count += 1
+
+            # Resolve the futures, the values are joined by key and never by position
+            with self.condition:
+                futures: list = [(key, self.pending.pop(key)) for key in batch]
+            for key, future in futures:
+                future.set_result(failure if failure is not None else values.get(key, None))
+
+    def stop(self) -> None:
+        """
+        Stop the batcher thread, the waiting callers get an error
+        """
+
+        with self.condition:
+            self.running = False
+            futures: list = [self.pending.pop(key) for key in self.waiting]
+            self.waiting.clear()
+            self.condition.notify_all()
+        for future in futures:
+            future.set_exception(RuntimeError("The batcher is stopped"))
+
+    def stats(self) -> dict:
+        """
+        Get the batcher statistics
+
+        return -> dict = The number of requests, of fetched keys and of failed batches
+        """
+
+        return {"requests": self.request_count, "keys": self.key_count, "failures": self.failure_count}
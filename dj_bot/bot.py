@@ -1,23 +1,19 @@
-from dj_bot import clients, song, utils
-from dj_bot import DOWNLOAD_DIR, CACHE_FILE, SAVE_FILE, LOGGER_NAME
+from dj_bot import audio, clients, player, session, song, utils
+from dj_bot import LOGGER_NAME
 
 import discord
-import json
-import os
+import collections
+import concurrent.futures
+import asyncio
 import logging
 
-# ----- DJBot states -----
-
-PAUSE_STATE: int = 0
-PLAY_STATE: int = 1
-IDLE_STATE: int = 2
-
 
 class DJBot:
     """
     DJBot class.
 
-    This class is the main class of the bot, it contains all methods to control the music playing
+    This class is the main class of the bot, it contains the clients shared by all guilds and the player of
+    each guild
     """
 
     # ----- Constructor -----
@@ -32,7 +28,33 @@ class DJBot:
             admin_roles: list,
             queue_max_size: int,
             max_result: int,
-            remove_req: bool
+            remove_req: bool,
+            search_cache_size: int = 512,
+            search_cache_ttl: float = 86400,
+            video_cache_size: int = 4096,
+            video_cache_ttl: float = 604800,
+            persist_search_cache: bool = True,
+            download_workers: int = 2,
+            download_timeout: float = 600,
+            opus_bitrate: int = 96,
+            progressive_playback: bool = True,
+            stream_buffer_size: int = 262144,
+            cache_max_size: int = 2048,
+            cache_max_files: int = 1000,
+            cache_check_interval: float = 300,
+            download_ahead: int = 3,
+            position_save_interval: float = 5,
+            shard_ids: list = None,
+            shard_count: int = None,
+            shared_cache: bool = False,
+            round_robin_queue: bool = False,
+            user_command_burst: float = 5,
+            user_command_rate: float = 1,
+            guild_task_limit: int = 4,
+            search_session_max: int = 1000,
+            search_session_ttl: float = 600,
+            daily_quota: int = 10000,
+            low_quota: int = 2000
     ):
         """
         Create a new bot with the wanted parameters
@@ -48,15 +70,58 @@ class DJBot:
         self.queue_max_size = queue_max_size
         self.max_result: int = max_result
         self.remove_req: bool = remove_req
-
-        self.state: int = IDLE_STATE
-        self.song_queue: list = list()
-        self.current_song: song.Song = None
-        self.user_search: dict = dict()
-        self.banned_user: list = list()
-
-        self.discord_client: clients.DJDiscordClient = clients.DJDiscordClient(self, self.req_channel, self.play_channel, self.remove_req)
-        self.youtube_client: clients.DJYoutubeClient = clients.DJYoutubeClient(self, self.youtube_token)
+        self.progressive_playback: bool = progressive_playback
+        self.stream_buffer_size: int = stream_buffer_size
+        self.download_ahead: int = download_ahead
+        self.position_save_interval: float = position_save_interval
+        self.round_robin_queue: bool = round_robin_queue
+
+        # The players of the guilds keyed by guild id
+        self.players: dict = dict()
+        self.first_audio_delays: collections.deque = collections.deque(maxlen=100)
+
+        # The journals of the closed players, their writer threads finish in background
+        self.closed_journals: list = list()
+        self.jitter_meter: audio.JitterMeter = audio.JitterMeter()
+
+        # The executor opening the song sources outside of the event loop
+        self.source_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="dj_source")
+
+        # The last search results of the users of every guild
+        self.search_sessions: session.SearchSessionStore = session.SearchSessionStore(
+            search_session_max,
+            search_session_ttl
+        )
+
+        self.discord_client: clients.DJDiscordClient = clients.DJDiscordClient(
+            self,
+            self.req_channel,
+            self.play_channel,
+            self.remove_req,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            user_command_burst=user_command_burst,
+            user_command_rate=user_command_rate,
+            guild_task_limit=guild_task_limit
+        )
+        self.youtube_client: clients.DJYoutubeClient = clients.DJYoutubeClient(
+            self,
+            self.youtube_token,
+            search_cache_size=search_cache_size,
+            search_cache_ttl=search_cache_ttl,
+            video_cache_size=video_cache_size,
+            video_cache_ttl=video_cache_ttl,
+            persist_cache=persist_search_cache,
+            download_workers=download_workers,
+            download_timeout=download_timeout,
+            opus_bitrate=opus_bitrate,
+            cache_max_size=cache_max_size,
+            cache_max_files=cache_max_files,
+            cache_check_interval=cache_check_interval,
+            shared_cache=shared_cache,
+            daily_quota=daily_quota,
+            low_quota=low_quota
+        )
 
     # ----- Class methods -----
 
@@ -87,194 +152,127 @@ class DJBot:
         # Return the default response
         return False
 
-    def is_banned(self, user: discord.Member) -> bool:
+    def get_player(self, guild_id: int):
         """
-        Get if a user is banned or not
+        Get the player of a guild
 
         params :
-            - user: discord.Member = A discord member
+            - guild_id: int = The guild id
 
-        return -> bool = True if the user is banned, False else
+        return -> player.DJPlayer = The guild player or None if the bot doesn't play in this guild
         """
 
-        # Get the user real name
-        user_name = utils.get_user_fullname(user)
-
-        # Return if the user is in the banned list
-        return user_name in self.banned_user
+        return self.players.get(guild_id, None)
 
-    def add_song(self, sng: song.Song, feedback=True) -> None:
+    def add_player(
+            self,
+            guild_id: int,
+            req_chan: discord.TextChannel,
+            play_chan_client: discord.VoiceClient
+    ):
         """
-        Add a song to the current queue with size verification adn download it
+        Create the player of a guild and load its previous state
 
         params :
-            - sng: dj_bot.song.Song = A song you want to add to the queue
-        """
-
-        if len(self.song_queue) < self.queue_max_size:
-            sng.ready_func = self.song_is_ready
-            self.song_queue.append(sng)
-            self.youtube_client.download_song(sng)
-            if feedback:
-                self.send_message("**" + sng.user + "** add the song **" + sng.title + "** to the queue  :smile:")
-        else:
-            if feedback:
-                self.send_error_message("Sorry **" + sng.user + "**, but the queue is full  :disappointed_relieved:")
-
-    def song_is_ready(self, sng: song.Song) -> None:
-        """
-        Function to call when a song is downloaded
+            - guild_id: int = The guild id
+            - req_chan: discord.TextChannel = The request channel of the guild
+            - play_chan_client: discord.VoiceClient = The voice client connected to the playing channel
 
-        param :
-            - sng : song.Song = The song that is ready
+        return -> player.DJPlayer = The new player
         """
 
-        if sng.video_id == self.song_queue[0].video_id and self.state == IDLE_STATE:
-            self.current_song = self.song_queue.pop(0)
-            self.play_music()
+        guild_player: player.DJPlayer = player.DJPlayer(self, guild_id, req_chan, play_chan_client)
+        self.players[guild_id] = guild_player
+        guild_player.load()
+        return guild_player
 
-    def next_in_queue(self, _) -> None:
+    def remove_player(self, guild_id: int) -> None:
         """
-        Play the next song in the queue
+        Save and remove the player of a guild if it exists
 
         params :
-            - _ = An unused parameter to avoid errors with the callback
+            - guild_id: int = The guild id
         """
 
-        # Stop the current song to make sure
-        self.discord_client.stop_song()
-        self.current_song = None
-
-        # Play the next song if it exists
-        if len(self.song_queue) > 0 and self.song_queue[0].is_ready:
-            self.current_song = self.song_queue.pop(0)
-            self.discord_client.play_song(self.current_song)
-        else:
-            self.state = IDLE_STATE
-
-    # --- Music manipulation methods
+        guild_player: player.DJPlayer = self.players.pop(guild_id, None)
+        if guild_player is not None:
+            for sng in guild_player.song_queue:
+                self.youtube_client.cancel_download(sng)
+            guild_player.close()
+            self.add_closed_journal(guild_player.journal)
+            self.discord_client.outbox.remove_channel(guild_player.req_chan.id)
 
-    def add_music(self, title: str, user: discord.Member) -> None:
+    def get_song_priority(self, video_id: str) -> int:
         """
-        Method call by the discord client when a user add a music with the !play command
+        Get the download priority of a video according to its best position in the guild queues
 
         params :
-            - title: str = The title of the music to add
-        """
-
-        # Get the song dict by calling the youtube client
-        song_dict: dict = self.youtube_client.get_first_video(title)
-
-        # Create and add the song instance
-        sng: song.Song = song.Song(song_dict["title"], song_dict["id"], song_dict["duration"], user.display_name)
-        self.add_song(sng)
+            - video_id: str = The video id
 
-    def choose_search(self, choose_id: str, user: discord.Member) -> None:
+        return -> int = The position of the first song with this video, the lowest is downloaded first
         """
-        Choose a search result after an user made a search
 
-        params :
-            - choose_id: str = The id of the search option
-            - user: discord.Member = The user who made the choice
-        """
-
-        # Get the user search list or None
-        user_name = utils.get_user_fullname(user)
-        user_search = self.user_search.get(user_name, None)
-
-        # If the user made a research provide a result, else send an error message
-        if user_search is not None:
-            if choose_id != "":
-                try:
-                    # Get the correct song dict and create the song instance
-                    song_dict: dict = user_search[int(choose_id) - 1]
-                    sng: song.Song = song.Song(song_dict["title"], song_dict["id"], song_dict["duration"], user.display_name)
-                    self.add_song(sng)
-
-                    # Erase the user search
-                    self.user_search[user_name] = None
-                except ValueError as _:
-                    self.send_message("Id must be an integer  :angry:")
-                except IndexError as _:
-                    self.send_message("Choose an id between 1 and " + str(len(user_search)) + " (you stupid)")
-            else:
-                self.send_message("Choose an id between 1 and " + str(len(user_search)) + " (you stupid)")
-        else:
-            self.send_message("Perform a **_!search_** before choosing an id  :slight_smile:")
+        return min((p.get_song_priority(video_id) for p in list(self.players.values())), default=0)
 
-    def play_music(self) -> None:
-        """
-        Start the music playing if it's not the case
+    def get_needed_video_ids(self) -> set:
         """
+        Get the video ids of the songs that are playing or queued in any guild, their files must stay in the cache
 
-        if self.state != PLAY_STATE:
-            self.state = PLAY_STATE
-            self.discord_client.play_song(self.current_song)
-
-    def skip_music(self):
-        """
-        Skip the current playing music
+        return -> set = The needed video ids
         """
 
-        self.discord_client.stop_song()
+        needed: set = set()
+        for guild_player in list(self.players.values()):
+            needed.update(guild_player.get_needed_video_ids())
+        return needed
 
-    def pause_music(self) -> None:
-        """
-        Pause the music playing
+    def first_audio_frame(self, sng: song.Song, frame_time: float) -> None:
         """
+        Function to call when the first audio frame of a song is sent, it records the time since the request
 
-        if self.state == PLAY_STATE:
-            self.state = PAUSE_STATE
-            self.discord_client.pause_song()
-
-    def resume_music(self) -> None:
-        """
-        Resume the previously playing music
+        params :
+            - sng: song.Song = The playing song
+            - frame_time: float = The time.monotonic() of the first frame
         """
 
-        if self.state == PAUSE_STATE:
-            self.state = PLAY_STATE
-            self.discord_client.resume_song()
+        if sng.request_time is not None:
+            delay: float = frame_time - sng.request_time
+            sng.request_time = None
+            self.first_audio_delays.append(delay)
+            logging.getLogger(LOGGER_NAME).info(
+                "First audio frame of " + sng.video_id + " after " + "{:.2f}".format(delay) + "s")
 
-    def pop_queue(self, song_index: str):
+    def get_first_audio_stats(self) -> dict:
         """
-        Remove a song from the queue
+        Get the statistics of the time from a song request to its first audio frame
 
-        params :
-            - song_index: str = The song index you want to remove
+        return -> dict = The number of measures, the average and maximum delays in seconds
         """
 
-        # Try to remove the wanted item and catch exceptions
-        try:
-            song_id = int(song_index) - 1
-            if 0 <= song_id < len(self.song_queue):
-                removed = self.song_queue.pop(song_id)
-                self.send_message("Song **" + removed.title + "** is removed from the queue")
-            else:
-                self.send_message("Choose an id between 1 and " + str(len(self.song_queue)) + " (you stupid)")
-        except ValueError as _:
-            self.send_message("Choose an id between 1 and " + str(len(self.song_queue)) + " (you stupid)")
+        delays: list = list(self.first_audio_delays)
+        if len(delays) == 0:
+            return {"count": 0, "average": None, "max": None}
+        return {"count": len(delays), "average": sum(delays) / len(delays), "max": max(delays)}
 
-    def empty_queue(self, user: discord.Member) -> None:
+    async def save_position_loop(self) -> None:
         """
-        Empty the current music queue
-
-        params :
-            - user: discord.Member = The user who made the request
+        Save the position of the current song of each guild regularly to resume it after a restart
         """
 
-        # Verify that the user is an admin
-        if self.is_admin(user):
-            self.song_queue.clear()
-            self.send_message("Queue has been cleaned  :thumbsup:")
-        else:
-            self.send_message("You are not an admin  :middle_finger:")
+        while not self.discord_client.is_closed():
+            await asyncio.sleep(self.position_save_interval)
+            for guild_player in list(self.players.values()):
+                if guild_player.state == player.PLAY_STATE:
+                    guild_player.save_position()
 
     # --- Interaction methods
 
-    def show_help(self) -> None:
+    def show_help(self, guild_player) -> None:
         """
         Send a message to help users understand commands
+
+        params :
+            - guild_player: player.DJPlayer = The player of the guild that asked for help
         """
 
         # Prepare the help message
@@ -284,9 +282,11 @@ class DJBot:
         help_message += "```\n"
         help_message += "!help (!h) : Display this help message\n"
         help_message += "!play (!pl) <SONG> : Add the song to the playing queue\n"
+        help_message += "!playlist (!pli) <URL> : Add the songs of the youtube playlist to the playing queue\n"
         help_message += "!skip (!sk) : Skip the current song\n"
         help_message += "!pause (!pa) : Pause my music playing\n"
         help_message += "!resume (!re) : Resume the previously paused music\n"
+        help_message += "!seek <POSITION> : Jump to the position (mm:ss) in the current song\n"
         help_message += "!search (!se) <SONG> : List songs on youtube\n"
         help_message += "!choose (!ch) <ID> : Choose a search result\n"
         help_message += "!current (!cu) : Display the current song\n"
@@ -297,266 +297,174 @@ class DJBot:
         help_message += "!shame : Show the list banned users (Admin)\n"
         help_message += "!empty-queue : Empty the music queue (Admin)\n"
         help_message += "!clean-cache : Clean the song cache (Admin)\n"
+        help_message += "!cache-stats : Show the cache usage (Admin)\n"
+        help_message += "!quota : Show the Youtube quota spent today (Admin)\n"
         help_message += "!shutdown : Stop me (Admin)\n"
         help_message += "```"
 
         # Send the help message
-        self.send_message(help_message)
-
-    def show_current(self) -> None:
-        """
-        Show the music that is currently playing if exists
-        """
-
-        if self.current_song is not None:
-            self.send_message("Current song is :```" + self.current_song.title + "```")
-        else:
-            self.send_message("There is no current song...")
-
-    def show_queue(self) -> None:
-        """
-        Send a message with the current queue
-        """
-
-        # Prepare the queue message
-        queue_message: str
-
-        if len(self.song_queue) > 0:
-            queue_message = "Current queue :\n"
-            queue_message += "```\n"
-
-            # Iterate over the queue
-            for i in range(len(self.song_queue)):
-                queue_message += str(i + 1) + ". " + str(self.song_queue[i]) + "\n"
-
-            queue_message += "```"
-        else:
-            queue_message = "Current queue is empty..."
-
-        # Send the queue message
-        self.send_message(queue_message)
+        guild_player.send_message(help_message)
 
-    def show_search(self, search_q: str, user: discord.Member) -> None:
+    def show_cache_stats(self, guild_player, user: discord.Member) -> None:
         """
-        Send a message with the result of the research for a keyword
+        Show the usage of the song and search caches
 
         params :
-            - search_q: str = The search keyword
-            - user: discord.Member = The user who made the research
+            - guild_player: player.DJPlayer = The player of the guild where the request was made
+            - user: discord.Member = The user who made the request
         """
 
-        # Get the search result from the client
-        search_result: list = self.youtube_client.search_videos(search_q, self.max_result)
-
-        # Store the user search
-        user_name = user.name + "#" + user.discriminator
-        self.user_search[user_name] = search_result
-
-        # Create the search message
-        search_message: str = user.display_name + " here is the result for \"" + search_q + "\" :\n"
-        search_message += "```\n"
-        for i in range(len(search_result)):
-            search_message += str(i + 1) + ". "
-            search_message += search_result[i]["title"] + " - " + search_result[i]["channel_title"]
-            search_message += " [" + search_result[i]["duration"] + "]\n"
-        search_message += "```"
-        search_message += "Type `!choose <ID>` to add a song to the queue"
+        # Verify that the user is an admin
+        if not self.is_admin(user):
+            guild_player.send_message("You are not an admin  :middle_finger:")
+            return
+
+        song_stats: dict = self.youtube_client.cache_manager.stats()
+        search_stats: dict = self.youtube_client.get_cache_stats()
+        audio_stats: dict = self.get_first_audio_stats()
+        jitter_stats: dict = self.jitter_meter.stats()
+        outbox_stats: dict = self.discord_client.outbox.stats()
+
+        # Create the stats message
+        stats_message: str = "Cache usage :"
+        stats_message += "```\n"
+        stats_message += "Songs : " + str(song_stats["files"]) + "/" + str(song_stats["max_files"]) + " files, "
+        stats_message += str(song_stats["size"] // (1024 * 1024)) + "/" + str(song_stats["max_size"] // (1024 * 1024))
+        stats_message += " MB, " + str(song_stats["evictions"]) + " evictions ("
+        stats_message += str(song_stats["evicted_bytes"] // (1024 * 1024)) + " MB)\n"
+        for name in ("search", "video"):
+            stats_message += name.capitalize() + " cache : " + str(search_stats[name]["size"]) + " entries, "
+            stats_message += str(search_stats[name]["hits"]) + " hits, " + str(search_stats[name]["misses"])
+            stats_message += " misses\n"
+        stats_message += "Video lookups : " + str(search_stats["video_batch"]["keys"]) + " videos in "
+        stats_message += str(search_stats["video_batch"]["requests"]) + " requests\n"
+        if audio_stats["count"] > 0:
+            stats_message += "First audio : " + "{:.2f}".format(audio_stats["average"]) + "s average, "
+            stats_message += "{:.2f}".format(audio_stats["max"]) + "s max\n"
+        if jitter_stats["count"] > 0:
+            stats_message += "Voice jitter : " + "{:.2f}".format(jitter_stats["average"]) + "ms average, "
+            stats_message += "{:.2f}".format(jitter_stats["max"]) + "ms max, " + str(jitter_stats["late"])
+            stats_message += " late frames\n"
+        stats_message += "Messages : " + str(outbox_stats["queued"]) + " queued, " + str(outbox_stats["sent"])
+        stats_message += " notices in " + str(outbox_stats["messages"]) + " messages"
+        if outbox_stats["average"] is not None:
+            stats_message += ", " + "{:.0f}".format(outbox_stats["average"] * 1000) + "ms average latency, "
+            stats_message += "{:.0f}".format(outbox_stats["max"] * 1000) + "ms max"
+        stats_message += "\n"
+        stats_message += "Search sessions : " + str(len(self.search_sessions)) + "\n"
+        stats_message += "Guilds : " + str(len(self.players)) + "\n"
+        stats_message += "```"
 
         # Send the message
-        self.send_message(search_message)
+        guild_player.send_message(stats_message)
 
-    def show_banned(self, user: discord.Member) -> None:
+    def show_quota(self, guild_player, user: discord.Member) -> None:
         """
-        Show all banned members
+        Show the Youtube API units spent today by call type
 
         params :
+            - guild_player: player.DJPlayer = The player of the guild where the request was made
             - user: discord.Member = The user who made the request
         """
 
-        # Create the shame list
-        shame_list = "Current banned users are :"
-        shame_list += "```\n"
-        for ban in self.banned_user:
-            shame_list += ban
-        shame_list += "```"
+        # Verify that the user is an admin
+        if not self.is_admin(user):
+            guild_player.send_message("You are not an admin  :middle_finger:")
+            return
+
+        quota_stats: dict = self.youtube_client.get_quota_stats()
+
+        # Create the quota message
+        quota_message: str = "Youtube quota :"
+        quota_message += "```\n"
+        quota_message += "Spent : " + str(quota_stats["spent"]) + "/" + str(quota_stats["budget"]) + " units\n"
+        for call_type, units in sorted(quota_stats["units"].items()):
+            quota_message += call_type + " : " + str(units) + " units, "
+            quota_message += str(quota_stats["calls"].get(call_type, 0)) + " calls\n"
+        quota_message += "Reset in : " + utils.format_seconds(quota_stats["reset"]) + "\n"
+        quota_message += "```"
 
         # Send the message
-        self.send_message(shame_list)
-
-    def send_message(self, message: str) -> None:
-        """
-        Send a message to the listened channel
-
-        params :
-            - message: str = The message you want to send
-        """
-
-        self.discord_client.send_message(message)
-
-    def send_error_message(self, error: str) -> None:
-        """
-        Send an error message to the listened channel
-
-        params :
-            - error: str = The error message to send
-        """
-
-        # Format and send the message
-        final_message = "**ERROR** : " + error
-        self.send_message(final_message)
+        guild_player.send_message(quota_message)
 
     # --- Bot control methods
 
     def save(self) -> None:
         """
-        Save the current bot state in a file to load it the next time
+        Save the state of every guild player
         """
 
-        # Create the export dict
-        res_dict: dict = {
-            "current": None,
-            "queue": list(),
-            "banned": self.banned_user
-        }
-
-        # Create the current song string
-        if self.current_song is not None:
-            res_dict["current"] = self.current_song.serialize()
-
-        # Fill the queue in the export dict
-        for sng in self.song_queue:
-            res_dict["queue"].append(sng.serialize())
-
-        # Open the save file
-        save_file = open(SAVE_FILE, mode="w")
-        save_file.write(json.dumps(res_dict))
-        save_file.close()
+        for guild_player in list(self.players.values()):
+            guild_player.save()
 
-    def load(self) -> None:
+    async def clean_song_cache(self, guild_player, user: discord.Member) -> None:
         """
-        Load the bot state from the save file
-        """
-
-        # Open and read the save file
-        try:
-            save_file = open(SAVE_FILE, mode="r")
-            save_dict = json.loads(save_file.read())
-            save_file.close()
-
-            # Reload the current song
-            if save_dict["current"] is not None:
-                self.add_song(song.Song.deserialize(save_dict["current"]), False)
-
-            # Reload the queue
-            for sng_str in save_dict["queue"]:
-                self.add_song(song.Song.deserialize(sng_str), False)
-
-            # Reload the banned users
-            self.banned_user = save_dict["banned"]
-        except FileNotFoundError as _:
-            logging.getLogger(LOGGER_NAME).info("Save file not found, one will be created")
-
-    def clean_song_files(self) -> None:
-        """
-        Erase all song files except those that are needed
-        """
-
-        for filename, dirs, files in os.walk(DOWNLOAD_DIR):
-            for file in files:
-                rm = True
-                for sng in self.song_queue:
-                    if sng.video_id + ".mp4" == file:
-                        rm = False
-                if self.current_song is not None:
-                    if self.current_song.video_id + ".mp4" == file:
-                        rm = False
-                if rm:
-                    os.remove(DOWNLOAD_DIR + file)
-
-    def clean_song_cache(self, user: discord.Member) -> None:
-        """
-        Clean the current song cache
+        Clean the current song cache, the songs needed by the players of every process are kept
 
         params :
+            - guild_player: player.DJPlayer = The player of the guild where the request was made
             - user: discord.Member = The user who made the request
         """
 
         # Verify that the user is an admin
         if self.is_admin(user):
-            try:
-                os.remove(CACHE_FILE)
-            except FileNotFoundError as _:
-                pass
-            self.clean_song_files()
-            self.send_message("Song cache has been cleaned  :thumbsup:")
+            removed_count: int = await self.youtube_client.clean_song_cache()
+            guild_player.send_message(
+                "Song cache has been cleaned, " + str(removed_count) + " file(s) removed  :thumbsup:")
         else:
-            self.send_message("You are not an admin  :middle_finger:")
+            guild_player.send_message("You are not an admin  :middle_finger:")
 
-    def ban_user(self, user_name: str, user: discord.Member) -> None:
+    def start(self) -> None:
         """
-        Exclude an user from the bot utilisation by its display name
-
-        params :
-            - user_name: str = The user name to ban from the bot
-            - user: discord.Member = The user who made the request
+        Start the bot
         """
 
-        # Verify the user is an admin
-        if self.is_admin(user):
-            # Verify the user doesn't auto-ban
-            if user_name != utils.get_user_fullname(user):
-                # Add the user to the banned list
-                self.banned_user.append(user_name)
-                self.send_message("**" + user_name + "**, I sentence you to jaz... to BAN !!!")
-            else:
-                self.send_message("You cannot auto-ban you stupid !")
-        else:
-            self.send_message("You are not an admin  :middle_finger:")
+        self.youtube_client.migrate_song_files()
+        self.discord_client.run(self.discord_token)
 
-    def unban_user(self, user_name: str, user: discord.Member):
-        """
-        Remove an user from the exclusion list
+        # Let the journals of the closed players write their last mutations
+        for closed_journal in self.closed_journals:
+            closed_journal.wait_closed(10)
 
-        params :
-            - user_name: str = The user name to unban
-            - user: discord.Member = The user who made the request
+    def add_closed_journal(self, closed_journal) -> None:
         """
+        Keep the journal of a closed player until its writer thread is done
 
-        # Verify the user is an admin
-        if self.is_admin(user):
-            # Search the user real name in the server
-            self.banned_user = list(filter(lambda a: a != user_name, self.banned_user))
-            self.send_message("**" + user_name + "** was not an Impostor")
-        else:
-            self.send_message("You are not an admin  :middle_finger:")
-
-    def start(self) -> None:
-        """
-        Start the bot
+        params :
+            - closed_journal: journal.StateJournal = The closed journal
         """
 
-        self.discord_client.run(self.discord_token)
+        self.closed_journals = [j for j in self.closed_journals if j.writer is not None and j.writer.is_alive()]
+        self.closed_journals.append(closed_journal)
 
-    def shutdown(self, user: discord.Member) -> None:
+    def shutdown(self, guild_player, user: discord.Member) -> None:
         """
         Method called by the discord client to shutdown the bot
 
         params :
+            - guild_player: player.DJPlayer = The player of the guild where the request was made
             - user: discord.Member = The user who made the request
         """
 
         # Verify that the user is an admin
         if self.is_admin(user):
-            self.save()
             self.stop()
         else:
-            self.send_message("You are not an admin  :middle_finger:")
+            guild_player.send_message("You are not an admin  :middle_finger:")
 
     def stop(self) -> None:
         """
         Stop the bot
         """
 
-        self.discord_client.disconnect()
+        # Save and disconnect every player
+        for guild_player in list(self.players.values()):
+            guild_player.close()
+            self.add_closed_journal(guild_player.journal)
+        self.players.clear()
+
+        self.source_executor.shutdown(wait=False)
+        self.youtube_client.close()
+        logging.getLogger(LOGGER_NAME).info("Voice jitter stats : " + str(self.jitter_meter.stats()))
         self.discord_client.loop.create_task(self.discord_client.logout())
         self.discord_client.loop.create_task(self.discord_client.close())
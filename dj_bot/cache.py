@@ -0,0 +1,205 @@
+from dj_bot import LOGGER_NAME
+
+import collections
+import threading
+import logging
+import json
+import time
+import os
+
+
+class TTLCache:
+    """
+    TTLCache class.
+
+    This class is a bounded and thread safe cache, entries expire after a time to live and the least recently
+    used entries are evicted when the cache is full
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, max_size: int, ttl: float, persist_file: str = None):
+        """
+        Create a new empty cache
+
+        params :
+            - max_size: int = The maximum number of entries
+            - ttl: float = The time to live of an entry in seconds
+            - persist_file: str = The file to save the cache in, None to keep it in memory only
+        """
+
+        # Assign the attributes
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.persist_file: str = persist_file
+
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    # ----- Class methods -----
+
+    def get(self, key: str, default=None):
+        """
+        Get a value from the cache and mark it as recently used
+
+        params :
+            - key: str = The entry key
+            - default = The value to return if the key is absent or expired
+
+        return -> The cached value or the default one
+        """
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+
+            # Verify the entry exists and is still alive
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] < time.time():
+                del self.entries[key]
+                self.misses += 1
+                return default
+
+            # Mark the entry as recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value) -> None:
+        """
+        Put a value in the cache and evict the least recently used entries if needed
+
+        params :
+            - key: str = The entry key
+            - value = The value to store, it must be json serializable to be persisted
+        """
+
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            # Evict the oldest entries
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key: str) -> None:
+        """
+        Remove an entry from the cache if it exists
+
+        params :
+            - key: str = The entry key
+        """
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def items(self) -> list:
+        """
+        Get the alive entries without marking them as used
+
+        return -> list = The (key, value) tuples in the least to most recently used order
+        """
+
+        now: float = time.time()
+        with self.lock:
+            return [(key, entry[1]) for key, entry in self.entries.items() if entry[0] >= now]
+
+    def purge(self) -> int:
+        """
+        Remove the expired entries
+
+        return -> int = The number of removed entries
+        """
+
+        now: float = time.time()
+        with self.lock:
+            expired: list = [key for key, entry in self.entries.items() if entry[0] < now]
+            for key in expired:
+                del self.entries[key]
+            return len(expired)
+
+    def clear(self) -> None:
+        """
+        Remove all entries of the cache
+        """
+
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the cache usage counters
+
+        return -> dict = The counters of the cache
+        """
+
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __len__(self) -> int:
+        """
+        Get the number of entries in the cache, expired ones included
+
+        return -> int = The number of entries
+        """
+
+        return len(self.entries)
+
+    # ----- Persistence -----
+
+    def save(self) -> None:
+        """
+        Write the alive entries in the persist file if there is one
+        """
+
+        if self.persist_file is None:
+            return
+
+        # Copy the alive entries
+        now: float = time.time()
+        with self.lock:
+            entry_list: list = [[key, entry[0], entry[1]] for key, entry in self.entries.items() if entry[0] >= now]
+
+        # Write in a temporary file and replace the old one to never leave a broken cache, the temporary file is
+        # unique to the process because the bot processes share the persist file
+        tmp_file: str = self.persist_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, mode="w") as cache_file:
+            cache_file.write(json.dumps(entry_list))
+        os.replace(tmp_file, self.persist_file)
+
+    def load(self) -> None:
+        """
+        Load the alive entries from the persist file if there is one
+        """
+
+        if self.persist_file is None:
+            return
+
+        try:
+            with open(self.persist_file, mode="r") as cache_file:
+                entry_list: list = json.loads(cache_file.read())
+        except FileNotFoundError as _:
+            return
+        except ValueError as _:
+            logging.getLogger(LOGGER_NAME).warning("Cache file " + self.persist_file + " is corrupted, ignore it")
+            return
+
+        # Restore the entries in the least to most recently used order
+        now: float = time.time()
+        with self.lock:
+            for key, expire, value in entry_list:
+                if expire >= now:
+                    self.entries[key] = (expire, value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
@@ -1,158 +1,220 @@
-from dj_bot import bot, command, song, utils
-from dj_bot import LOGGER_NAME, DOWNLOAD_DIR, CACHE_FILE
+from dj_bot import audio, batch, bot, cache, command, download, index, lock, outbox, player, quota, song, utils
+from dj_bot import LOGGER_NAME, DOWNLOAD_DIR, CACHE_FILE, INDEX_FILE, QUOTA_FILE, SEARCH_CACHE_FILE, VIDEO_CACHE_FILE
 
 import discord
 import googleapiclient.discovery
-import youtube_dl as yt
+import googleapiclient.errors
+import httplib2
+import concurrent.futures
+import functools
+import asyncio
 import logging
 import threading
 import html
+import os
 
 
-class DJDiscordClient(discord.Client):
+class DJDiscordClient(discord.AutoShardedClient):
     """
     DJDiscordClient class.
 
-    This class is the custom discord client for the DJ Bot, it handles all interactions with discord
+    This class is the custom discord client for the DJ Bot, it handles all interactions with discord and routes
+    the messages to the player of their guild, its guilds are spread over one or several shards
     """
 
     # ----- Constructor -----
 
-    def __init__(self, dj_bot, request_channel: str, playing_channel: str, remove_req: bool):
+    def __init__(
+            self,
+            dj_bot,
+            request_channel: str,
+            playing_channel: str,
+            remove_req: bool,
+            shard_ids: list = None,
+            shard_count: int = None,
+            user_command_burst: float = 5,
+            user_command_rate: float = 1,
+            guild_task_limit: int = 4
+    ):
         """
-        Create a new discord client with the request and the playing channel
+        Create a new discord client with the request and the playing channel names
 
         params :
             - dj_bot: dj_bot.DJBot = The bot that contains the client
-            - request_channel: str = The request channel name
-            - playing_channel: str = The playing channel name
+            - request_channel: str = The request channel name in each guild
+            - playing_channel: str = The playing channel name in each guild
+            - shard_ids: list = The shards run by the client, None to run all shards
+            - shard_count: int = The total number of shards, None to use the count recommended by discord
+            - user_command_burst: float = The number of command tokens a user can spend at once
+            - user_command_rate: float = The number of command tokens a user earns per second
+            - guild_task_limit: int = The number of command tasks running at once in a guild
         """
 
         # Call the super constructor
-        super().__init__()
+        super().__init__(shard_ids=shard_ids, shard_count=shard_count)
 
         # Assign attributes
         self.dj_bot: bot.DJBot = dj_bot
         self.req_chan_name: str = request_channel
         self.play_chan_name: str = playing_channel
         self.remove_req: bool = remove_req
-        self.req_chan: discord.TextChannel = None
-        self.play_chan: discord.VoiceChannel = None
-        self.play_chan_client: discord.VoiceClient = None
+        self.position_task: asyncio.Task = None
+        self.session_task: asyncio.Task = None
+        self.outbox: outbox.MessageOutbox = outbox.MessageOutbox(self.loop)
+        self.guild_task_limit: int = guild_task_limit
+        self.guild_semaphores: dict = dict()
+
+        # Create the command registry
+        self.router: command.CommandRouter = command.CommandRouter(user_command_burst, user_command_rate)
+        self.register_commands()
 
     # ----- Class methods -----
 
-    def process_command(self, message: discord.Message) -> None:
+    def register_commands(self) -> None:
+        """
+        Fill the command registry, the commands calling the Youtube API cost more and are limited for all users
+        """
+
+        reg = self.router.register
+        reg("!help", lambda m, p, a: self.dj_bot.show_help(p), ("!h",))
+        reg("!play", lambda m, p, a: p.add_music(a, m.author), ("!pl",), cost=2, burst=10, rate=2)
+        reg("!playlist", lambda m, p, a: p.add_playlist(a, m.author), ("!pli",), cost=3, burst=5, rate=0.2)
+        reg("!skip", lambda m, p, a: p.skip_music(), ("!sk",))
+        reg("!pause", lambda m, p, a: p.pause_music(), ("!pa",))
+        reg("!resume", lambda m, p, a: p.resume_music(), ("!re",))
+        reg("!seek", lambda m, p, a: p.seek_music(a))
+        reg("!current", lambda m, p, a: p.show_current(), ("!cu",))
+        reg("!queue", lambda m, p, a: p.show_queue(), ("!qu",))
+        reg("!pop", lambda m, p, a: p.pop_queue(a))
+        reg("!search", lambda m, p, a: p.show_search(a, m.author), ("!se",), cost=3, burst=5, rate=0.5)
+        reg("!choose", lambda m, p, a: p.choose_search(a, m.author), ("!ch",))
+        reg("!ban", lambda m, p, a: p.ban_user(a, m.author), admin=True)
+        reg("!unban", lambda m, p, a: p.unban_user(a, m.author), admin=True)
+        reg("!shame", lambda m, p, a: p.show_banned(m.author))
+        reg("!empty-queue", lambda m, p, a: p.empty_queue(m.author), admin=True)
+        reg("!clean-cache", lambda m, p, a: self.dj_bot.clean_song_cache(p, m.author), admin=True)
+        reg("!cache-stats", lambda m, p, a: self.dj_bot.show_cache_stats(p, m.author), admin=True)
+        reg("!quota", lambda m, p, a: self.dj_bot.show_quota(p, m.author), admin=True)
+        reg("!shutdown", lambda m, p, a: self.dj_bot.shutdown(p, m.author), admin=True)
+
+    def process_command(self, message: discord.Message, guild_player) -> None:
         """
-        Extract and process a command from a discord message
+        Extract a command from a discord message and run it if its user and the command are not rate limited,
+        the coroutine handlers run as tasks so a slow command doesn't delay the others
 
         params :
             - message: discord.Message = The message to process
+            - guild_player: player.DJPlayer = The player of the message guild
         """
 
         # Extract the command from the message
         com: command.Command = command.Command(message.content)
-
-        # Handle every command
-        if com.name == "!help" or com.name == "!h":
-            self.dj_bot.show_help()
-        elif com.name == "!play" or com.name == "!pl":
-            self.dj_bot.add_music(com.arg, message.author)
-        elif com.name == "!skip" or com.name == "!sk":
-            self.dj_bot.skip_music()
-        elif com.name == "!pause" or com.name == "!pa":
-            self.dj_bot.pause_music()
-        elif com.name == "!resume" or com.name == "!re":
-            self.dj_bot.resume_music()
-        elif com.name == "!current" or com.name == "!cu":
-            self.dj_bot.show_current()
-        elif com.name == "!queue" or com.name == "!qu":
-            self.dj_bot.show_queue()
-        elif com.name == "!pop":
-            self.dj_bot.pop_queue(com.arg)
-        elif com.name == "!search" or com.name == "!se":
-            self.dj_bot.show_search(com.arg, message.author)
-        elif com.name == "!choose" or com.name == "!ch":
-            self.dj_bot.choose_search(com.arg, message.author)
-        elif com.name == "!ban":
-            self.dj_bot.ban_user(com.arg, message.author)
-        elif com.name == "!unban":
-            self.dj_bot.unban_user(com.arg, message.author)
-        elif com.name == "!shame":
-            self.dj_bot.show_banned(message.author)
-        elif com.name == "!empty-queue":
-            self.dj_bot.empty_queue(message.author)
-        elif com.name == "!clean-cache":
-            self.dj_bot.clean_song_cache(message.author)
-        elif com.name == "!shutdown":
-            self.dj_bot.shutdown(message.author)
+        if com.name == "":
+            return
 
         # Remove the request message to keep the board clean
-        if com.name != "!shutdown" and com.name != "" and self.remove_req:
-            try:
-                self.loop.create_task(message.delete())
-            except discord.Forbidden as _:
-                logging.getLogger(LOGGER_NAME).warning(
-                    "Cannot remove message from the listening channel : Forbidden")
-            except discord.NotFound as _:
-                pass
-            except discord.HTTPException as _:
-                logging.getLogger(LOGGER_NAME).warning(
-                    "Cannot remove message from the listening channel : HTTPError")
-
-    def send_message(self, message: str) -> None:
+        if com.name != "!shutdown" and self.remove_req:
+            self.outbox.delete(message)
+
+        spec: command.CommandSpec = self.router.get_command(com.name)
+        if spec is None:
+            return
+
+        # Verify the admin commands before spending the user tokens
+        if spec.admin and not self.dj_bot.is_admin(message.author):
+            guild_player.send_message("You are not an admin  :middle_finger:")
+            return
+
+        # Verify the rate limits and warn the user once until the command is allowed again
+        refused: command.TokenBucket = self.router.acquire(spec, utils.get_user_fullname(message.author))
+        if refused is not None:
+            if not refused.warned:
+                refused.warned = True
+                guild_player.send_message("Slow down **" + message.author.display_name + "**  :hourglass:")
+            return
+
+        # Run the command
+        result = spec.handler(message, guild_player, com.arg)
+        if asyncio.iscoroutine(result):
+            self.run_task(self.run_guild_command(guild_player.guild_id, result))
+
+    async def run_guild_command(self, guild_id: int, coro) -> None:
         """
-        Send a simple message
+        Run a command coroutine when the guild has less running commands than the limit
 
         params :
-            - message: str = The message to send
+            - guild_id: int = The guild of the command
+            - coro: coroutine = The command coroutine
         """
 
-        # Create a new sending message task
-        self.loop.create_task(self.req_chan.send(content=message))
+        semaphore: asyncio.Semaphore = self.guild_semaphores.get(guild_id, None)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.guild_task_limit)
+            self.guild_semaphores[guild_id] = semaphore
+        async with semaphore:
+            await coro
 
-    def play_song(self, sng: song.Song):
+    def run_task(self, coro) -> asyncio.Task:
         """
-        Start playing the wanted song
+        Run a command coroutine as an independent task and log its failure
 
         params :
-            - sng: song.Song = The song you want to play
+            - coro: coroutine = The coroutine to run
+
+        return -> asyncio.Task = The created task
         """
 
-        self.play_chan_client.play(sng.get_audio_source(), after=self.dj_bot.next_in_queue)
+        # Create the task and attach the error logger
+        task: asyncio.Task = self.loop.create_task(coro)
+        task.add_done_callback(self.log_task_error)
+        return task
 
-    def stop_song(self):
+    def log_task_error(self, task: asyncio.Task) -> None:
         """
-        Stop the current song and clear the audio source
+        Log the exception raised by a finished command task if there is one
+
+        params :
+            - task: asyncio.Task = The finished task
         """
 
-        if self.play_chan_client.is_playing() or self.play_chan_client.is_paused():
-            self.play_chan_client.stop()
+        if not task.cancelled() and task.exception() is not None:
+            logging.getLogger(LOGGER_NAME).error("Command task failed", exc_info=task.exception())
 
-    def pause_song(self):
+    def send_message(self, channel: discord.TextChannel, message: str) -> None:
         """
-        Pause the current song
+        Send a simple message through the channel outbox
+
+        params :
+            - channel: discord.TextChannel = The channel to send the message in
+            - message: str = The message to send
         """
 
-        if self.play_chan_client.is_playing():
-            self.play_chan_client.pause()
+        self.outbox.send(channel, message)
 
-    def resume_song(self):
+    async def setup_guild(self, guild: discord.Guild) -> None:
         """
-        Resume the current song
+        Connect to the playing channel of a guild and create its player
+
+        params :
+            - guild: discord.Guild = The guild to play in
         """
 
-        if self.play_chan_client.is_paused():
-            self.play_chan_client.resume()
+        if self.dj_bot.get_player(guild.id) is not None:
+            return
 
-    def disconnect(self):
-        """
-        Disconnect the bot from the discord server
-        """
+        # Get the request and the playing channels of the guild
+        req_chan: discord.TextChannel = discord.utils.get(guild.text_channels, name=self.req_chan_name)
+        play_chan: discord.VoiceChannel = discord.utils.get(guild.voice_channels, name=self.play_chan_name)
+        if req_chan is None or play_chan is None:
+            logging.getLogger(LOGGER_NAME).info(
+                "Ignore the guild " + guild.name + " : no " + self.req_chan_name + " or " + self.play_chan_name +
+                " channel")
+            return
 
-        self.stop_song()
-        self.play_chan_client.cleanup()
-        self.loop.create_task(self.play_chan_client.disconnect())
+        # Connect to the playing channel and create the player
+        play_chan_client: discord.VoiceClient = await play_chan.connect()
+        self.dj_bot.add_player(guild.id, req_chan, play_chan_client)
+        logging.getLogger(LOGGER_NAME).info("Listen to " + self.req_chan_name + " in the guild " + guild.name)
 
     # ------ Handling methods -----
 
@@ -161,18 +223,44 @@ class DJDiscordClient(discord.Client):
         Function called when the bot is ready to listen
         """
 
-        # Get the request channel
-        self.req_chan = discord.utils.get(self.get_all_channels(), name=self.req_chan_name)
-
-        # Get the playing channel and connect to it
-        self.play_chan = discord.utils.get(self.get_all_channels(), name=self.play_chan_name)
-        self.play_chan_client = await self.play_chan.connect()
+        # Create the player of each guild
+        for guild in self.guilds:
+            try:
+                await self.setup_guild(guild)
+            except (discord.ClientException, asyncio.TimeoutError) as e:
+                logging.getLogger(LOGGER_NAME).error("Cannot join the guild " + guild.name + " : " + str(e))
 
         # Log the bot state
-        logging.getLogger(LOGGER_NAME).info("DJ Bot is started and ready, listen to " + self.req_chan_name)
+        logging.getLogger(LOGGER_NAME).info(
+            "DJ Bot is started and ready, playing in " + str(len(self.dj_bot.players)) + " guild(s)")
+
+        # Save the playing positions and expire the search sessions regularly, on_ready is called again after
+        # a reconnection
+        if self.position_task is None:
+            self.position_task = self.loop.create_task(self.dj_bot.save_position_loop())
+        if self.session_task is None:
+            self.session_task = self.loop.create_task(self.dj_bot.search_sessions.purge_loop())
 
-        # Load the previous bot state
-        self.dj_bot.load()
+    async def on_guild_join(self, guild: discord.Guild) -> None:
+        """
+        Function called when the bot joins a new guild
+
+        params :
+            - guild: discord.Guild = The joined guild
+        """
+
+        await self.setup_guild(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        """
+        Function called when the bot leaves a guild
+
+        params :
+            - guild: discord.Guild = The left guild
+        """
+
+        self.dj_bot.remove_player(guild.id)
+        self.guild_semaphores.pop(guild.id, None)
 
     async def on_message(self, message: discord.Message) -> None:
         """
@@ -182,9 +270,16 @@ class DJDiscordClient(discord.Client):
             - message: discord.Message = The new message
         """
 
+        # Get the player of the message guild, direct messages are ignored
+        if message.guild is None:
+            return
+        guild_player: player.DJPlayer = self.dj_bot.get_player(message.guild.id)
+        if guild_player is None:
+            return
+
         # Verify the message channel and the user banning state
-        if message.channel.name == self.req_chan_name and not self.dj_bot.is_banned(message.author):
-            self.process_command(message)
+        if message.channel.id == guild_player.req_chan.id and not guild_player.is_banned(message.author):
+            self.process_command(message, guild_player)
 
 
 class DJYoutubeClient:
@@ -196,43 +291,255 @@ class DJYoutubeClient:
 
     # ----- Constructor -----
 
-    def __init__(self, dj_bot, youtube_token: str):
+    def __init__(
+            self,
+            dj_bot,
+            youtube_token: str,
+            search_workers: int = 4,
+            search_cache_size: int = 512,
+            search_cache_ttl: float = 86400,
+            video_cache_size: int = 4096,
+            video_cache_ttl: float = 604800,
+            persist_cache: bool = True,
+            download_workers: int = 2,
+            download_timeout: float = 600,
+            opus_bitrate: int = 96,
+            cache_max_size: int = 2048,
+            cache_max_files: int = 1000,
+            cache_check_interval: float = 300,
+            shared_cache: bool = False,
+            daily_quota: int = 10000,
+            low_quota: int = 2000
+    ):
         """
         Construct a new client with the parent bot and the wanted token
 
         params :
             - dj_bot: dj_bot.DJBot = The parent bot
             - youtube_token: str = The Youtube Data API v3 token
+            - search_workers: int = The number of threads running the Youtube API requests
+            - search_cache_size: int = The maximum number of cached searches
+            - search_cache_ttl: float = The time to live of a cached search in seconds
+            - video_cache_size: int = The maximum number of cached video details
+            - video_cache_ttl: float = The time to live of cached video details in seconds
+            - persist_cache: bool = If the caches are saved on the disk to survive restarts
+            - download_workers: int = The number of simultaneous downloads
+            - download_timeout: float = The maximum duration of a download in seconds
+            - opus_bitrate: int = The bitrate in kbps of the songs that need to be encoded to Opus
+            - cache_max_size: int = The maximum size of the song cache in megabytes
+            - cache_max_files: int = The maximum number of files in the song cache
+            - cache_check_interval: float = The delay in seconds between two song cache checks
+            - shared_cache: bool = If other bot processes use the same song cache
+            - daily_quota: int = The Youtube API units of the day
+            - low_quota: int = The remaining units under which the searches are answered locally when possible
         """
 
         # Assign the attributes
         self.dj_bot: bot.DJBot = dj_bot
         self.youtube_token: str = youtube_token
+        self.opus_bitrate: int = opus_bitrate
+
+        # The post-processing of the downloaded songs, it is run by the download workers and the migration and
+        # must stay picklable for the spawned workers
+        self.encode_func: functools.partial = functools.partial(audio.encode_opus, bitrate=self.opus_bitrate)
 
         # Create the youtube client
         self.client = googleapiclient.discovery.build("youtube", "v3", developerKey=self.youtube_token)
 
+        # Create the executor running the blocking API requests outside of the event loop,
+        # httplib2 is not thread safe so each worker thread gets its own http object
+        self.search_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=search_workers,
+            thread_name_prefix="dj_search"
+        )
+        self.thread_data = threading.local()
+
+        # Create the executor running the song cache operations that wait for the other processes
+        self.index_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dj_index")
+
+        # Create the batcher merging the video details lookups of the concurrent requests
+        self.video_batcher: batch.LookupBatcher = batch.LookupBatcher(
+            self.request_video_details_blocking,
+            name="dj_video_batch"
+        )
+
+        # Create the registries of the running searches and downloads to share them between callers,
+        # the downloads are keyed by video id and contain the list of the waiting songs
+        self.pending_searches: dict = dict()
+        self.pending_downloads: dict = dict()
+        self.pending_lock: threading.Lock = threading.Lock()
+
+        # Create the search and video details caches
+        self.search_cache: cache.TTLCache = cache.TTLCache(
+            search_cache_size,
+            search_cache_ttl,
+            SEARCH_CACHE_FILE if persist_cache else None
+        )
+        self.video_cache: cache.TTLCache = cache.TTLCache(
+            video_cache_size,
+            video_cache_ttl,
+            VIDEO_CACHE_FILE if persist_cache else None
+        )
+        self.search_cache.load()
+        self.video_cache.load()
+
+        # Index the known video titles to answer the searches locally when the quota is low
+        self.title_index: index.TitleIndex = index.TitleIndex(video_cache_size)
+        for video_id, video_details in self.video_cache.items():
+            self.title_index.add(video_id, video_details)
+
+        # Count the API units spent today, the bot processes share the same key
+        self.quota_meter: quota.QuotaMeter = quota.QuotaMeter(daily_quota, low_quota, QUOTA_FILE, shared_cache)
+
         # Set the youtube dl options
         self.ytdl_opts: dict = {
             "outtmpl": DOWNLOAD_DIR + "%(id)s.%(ext)s",
             "logger": logging.getLogger(LOGGER_NAME),
-            "download_archive": CACHE_FILE,
-            "format": "mp4"
+            "format": "bestaudio[acodec=opus]/bestaudio[ext=webm]/bestaudio/best",
+            "socket_timeout": 30
         }
 
+        # Open the index of the downloaded songs, it replaces the youtube dl archive file
+        self.song_index: index.SongIndex = index.SongIndex(INDEX_FILE, DOWNLOAD_DIR, shared_cache)
+        try:
+            os.remove(CACHE_FILE)
+        except FileNotFoundError as _:
+            pass
+
+        # Start the manager keeping the song cache in its budget
+        self.cache_manager: index.SongCacheManager = index.SongCacheManager(
+            self.song_index,
+            cache_max_size * 1024 * 1024,
+            cache_max_files,
+            cache_check_interval,
+            self.dj_bot.get_needed_video_ids
+        )
+
+        # Create the download scheduler
+        self.download_scheduler: download.DownloadScheduler = download.DownloadScheduler(
+            self.ytdl_opts,
+            download_workers,
+            download_timeout,
+            self.dj_bot.get_song_priority,
+            self.dispatch_download_hook,
+            self.download_failed,
+            self.encode_func,
+            shared_cache
+        )
+
     # ----- Class methods -----
 
-    def search_videos(self, query: str, max_results: int) -> list:
+    def get_http(self) -> httplib2.Http:
+        """
+        Get the http object of the current thread and create it if needed
+
+        return -> httplib2.Http = The http object to execute the requests with
+        """
+
+        http = getattr(self.thread_data, "http", None)
+        if http is None:
+            http = httplib2.Http()
+            self.thread_data.http = http
+        return http
+
+    def execute_request(self, request, call_type: str) -> dict:
+        """
+        Execute a Youtube API request if the quota allows it and count its units
+
+        params :
+            - request = The API request
+            - call_type: str = The call type of the request in the quota costs
+
+        return -> dict = The API answer
+        """
+
+        # Verify and count the call before executing it, a failed call is charged too
+        if not self.quota_meter.can_spend(call_type):
+            raise quota.QuotaExceeded("No Youtube quota left for " + call_type)
+        self.quota_meter.record(call_type)
+
+        try:
+            return request.execute(http=self.get_http())
+        except googleapiclient.errors.HttpError as e:
+            # The key can be used elsewhere, trust the API when it refuses the call
+            if e.resp.status == 403 and "quota" in str(e).lower():
+                self.quota_meter.exhaust()
+                raise quota.QuotaExceeded(str(e))
+            raise
+
+    def is_downloaded(self, video_id: str) -> bool:
         """
-        Get all videos and their details with a search phrase
+        Get if a video is in the song cache
+
+        params :
+            - video_id: str = The video id
+
+        return -> bool = True if the video is downloaded, False else
+        """
+
+        return self.song_index.get(video_id) is not None
+
+    async def search_videos(self, query: str, max_results: int) -> list:
+        """
+        Get all videos and their details with a search phrase without blocking the event loop
 
         params :
             - query: str = The search phrase
-            max_results: int = The maximum number of results
+            - max_results: int = The maximum number of results
 
         return -> list = A list of the youtube result
         """
 
+        # Share the pending request if the same search is already running
+        search_key: str = self.get_search_key(query, max_results)
+        pending: asyncio.Future = self.pending_searches.get(search_key, None)
+        if pending is None:
+            loop = asyncio.get_event_loop()
+            pending = loop.run_in_executor(self.search_executor, self.search_videos_blocking, query, max_results)
+            self.pending_searches[search_key] = pending
+            pending.add_done_callback(lambda _: self.pending_searches.pop(search_key, None))
+
+        # Wait for the result and give a copy to each caller
+        result: list = await asyncio.shield(pending)
+        return [dict(item) for item in result]
+
+    @staticmethod
+    def get_search_key(query: str, max_results: int) -> str:
+        """
+        Get the key identifying a search in the cache and the pending searches
+
+        params :
+            - query: str = The search phrase
+            - max_results: int = The maximum number of results
+
+        return -> str = The search key
+        """
+
+        return utils.normalize_query(query) + "|" + str(max_results)
+
+    def search_videos_blocking(self, query: str, max_results: int) -> list:
+        """
+        Get all videos and their details with a search phrase, this method blocks until the API answers
+
+        params :
+            - query: str = The search phrase
+            - max_results: int = The maximum number of results
+
+        return -> list = A list of the youtube result
+        """
+
+        # Look for the search in the cache
+        search_key: str = self.get_search_key(query, max_results)
+        cached_result: list = self.search_cache.get(search_key)
+        if cached_result is not None:
+            return [dict(item) for item in cached_result]
+
+        # Answer with the known titles when the quota is low because a search costs 100 units
+        if self.quota_meter.is_low() or not self.quota_meter.can_spend("search"):
+            local_result: list = self.title_index.search(query, max_results, self.is_downloaded)
+            if len(local_result) > 0:
+                return local_result
+
         # Prepare the request
         search_req = self.client.search().list(
             part="snippet",
@@ -242,11 +549,10 @@ class DJYoutubeClient:
         )
 
         # Get the raw result of the search
-        raw_result = search_req.execute()
+        raw_result = self.execute_request(search_req, "search")
 
         # Prepare the final result
         final_result: list = list()
-        video_id_list: list = list()
 
         for raw_item in raw_result["items"]:
             final_item = dict()
@@ -255,55 +561,426 @@ class DJYoutubeClient:
             final_item["channel_title"] = html.unescape(raw_item["snippet"]["channelTitle"])
             final_item["description"] = html.unescape(raw_item["snippet"]["description"])
 
-            video_id_list.append(raw_item["id"]["videoId"])
             final_result.append(final_item)
 
-        # Get the video's duration
+        # Get the video durations from the video cache or with one request, the lookup is skipped when the quota
+        # cannot pay it and the durations stay unknown
+        lookup: bool = self.quota_meter.can_spend("videos")
+        details_dict, unknown_ids = self.get_video_details_blocking(
+            [final_item["id"] for final_item in final_result], lookup)
+        for final_item in final_result:
+            if final_item["id"] in details_dict:
+                final_item["duration"] = details_dict[final_item["id"]]["duration"]
+            elif final_item["id"] in unknown_ids:
+                final_item["duration"] = utils.UNKNOWN_DURATION
+
+        # Remove the videos without details (deleted or private videos)
+        final_result = [final_item for final_item in final_result if "duration" in final_item]
+
+        # Fill the cache with the complete results only
+        if len(unknown_ids) == 0:
+            self.search_cache.put(search_key, [dict(item) for item in final_result])
+
+        # Return the final list
+        return final_result
+
+    def get_video_details_blocking(self, video_ids: list, lookup: bool = True) -> tuple:
+        """
+        Get the details of videos from the video cache or from the batcher, the missing videos are requested
+        with those of the concurrent searches and playlist imports, this method blocks until the API answers
+
+        params :
+            - video_ids: list = The video ids
+            - lookup: bool = If the videos missing from the cache are requested
+
+        return -> tuple = The details dicts with the "title", "channel_title" and "duration" keys by video id, the
+                          deleted and private videos are absent, and the set of the video ids whose details are
+                          unknown because they were not requested or their request failed
+        """
+
+        # Take the cached details
+        details_dict: dict = dict()
+        missing_id_list: list = list()
+        for video_id in video_ids:
+            video_details: dict = self.video_cache.get(video_id)
+            if video_details is not None:
+                details_dict[video_id] = video_details
+            elif video_id not in missing_id_list:
+                missing_id_list.append(video_id)
+
+        # Request the missing details
+        if not lookup:
+            return details_dict, set(missing_id_list)
+        if len(missing_id_list) == 0:
+            return details_dict, set()
+        requested_dict, failed_ids = self.video_batcher.get(missing_id_list)
+        details_dict.update(requested_dict)
+        return details_dict, failed_ids
+
+    def request_video_details_blocking(self, video_ids: list) -> dict:
+        """
+        Request the details of at most 50 videos with one videos request and put them in the video cache, the
+        answer items are joined by their id because the missing videos are skipped
+
+        params :
+            - video_ids: list = The video ids
+
+        return -> dict = The details dicts by video id
+        """
+
         precision_req = self.client.videos().list(
-            part="contentDetails",
-            id=",".join(video_id_list)
+            part="snippet,contentDetails",
+            id=",".join(video_ids)
         )
+        raw_result = self.execute_request(precision_req, "videos")
 
-        # Get the raw result of the video precisions
-        raw_result = precision_req.execute()
+        details_dict: dict = dict()
+        for raw_item in raw_result["items"]:
+            video_details: dict = {
+                "title": html.unescape(raw_item["snippet"]["title"]),
+                "channel_title": html.unescape(raw_item["snippet"]["channelTitle"]),
+                "duration": utils.parse_youtube_time(raw_item["contentDetails"]["duration"])
+            }
+            details_dict[raw_item["id"]] = video_details
+            self.video_cache.put(raw_item["id"], video_details)
+            self.title_index.add(raw_item["id"], video_details)
+        return details_dict
+
+    async def get_playlist_videos(self, playlist_id: str, max_results: int) -> list:
+        """
+        Get the videos of a playlist and their details without blocking the event loop
 
-        for i in range(len(raw_result["items"])):
-            video_duration = raw_result["items"][i]["contentDetails"]["duration"]
-            final_result[i]["duration"] = utils.parse_youtube_time(video_duration)
+        params :
+            - playlist_id: str = The playlist id
+            - max_results: int = The maximum number of videos
+
+        return -> list = The video dicts in the playlist order
+        """
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.search_executor,
+            self.get_playlist_videos_blocking,
+            playlist_id,
+            max_results
+        )
+
+    def get_playlist_videos_blocking(self, playlist_id: str, max_results: int) -> list:
+        """
+        Get the videos of a playlist 50 at a time and their details with one videos request per page, this
+        method blocks until the API answers
+
+        params :
+            - playlist_id: str = The playlist id
+            - max_results: int = The maximum number of videos
+
+        return -> list = The video dicts in the playlist order, the deleted and private videos are skipped
+        """
+
+        final_result: list = list()
+        page_token: str = None
+
+        while len(final_result) < max_results:
+            # Import the pages already fetched when the quota is spent
+            if len(final_result) > 0 and not self.quota_meter.can_spend("playlistItems"):
+                break
+
+            # Get the next page of the playlist
+            items_req = self.client.playlistItems().list(
+                part="snippet,contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_token
+            )
+            raw_result = self.execute_request(items_req, "playlistItems")
+
+            # Get the details of the page videos with one request, the titles of the page are used with unknown
+            # durations when the quota cannot pay the lookup or the lookup failed
+            lookup: bool = self.quota_meter.can_spend("videos")
+            video_ids: list = [raw_item["contentDetails"]["videoId"] for raw_item in raw_result["items"]]
+            details_dict, unknown_ids = self.get_video_details_blocking(video_ids, lookup)
+            for raw_item in raw_result["items"]:
+                video_id: str = raw_item["contentDetails"]["videoId"]
+                if len(final_result) >= max_results:
+                    break
+                if video_id in details_dict:
+                    final_item: dict = dict(details_dict[video_id])
+                elif video_id in unknown_ids and "videoOwnerChannelTitle" in raw_item["snippet"]:
+                    final_item: dict = {
+                        "title": html.unescape(raw_item["snippet"]["title"]),
+                        "channel_title": html.unescape(raw_item["snippet"]["videoOwnerChannelTitle"]),
+                        "duration": utils.UNKNOWN_DURATION
+                    }
+                else:
+                    continue
+                final_item["id"] = video_id
+                final_result.append(final_item)
+
+            page_token = raw_result.get("nextPageToken", None)
+            if page_token is None:
+                break
 
-        # Return the final list
         return final_result
 
-    def get_first_video(self, title: str) -> dict:
+    async def get_first_video(self, title: str) -> dict:
         """
         Get the first Youtube result for a title
 
         params :
             - title: str = the title you want to search
+
+        return -> dict = The first result or None if there is no result
+        """
+
+        result: list = await self.search_videos(title, 1)
+        if len(result) > 0:
+            return result[0]
+        return None
+
+    def get_cache_stats(self) -> dict:
+        """
+        Get the hit and miss counters of the search and video caches and the counters of the video batcher
+
+        return -> dict = The counters of each cache and of the batcher
+        """
+
+        return {
+            "search": self.search_cache.stats(),
+            "video": self.video_cache.stats(),
+            "video_batch": self.video_batcher.stats()
+        }
+
+    async def clean_song_cache(self) -> int:
+        """
+        Remove the song files needed by no process outside of the event loop
+
+        return -> int = The number of removed files
+        """
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.index_executor, self.cache_manager.clean)
+
+    def get_quota_stats(self) -> dict:
+        """
+        Get the Youtube API units spent today
+
+        return -> dict = The counters of the quota meter
+        """
+
+        return self.quota_meter.stats()
+
+    def close(self) -> None:
+        """
+        Release the resources of the client and persist the caches
+        """
+
+        self.search_executor.shutdown(wait=False)
+        self.index_executor.shutdown(wait=False)
+        self.video_batcher.stop()
+        self.download_scheduler.stop()
+        self.cache_manager.stop()
+        self.song_index.close()
+
+        # Save the caches
+        try:
+            self.search_cache.save()
+            self.video_cache.save()
+        except OSError as _:
+            logging.getLogger(LOGGER_NAME).warning("Cannot save the search caches")
+        logging.getLogger(LOGGER_NAME).info("Search cache stats : " + str(self.get_cache_stats()))
+
+    def migrate_song_files(self) -> None:
+        """
+        Convert the song files downloaded by the previous versions to Ogg Opus files, the files that cannot be
+        converted are dropped from the cache
+        """
+
+        # Only one process converts the files
+        with lock.FileLock("migrate"):
+            self.migrate_song_files_locked()
+
+    def migrate_song_files_locked(self) -> None:
+        """
+        Convert the song files downloaded by the previous versions, the migrate lock must be held
         """
 
-        return self.search_videos(title, 1)[0]
+        # Get the song files that are not converted
+        try:
+            old_files: list = [
+                file for file in os.listdir(DOWNLOAD_DIR)
+                if not audio.is_opus_file(file) and not file.endswith(utils.PARTIAL_EXTENSIONS)
+            ]
+        except FileNotFoundError as _:
+            return
+        if len(old_files) == 0:
+            return
+
+        logging.getLogger(LOGGER_NAME).info("Migrate " + str(len(old_files)) + " song file(s) to Ogg Opus files")
+        dropped_count: int = 0
+
+        for file in old_files:
+            video_id: str = utils.get_file_video_id(file)
+            try:
+                new_path: str = self.encode_func(DOWNLOAD_DIR + file)
+            except audio.FFmpegError as _:
+                # Keep the files until ffmpeg can be run, they are migrated at the next start
+                logging.getLogger(LOGGER_NAME).error("Cannot run ffmpeg, postpone the song files migration")
+                return
+            if new_path is not None:
+                entry: dict = self.song_index.get(video_id)
+                self.song_index.add(
+                    video_id,
+                    new_path,
+                    entry["duration"] if entry is not None else None,
+                    entry["last_played"] if entry is not None else None
+                )
+            else:
+                dropped_count += 1
+                self.song_index.remove(video_id)
+                os.remove(DOWNLOAD_DIR + file)
+
+        if dropped_count > 0:
+            logging.getLogger(LOGGER_NAME).warning("Drop " + str(dropped_count) + " unreadable song file(s)")
 
     def download_song(self, sng: song.Song):
         """
-        Download a song an set its state to ready when the download is finished
+        Schedule a song download and set its state to ready when the download is finished, if the same video
+        is already downloading the song just waits for this download to finish
 
         params :
             - sng: song.Song = The song to download
         """
 
-        # Prepare the youtube downloader
-        ytdl: yt.YoutubeDL = yt.YoutubeDL(self.ytdl_opts)
-        ytdl.add_progress_hook(sng.download_hook)
+        with self.pending_lock:
+            # Join the pending download of the video if there is one
+            waiting_songs: list = self.pending_downloads.get(sng.video_id, None)
+            if waiting_songs is not None:
+                waiting_songs.append(sng)
+                return
+            self.pending_downloads[sng.video_id] = [sng]
+
+        # The cache is verified in the index executor because the reservation waits for the other processes
+        self.index_executor.submit(self.check_song_cache, sng.video_id)
+
+    def check_song_cache(self, video_id: str) -> None:
+        """
+        Make the songs waiting for a video ready if it is in the cache, else download it. A cached song is
+        reserved so no process evicts it before it is played
+
+        params :
+            - video_id: str = The video id
+        """
+
+        try:
+            entry: dict = self.cache_manager.reserve(video_id, lambda: self.get_cached_song(video_id))
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).warning("Cannot verify the song cache for " + video_id + " : " + str(e))
+            entry = None
+
+        with self.pending_lock:
+            if entry is None:
+                # Only download if a song still waits, a cancellation removed the pending entry
+                if video_id in self.pending_downloads:
+                    self.download_scheduler.submit(video_id)
+                return
+            waiting_songs: list = self.pending_downloads.pop(video_id, [])
+
+        # Simulate a finished download
+        for sng in waiting_songs:
+            self.call_download_hook(sng, {"status": "finished", "filename": entry["path"]})
+
+    def get_cached_song(self, video_id: str) -> dict:
+        """
+        Get the index entry of a downloaded video and forget it if its file was removed
+
+        params :
+            - video_id: str = The video id
+
+        return -> dict = The index entry or None if the video isn't downloaded
+        """
+
+        entry: dict = self.song_index.get(video_id)
+        if entry is not None and not os.path.isfile(entry["path"]):
+            self.song_index.remove(video_id)
+            return None
+        return entry
+
+    def cancel_download(self, sng: song.Song) -> None:
+        """
+        Stop waiting for a song download and cancel the download if no other song waits for it
+
+        params :
+            - sng: song.Song = The song that doesn't need its download anymore
+        """
 
-        # Verify that the song is not in the cache
-        if not ytdl.in_download_archive({"id": sng.video_id, "extractor_key": "youtube"}):
-            # Create the video URL
-            video_url = "https://www.youtube.com/watch?v=" + sng.video_id
+        with self.pending_lock:
+            waiting_songs: list = self.pending_downloads.get(sng.video_id, None)
+            if waiting_songs is None or sng not in waiting_songs:
+                return
+
+            # Remove the song and release the download if it was the last one
+            waiting_songs.remove(sng)
+            if len(waiting_songs) > 0:
+                return
+            del self.pending_downloads[sng.video_id]
+
+        self.download_scheduler.cancel(sng.video_id)
+
+    def download_failed(self, video_id: str) -> None:
+        """
+        Release the songs waiting for a failed or cancelled download
+
+        params :
+            - video_id: str = The video id of the failed download
+        """
+
+        with self.pending_lock:
+            waiting_songs: list = self.pending_downloads.pop(video_id, [])
+
+        for sng in waiting_songs:
+            self.call_download_hook(sng, {"status": "error"})
+
+        if len(waiting_songs) > 0:
+            logging.getLogger(LOGGER_NAME).warning(
+                str(len(waiting_songs)) + " song(s) will never be ready because the download of " + video_id +
+                " failed")
+
+    def dispatch_download_hook(self, video_id: str, s: dict) -> None:
+        """
+        Forward a download progress to all songs waiting for the video
+
+        params :
+            - video_id: str = The downloading video id
+            - s: dict = The download informations
+        """
+
+        # Get the waiting songs and release the download when it is finished
+        with self.pending_lock:
+            if s["status"] == "finished":
+                waiting_songs: list = self.pending_downloads.pop(video_id, [])
+            else:
+                waiting_songs: list = list(self.pending_downloads.get(video_id, []))
+
+        # Index the downloaded song
+        if s["status"] == "finished":
+            duration: int = utils.parse_duration_seconds(waiting_songs[0].duration) if len(waiting_songs) > 0 else None
+            self.cache_manager.reserve(video_id, lambda: self.song_index.add(video_id, s["filename"], duration))
+            self.cache_manager.notify()
+
+        for sng in waiting_songs:
+            self.call_download_hook(sng, s)
+
+    def call_download_hook(self, sng: song.Song, s: dict) -> None:
+        """
+        Call the download hook of a song on the event loop, the downloads report from their worker threads
+
+        params :
+            - sng: song.Song = The waiting song
+            - s: dict = The download informations
+        """
 
-            # Start the video downloading in a thread to avoid waiting
-            t = threading.Thread(target=ytdl.download, args=([video_url], ))
-            t.start()
-        else:
-            # Simulate a finished download
-            sng.download_hook({"status": "finished"})
+        try:
+            self.dj_bot.discord_client.loop.call_soon_threadsafe(sng.download_hook, s)
+        except RuntimeError as _:
+            # The loop is closed, the bot is stopping
+            pass
@@ -1,3 +1,6 @@
+import time
+
+
 class Command:
     """
     This class represent a command from discord users
@@ -25,17 +28,231 @@ class Command:
 
     def parse_command(self) -> None:
         """
-        Parse the command string
+        Parse the command string, the messages that are not commands are not split
         """
 
-        # Verify the command length and existence
-        if self.command_str is not None and len(self.command_str) >= 1:
+        # Verify the command format
+        if self.command_str is not None and self.command_str.startswith("!"):
 
             # Split the command into two parts
-            tmp_list: list = self.command_str.split(" ", 1)
+            self.name, _, self.arg = self.command_str.partition(" ")
+
+
+class TokenBucket:
+    """
+    TokenBucket class.
+
+    This class limits a rate of actions, the bucket is refilled continuously up to its capacity and each
+    action takes its cost from it
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, capacity: float, refill_rate: float):
+        """
+        Create a new full bucket
+
+        params :
+            - capacity: float = The maximum number of tokens, it is the allowed burst
+            - refill_rate: float = The number of tokens added per second
+        """
+
+        # Assign the attributes
+        self.capacity: float = capacity
+        self.refill_rate: float = refill_rate
+        self.tokens: float = capacity
+        self.update_time: float = time.monotonic()
+        self.warned: bool = False
+
+    # ----- Class methods -----
+
+    def refill(self) -> None:
+        """
+        Add the tokens earned since the last update
+        """
+
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.update_time) * self.refill_rate)
+        self.update_time = now
+
+    def can_take(self, cost: float) -> bool:
+        """
+        Get if the bucket contains enough tokens for an action
+
+        params :
+            - cost: float = The action cost
+
+        return -> bool = True if the action is allowed, False else
+        """
+
+        self.refill()
+        return self.tokens >= cost
+
+    def take(self, cost: float) -> None:
+        """
+        Take the cost of an allowed action from the bucket
+
+        params :
+            - cost: float = The action cost
+        """
+
+        self.tokens -= cost
+        self.warned = False
+
+    def is_full(self) -> bool:
+        """
+        Get if the bucket is full, a full bucket can be dropped and created again without changing anything
+
+        return -> bool = True if the bucket is full, False else
+        """
+
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class CommandSpec:
+    """
+    CommandSpec class.
+
+    This class describes a command of the registry, its handler is called with the message, the guild player
+    and the command argument and it can return a coroutine to run as a task
+    """
+
+    __slots__ = ("name", "aliases", "handler", "admin", "cost", "bucket")
+
+    # ----- Constructor -----
+
+    def __init__(self, name: str, aliases: tuple, handler, admin: bool, cost: float, bucket: TokenBucket):
+        """
+        Create a new command description
+
+        params :
+            - name: str = The command name
+            - aliases: tuple = The other names of the command
+            - handler = The function handling the command
+            - admin: bool = If the command is reserved to the admins
+            - cost: float = The number of tokens taken from the user bucket
+            - bucket: TokenBucket = The bucket limiting the command for all users or None
+        """
+
+        # Assign the attributes
+        self.name: str = name
+        self.aliases: tuple = aliases
+        self.handler = handler
+        self.admin: bool = admin
+        self.cost: float = cost
+        self.bucket: TokenBucket = bucket
+
+
+class CommandRouter:
+    """
+    CommandRouter class.
+
+    This class finds the command of a message in a registry and verifies the rate limits of its user and of the
+    command before running it
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, user_burst: float = 5, user_rate: float = 1, max_buckets: int = 1024):
+        """
+        Create a new empty router
+
+        params :
+            - user_burst: float = The number of tokens a user can spend at once
+            - user_rate: float = The number of tokens a user earns per second
+            - max_buckets: int = The number of user buckets after which the full ones are dropped
+        """
+
+        # Assign the attributes
+        self.user_burst: float = user_burst
+        self.user_rate: float = user_rate
+        self.max_buckets: int = max_buckets
+        self.commands: dict = dict()
+        self.user_buckets: dict = dict()
+
+    # ----- Class methods -----
+
+    def register(
+            self,
+            name: str,
+            handler,
+            aliases: tuple = (),
+            admin: bool = False,
+            cost: float = 1,
+            burst: float = None,
+            rate: float = None
+    ) -> None:
+        """
+        Add a command to the registry
+
+        params :
+            - name: str = The command name
+            - handler = The function handling the command with the message, the guild player and the argument
+            - aliases: tuple = The other names of the command
+            - admin: bool = If the command is reserved to the admins
+            - cost: float = The number of tokens taken from the user bucket
+            - burst: float = The number of times the command can run at once for all users, None for no limit
+            - rate: float = The number of times the command can run per second for all users
+        """
+
+        bucket: TokenBucket = TokenBucket(burst, rate) if burst is not None else None
+        spec: CommandSpec = CommandSpec(name, aliases, handler, admin, cost, bucket)
+        self.commands[name] = spec
+        for alias in aliases:
+            self.commands[alias] = spec
+
+    def get_command(self, name: str) -> CommandSpec:
+        """
+        Get a command by its name or one of its aliases
+
+        params :
+            - name: str = The command name
+
+        return -> CommandSpec = The command or None if it doesn't exist
+        """
+
+        return self.commands.get(name, None)
+
+    def get_user_bucket(self, user_name: str) -> TokenBucket:
+        """
+        Get the bucket of a user and create it if needed
+
+        params :
+            - user_name: str = The user full name
+
+        return -> TokenBucket = The user bucket
+        """
+
+        bucket: TokenBucket = self.user_buckets.get(user_name, None)
+        if bucket is None:
+            # Drop the buckets of the users that are quiet for a while
+            if len(self.user_buckets) >= self.max_buckets:
+                self.user_buckets = {
+                    name: user_bucket for name, user_bucket in self.user_buckets.items() if not user_bucket.is_full()
+                }
+            bucket = TokenBucket(self.user_burst, self.user_rate)
+            self.user_buckets[user_name] = bucket
+        return bucket
+
+    def acquire(self, spec: CommandSpec, user_name: str) -> TokenBucket:
+        """
+        Take the cost of a command from the user and the command buckets if both allow it
+
+        params :
+            - spec: CommandSpec = The command
+            - user_name: str = The user full name
+
+        return -> TokenBucket = None if the command can run, else the bucket that refused it
+        """
+
+        user_bucket: TokenBucket = self.get_user_bucket(user_name)
+        if not user_bucket.can_take(spec.cost):
+            return user_bucket
+        if spec.bucket is not None and not spec.bucket.can_take(1):
+            return spec.bucket
 
-            # Verify the command format
-            if tmp_list[0][0] == "!":
-                self.name = tmp_list[0]
-                if len(tmp_list) == 2:
-                    self.arg = tmp_list[1]
+        user_bucket.take(spec.cost)
+        if spec.bucket is not None:
+            spec.bucket.take(1)
+        return None
@@ -0,0 +1,370 @@
+from dj_bot import lock, utils
+from dj_bot import LOGGER_NAME
+
+import youtube_dl as yt
+import multiprocessing
+import threading
+import logging
+import time
+
+# ----- The progress keys sent by the download processes -----
+
+PROGRESS_KEYS: tuple = ("status", "filename", "tmpfilename", "downloaded_bytes", "total_bytes", "total_bytes_estimate")
+
+
+class DownloadCancelled(Exception):
+    """
+    DownloadCancelled class.
+
+    This exception is raised in a download progress hook to abort a cancelled or timed out download
+    """
+    pass
+
+
+class DownloadJob:
+    """
+    DownloadJob class.
+
+    This class represent a video download waiting for or running in the scheduler
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, video_id: str, seq: int):
+        """
+        Create a new download job
+
+        params :
+            - video_id: str = The video id to download
+            - seq: int = The submission number of the job, used to keep the submission order between equals
+        """
+
+        # Assign the attributes
+        self.video_id: str = video_id
+        self.seq: int = seq
+        self.cancelled: bool = False
+        self.start_time: float = None
+        self.file_path: str = None
+
+
+def download_process_main(ytdl_opts: dict, postprocess_func, shared: bool, conn, cancel_event, progress_delay: float):
+    """
+    The download process function, it runs the video downloads sent by its worker thread one after another with
+    the same youtube downloader and sends back their progress
+
+    params :
+        - ytdl_opts: dict = The youtube dl options
+        - postprocess_func = The function to call with the downloaded file path, it returns the final file path
+        - shared: bool = If other bot processes download in the same directory
+        - conn: multiprocessing.connection.Connection = The connection with the worker thread
+        - cancel_event: multiprocessing.Event = The event set by the worker thread to abort the running download
+        - progress_delay: float = The minimal delay in seconds between two sent progress reports
+    """
+
+    # The state of the running download
+    current: dict = {"file_path": None, "last_progress": 0}
+
+    def progress_hook(s: dict) -> None:
+        # Keep the downloaded file and report the download end, the job end is reported after the post processing
+        if s["status"] == "finished":
+            current["file_path"] = s.get("filename", None)
+            conn.send(("progress", {"status": "downloaded", "filename": current["file_path"]}))
+            return
+
+        # Abort the download if needed
+        if cancel_event.is_set():
+            raise DownloadCancelled()
+
+        # Forward the progress without flooding the connection
+        now: float = time.monotonic()
+        if now - current["last_progress"] >= progress_delay:
+            current["last_progress"] = now
+            conn.send(("progress", {key: s[key] for key in PROGRESS_KEYS if key in s}))
+
+    ytdl: yt.YoutubeDL = yt.YoutubeDL(dict(ytdl_opts, logger=logging.getLogger(LOGGER_NAME)))
+    ytdl.add_progress_hook(progress_hook)
+
+    while True:
+        try:
+            video_id: str = conn.recv()
+        except (EOFError, KeyboardInterrupt) as _:
+            return
+        if video_id is None:
+            return
+
+        current["file_path"] = None
+        current["last_progress"] = 0
+        file_lock: lock.FileLock = lock.FileLock("download_" + video_id) if shared else None
+        error: str = None
+        try:
+            # Wait for the process downloading the same video and take its file
+            if file_lock is not None:
+                if not file_lock.acquire(abort_func=cancel_event.is_set):
+                    raise DownloadCancelled()
+                current["file_path"] = utils.find_song_file(video_id)
+
+            if current["file_path"] is None:
+                ytdl.download(["https://www.youtube.com/watch?v=" + video_id])
+                if current["file_path"] is None:
+                    current["file_path"] = utils.find_song_file(video_id)
+            if postprocess_func is not None and current["file_path"] is not None:
+                current["file_path"] = postprocess_func(current["file_path"])
+        except DownloadCancelled as _:
+            current["file_path"] = None
+            error = "cancelled"
+        except Exception as e:
+            current["file_path"] = None
+            error = str(e)
+        finally:
+            if file_lock is not None:
+                file_lock.release()
+
+        conn.send(("done", current["file_path"], error))
+
+
+class DownloadScheduler:
+    """
+    DownloadScheduler class.
+
+    This class runs the video downloads in a fixed number of worker processes, the waiting job with the
+    best priority is started first each time a worker is free. Each process is driven by a bot thread that
+    only waits for its messages, so the downloads don't compete with the voice threads for the GIL
+    """
+
+    # ----- Constructor -----
+
+    def __init__(
+            self,
+            ytdl_opts: dict,
+            pool_size: int,
+            job_timeout: float,
+            priority_func,
+            progress_func,
+            failure_func,
+            postprocess_func=None,
+            shared: bool = False,
+            progress_delay: float = 0.1,
+            kill_delay: float = 30
+    ):
+        """
+        Create a new scheduler and start its workers
+
+        params :
+            - ytdl_opts: dict = The youtube dl options, the logger is replaced in the worker processes
+            - pool_size: int = The number of worker processes
+            - job_timeout: float = The maximum duration of a download in seconds
+            - priority_func = The function giving the priority of a video id, the lowest is started first
+            - progress_func = The function to call with the video id and the youtube dl progress information
+            - failure_func = The function to call with the video id when a download fails or is cancelled
+            - postprocess_func = The function to call in the worker process with the downloaded file path, it
+              returns the final file path and it must be picklable
+            - shared: bool = If other processes download in the same directory, a video is then downloaded by
+              one process at a time and the others take its file
+            - progress_delay: float = The minimal delay in seconds between two progress reports of a download
+            - kill_delay: float = The delay in seconds after which a process ignoring a cancellation is killed
+        """
+
+        # Assign the attributes, the logger cannot be sent to the processes
+        self.ytdl_opts: dict = {key: value for key, value in ytdl_opts.items() if key != "logger"}
+        self.pool_size: int = pool_size
+        self.job_timeout: float = job_timeout
+        self.priority_func = priority_func
+        self.progress_func = progress_func
+        self.failure_func = failure_func
+        self.postprocess_func = postprocess_func
+        self.shared: bool = shared
+        self.progress_delay: float = progress_delay
+        self.kill_delay: float = kill_delay
+
+        self.waiting_jobs: dict = dict()
+        self.running_jobs: dict = dict()
+        self.condition: threading.Condition = threading.Condition()
+        self.job_count: int = 0
+        self.running: bool = True
+
+        # Start the workers
+        self.workers: list = list()
+        for i in range(pool_size):
+            worker = threading.Thread(target=self.worker_loop, name="dj_download_" + str(i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    # ----- Class methods -----
+
+    def submit(self, video_id: str) -> None:
+        """
+        Add a video download to the scheduler if it isn't already waiting or running
+
+        params :
+            - video_id: str = The video id to download
+        """
+
+        with self.condition:
+            if video_id not in self.waiting_jobs and video_id not in self.running_jobs:
+                self.job_count += 1
+                self.waiting_jobs[video_id] = DownloadJob(video_id, self.job_count)
+                self.condition.notify()
+
+    def cancel(self, video_id: str) -> bool:
+        """
+        Cancel a video download, a running download is aborted at its next progress report
+
+        params :
+            - video_id: str = The video id to cancel
+
+        return -> bool = True if a download was cancelled, False else
+        """
+
+        with self.condition:
+            job: DownloadJob = self.waiting_jobs.pop(video_id, None)
+            if job is None:
+                job = self.running_jobs.get(video_id, None)
+            if job is None:
+                return False
+            job.cancelled = True
+            return True
+
+    def is_pending(self, video_id: str) -> bool:
+        """
+        Get if a video is waiting or running in the scheduler
+
+        params :
+            - video_id: str = The video id
+
+        return -> bool = True if the video download is pending, False else
+        """
+
+        with self.condition:
+            return video_id in self.waiting_jobs or video_id in self.running_jobs
+
+    def stop(self) -> None:
+        """
+        Stop the workers and cancel all downloads
+        """
+
+        with self.condition:
+            self.running = False
+            self.waiting_jobs.clear()
+            for job in self.running_jobs.values():
+                job.cancelled = True
+            self.condition.notify_all()
+
+    def next_job(self) -> DownloadJob:
+        """
+        Wait for a job and take the one with the best priority
+
+        return -> DownloadJob = The job to run or None if the scheduler is stopped
+        """
+
+        with self.condition:
+            while self.running and len(self.waiting_jobs) == 0:
+                self.condition.wait()
+            if not self.running:
+                return None
+
+            # Get the priorities when the job is taken because the queue may have moved since the submission
+            job: DownloadJob = min(
+                self.waiting_jobs.values(),
+                key=lambda j: (self.priority_func(j.video_id), j.seq)
+            )
+            del self.waiting_jobs[job.video_id]
+            self.running_jobs[job.video_id] = job
+            job.start_time = time.monotonic()
+            return job
+
+    def start_process(self) -> tuple:
+        """
+        Start a download process
+
+        return -> tuple = The process, the connection with it and its cancel event
+        """
+
+        # Spawn a fresh interpreter, a fork would copy the threads and the open files of the bot process
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe()
+        cancel_event = context.Event()
+        process = context.Process(
+            target=download_process_main,
+            args=(self.ytdl_opts, self.postprocess_func, self.shared, child_conn, cancel_event, self.progress_delay),
+            name="dj_download",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, conn, cancel_event
+
+    def worker_loop(self) -> None:
+        """
+        The worker thread function, it sends the jobs to its download process one after another and forwards
+        the process messages
+        """
+
+        process, conn, cancel_event = self.start_process()
+
+        while True:
+            job: DownloadJob = self.next_job()
+            if job is None:
+                conn.close()
+                process.join(self.kill_delay)
+                return
+
+            # Run the job in the process
+            cancel_event.clear()
+            cancel_time: float = None
+            error: str = None
+            try:
+                conn.send(job.video_id)
+                while True:
+                    # Abort the download if needed and kill the process if it doesn't stop, this is verified
+                    # between every message because the process reports its progress continuously
+                    if self.is_aborted(job):
+                        if cancel_time is None:
+                            cancel_time = time.monotonic()
+                            cancel_event.set()
+                        elif time.monotonic() - cancel_time > self.kill_delay:
+                            raise EOFError("the download process doesn't answer")
+                    if not conn.poll(0.5):
+                        continue
+
+                    message: tuple = conn.recv()
+                    if message[0] == "progress":
+                        self.progress_func(job.video_id, message[1])
+                    else:
+                        job.file_path = message[1]
+                        error = message[2]
+                        break
+            except (EOFError, OSError) as e:
+                # Replace the dead or stuck process
+                job.file_path = None
+                error = str(e)
+                process.kill()
+                process.join()
+                conn.close()
+                process, conn, cancel_event = self.start_process()
+            finally:
+                with self.condition:
+                    self.running_jobs.pop(job.video_id, None)
+
+            # Report the end of the job when the file is ready
+            if job.file_path is not None:
+                self.progress_func(job.video_id, {"status": "finished", "filename": job.file_path})
+            elif error == "cancelled":
+                logging.getLogger(LOGGER_NAME).info("Download of " + job.video_id + " is cancelled")
+                self.failure_func(job.video_id)
+            else:
+                logging.getLogger(LOGGER_NAME).error("Cannot download the video " + job.video_id + " : " + str(error))
+                self.failure_func(job.video_id)
+
+    def is_aborted(self, job: DownloadJob) -> bool:
+        """
+        Get if a job is cancelled and cancel it if it timed out
+
+        params :
+            - job: DownloadJob = The running job
+
+        return -> bool = True if the job must stop, False else
+        """
+
+        if self.job_timeout is not None and time.monotonic() - job.start_time > self.job_timeout:
+            job.cancelled = True
+        return job.cancelled
@@ -0,0 +1,657 @@
+from dj_bot import lock, utils
+from dj_bot import LOGGER_NAME
+
+import collections
+import threading
+import logging
+import sqlite3
+import time
+import re
+import os
+
+
+class SongIndex:
+    """
+    SongIndex class.
+
+    This class is the index of the downloaded song files, it is stored in a SQLite database and mirrored in
+    memory to look up a video id without any disk access, a shared index is also read from the database when
+    the mirror misses because other processes write in it
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, db_file: str, download_dir: str, shared: bool = False):
+        """
+        Open the index database and rebuild it from the download directory if it doesn't exist
+
+        params :
+            - db_file: str = The SQLite database file
+            - download_dir: str = The directory containing the song files
+            - shared: bool = If other processes use the same database and download directory
+        """
+
+        # Assign the attributes
+        self.db_file: str = db_file
+        self.download_dir: str = download_dir
+        self.shared: bool = shared
+        self.lock: threading.Lock = threading.Lock()
+        self.entries: dict = dict()
+
+        # Open the database, only one process creates it
+        with lock.FileLock("index"):
+            is_new: bool = not os.path.isfile(db_file)
+            self.db: sqlite3.Connection = sqlite3.connect(
+                db_file,
+                timeout=30,
+                check_same_thread=False,
+                isolation_level=None
+            )
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS songs ("
+                "video_id TEXT PRIMARY KEY, "
+                "path TEXT NOT NULL, "
+                "format TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "duration INTEGER, "
+                "last_played REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS needed ("
+                "owner TEXT NOT NULL, "
+                "video_id TEXT NOT NULL, "
+                "updated REAL NOT NULL, "
+                "PRIMARY KEY (owner, video_id))"
+            )
+
+            # Fill the index
+            if is_new:
+                self.rebuild()
+            else:
+                self.reload()
+
+    # ----- Class methods -----
+
+    @staticmethod
+    def row_to_entry(row: tuple) -> dict:
+        """
+        Convert a database row to an index entry
+
+        params :
+            - row: tuple = The database row
+
+        return -> dict = The index entry
+        """
+
+        return {
+            "video_id": row[0],
+            "path": row[1],
+            "format": row[2],
+            "size": row[3],
+            "duration": row[4],
+            "last_played": row[5]
+        }
+
+    def rebuild(self) -> None:
+        """
+        Fill the index with the song files of the download directory
+        """
+
+        # Get the complete song files
+        try:
+            files: list = [
+                file for file in os.listdir(self.download_dir)
+                if not file.endswith(utils.PARTIAL_EXTENSIONS) and os.path.isfile(self.download_dir + file)
+            ]
+        except FileNotFoundError as _:
+            files: list = list()
+
+        with self.lock:
+            self.db.execute("DELETE FROM songs")
+            self.entries.clear()
+
+        for file in files:
+            path: str = self.download_dir + file
+            stat = os.stat(path)
+            self.add(utils.get_file_video_id(file), path, None, stat.st_mtime)
+
+        logging.getLogger(LOGGER_NAME).info("Song index rebuilt with " + str(len(files)) + " file(s)")
+
+    def reload(self) -> None:
+        """
+        Replace the memory mirror by the content of the database
+        """
+
+        with self.lock:
+            if self.db is None:
+                return
+            rows: list = self.db.execute(
+                "SELECT video_id, path, format, size, duration, last_played FROM songs").fetchall()
+            self.entries = {row[0]: self.row_to_entry(row) for row in rows}
+
+    def get(self, video_id: str) -> dict:
+        """
+        Get the index entry of a video
+
+        params :
+            - video_id: str = The video id
+
+        return -> dict = The index entry or None if the video isn't downloaded
+        """
+
+        entry: dict = self.entries.get(video_id, None)
+        if entry is not None or not self.shared:
+            return entry
+
+        # Look for a song downloaded by another process
+        with self.lock:
+            if self.db is None:
+                return None
+            row: tuple = self.db.execute(
+                "SELECT video_id, path, format, size, duration, last_played FROM songs WHERE video_id = ?",
+                (video_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = self.row_to_entry(row)
+            self.entries[video_id] = entry
+            return entry
+
+    def add(self, video_id: str, path: str, duration: int = None, last_played: float = None) -> dict:
+        """
+        Add or replace the entry of a downloaded video
+
+        params :
+            - video_id: str = The video id
+            - path: str = The song file path
+            - duration: int = The song duration in seconds if known
+            - last_played: float = The last playing time, now if None
+
+        return -> dict = The new index entry
+        """
+
+        entry: dict = {
+            "video_id": video_id,
+            "path": path,
+            "format": os.path.splitext(path)[1][1:],
+            "size": os.path.getsize(path),
+            "duration": duration,
+            "last_played": last_played if last_played is not None else time.time()
+        }
+
+        with self.lock:
+            if self.db is None:
+                return entry
+            self.db.execute(
+                "INSERT OR REPLACE INTO songs (video_id, path, format, size, duration, last_played) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, path, entry["format"], entry["size"], duration, entry["last_played"])
+            )
+            self.entries[video_id] = entry
+        return entry
+
+    def remove(self, video_id: str) -> None:
+        """
+        Remove the entry of a video if it exists
+
+        params :
+            - video_id: str = The video id
+        """
+
+        with self.lock:
+            if self.entries.pop(video_id, None) is not None and self.db is not None:
+                self.db.execute("DELETE FROM songs WHERE video_id = ?", (video_id,))
+
+    def touch(self, video_id: str) -> None:
+        """
+        Set the last playing time of a video to now
+
+        params :
+            - video_id: str = The video id
+        """
+
+        now: float = time.time()
+        with self.lock:
+            entry: dict = self.entries.get(video_id, None)
+            if (entry is not None or self.shared) and self.db is not None:
+                if entry is not None:
+                    entry["last_played"] = now
+                self.db.execute("UPDATE songs SET last_played = ? WHERE video_id = ?", (now, video_id))
+
+    def get_all(self) -> list:
+        """
+        Get a copy of all index entries, a shared index is reloaded first to get the entries of the other
+        processes
+
+        return -> list = The index entries
+        """
+
+        if self.shared:
+            self.reload()
+        with self.lock:
+            return [dict(entry) for entry in self.entries.values()]
+
+    def publish_needed(self, owner: str, video_ids: set) -> None:
+        """
+        Replace the video ids needed by a process, the other processes don't evict them from the cache
+
+        params :
+            - owner: str = The process identifier
+            - video_ids: set = The needed video ids
+        """
+
+        now: float = time.time()
+        with self.lock:
+            if self.db is None:
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("DELETE FROM needed WHERE owner = ?", (owner,))
+                self.db.executemany(
+                    "INSERT INTO needed (owner, video_id, updated) VALUES (?, ?, ?)",
+                    [(owner, video_id, now) for video_id in video_ids]
+                )
+                self.db.execute("COMMIT")
+            except sqlite3.Error as _:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def reserve_needed(self, owner: str, video_id: str) -> None:
+        """
+        Add a video id to the ones needed by a process without waiting for its next publication
+
+        params :
+            - owner: str = The process identifier
+            - video_id: str = The needed video id
+        """
+
+        with self.lock:
+            if self.db is None:
+                return
+            self.db.execute(
+                "INSERT OR REPLACE INTO needed (owner, video_id, updated) VALUES (?, ?, ?)",
+                (owner, video_id, time.time())
+            )
+
+    def get_shared_needed(self, max_age: float) -> set:
+        """
+        Get the video ids needed by all processes
+
+        params :
+            - max_age: float = The age in seconds after which a publication is ignored, its process is dead
+
+        return -> set = The needed video ids
+        """
+
+        with self.lock:
+            if self.db is None:
+                return set()
+            rows: list = self.db.execute(
+                "SELECT DISTINCT video_id FROM needed WHERE updated >= ?", (time.time() - max_age,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def __len__(self) -> int:
+        """
+        Get the number of indexed songs
+
+        return -> int = The number of entries
+        """
+
+        return len(self.entries)
+
+    def close(self) -> None:
+        """
+        Close the index database
+        """
+
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+class SongCacheManager:
+    """
+    SongCacheManager class.
+
+    This class keeps the song cache under a size and a file count budget, it evicts the least recently played
+    songs that are not needed by the player in a background thread, with a shared index the processes publish
+    their needed songs and evict one at a time
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, song_index: SongIndex, max_size: int, max_files: int, check_interval: float, needed_func):
+        """
+        Create a new cache manager and start its thread
+
+        params :
+            - song_index: SongIndex = The index of the song cache
+            - max_size: int = The maximum size of the cache in bytes
+            - max_files: int = The maximum number of files in the cache
+            - check_interval: float = The delay in seconds between two periodic checks
+            - needed_func = The function returning the set of the video ids that must be kept
+        """
+
+        # Assign the attributes
+        self.song_index: SongIndex = song_index
+        self.max_size: int = max_size
+        self.max_files: int = max_files
+        self.check_interval: float = check_interval
+        self.needed_func = needed_func
+
+        self.owner: str = str(os.getpid())
+        self.evictions: int = 0
+        self.evicted_bytes: int = 0
+        self.running: bool = True
+        self.wake_event: threading.Event = threading.Event()
+
+        # Held while the needed songs are read and evicted, a reserved song is never evicted meanwhile
+        self.evict_lock: threading.Lock = threading.Lock()
+
+        # Start the manager thread
+        self.thread: threading.Thread = threading.Thread(target=self.run, name="dj_cache", daemon=True)
+        self.thread.start()
+
+    # ----- Class methods -----
+
+    def run(self) -> None:
+        """
+        The manager thread function, it checks the cache periodically or when it is notified
+        """
+
+        while self.running:
+            try:
+                self.enforce()
+            except Exception as e:
+                logging.getLogger(LOGGER_NAME).error("Cannot enforce the song cache budget : " + str(e))
+            self.wake_event.wait(self.check_interval)
+            self.wake_event.clear()
+
+    def notify(self) -> None:
+        """
+        Ask the manager to check the cache now, for example after a download
+        """
+
+        self.wake_event.set()
+
+    def enforce(self) -> None:
+        """
+        Evict the songs needed by no player until the cache fits in its budget
+        """
+
+        self.run_locked(self.evict)
+
+    def clean(self) -> int:
+        """
+        Remove all the song files needed by no process, the files still downloading or encoding are kept
+
+        return -> int = The number of removed files
+        """
+
+        return self.run_locked(self.remove_unneeded)
+
+    def run_locked(self, func):
+        """
+        Call a function with the songs needed by all processes while no other eviction or reservation runs
+
+        params :
+            - func = The function to call with the set of the needed video ids
+
+        return -> The result of the function
+        """
+
+        with self.evict_lock:
+            if not self.song_index.shared:
+                return func(self.needed_func())
+
+            # Publish the needed songs and add the songs needed by the other processes
+            needed: set = self.needed_func()
+            self.song_index.publish_needed(self.owner, needed)
+            with lock.FileLock("cache"):
+                return func(needed | self.song_index.get_shared_needed(self.check_interval * 3))
+
+    def remove_unneeded(self, needed: set) -> int:
+        """
+        Remove the song files of the download directory that are not needed
+
+        params :
+            - needed: set = The video ids that must be kept
+
+        return -> int = The number of removed files
+        """
+
+        download_dir: str = self.song_index.download_dir
+        try:
+            files: list = os.listdir(download_dir)
+        except FileNotFoundError as _:
+            return 0
+
+        removed_count: int = 0
+        for file in files:
+            video_id: str = utils.get_file_video_id(file)
+            if file.endswith(utils.PARTIAL_EXTENSIONS) or video_id in needed:
+                continue
+            try:
+                os.remove(download_dir + file)
+            except (FileNotFoundError, IsADirectoryError, PermissionError) as _:
+                continue
+            self.song_index.remove(video_id)
+            removed_count += 1
+        return removed_count
+
+    def reserve(self, video_id: str, check_func):
+        """
+        Mark a song as needed at once and call a function while no eviction can run, with a shared index the
+        other processes only know the needed songs of the last publication and could evict a song taken from
+        the cache before the next one
+
+        params :
+            - video_id: str = The needed video id
+            - check_func = The function verifying or adding the song file in the cache
+
+        return -> The result of the check function
+        """
+
+        with self.evict_lock:
+            if not self.song_index.shared:
+                return check_func()
+
+            with lock.FileLock("cache", poll_delay=0.05):
+                self.song_index.reserve_needed(self.owner, video_id)
+                return check_func()
+
+    def evict(self, needed: set) -> None:
+        """
+        Evict the least recently played songs until the cache fits in its budget
+
+        params :
+            - needed: set = The video ids that must be kept
+        """
+
+        # Verify the cache budget
+        entries: list = self.song_index.get_all()
+        total_size: int = sum(entry["size"] for entry in entries)
+        file_count: int = len(entries)
+        if total_size <= self.max_size and file_count <= self.max_files:
+            return
+
+        # Evict the unneeded songs from the least recently played
+        entries.sort(key=lambda e: e["last_played"])
+        for entry in entries:
+            if total_size <= self.max_size and file_count <= self.max_files:
+                break
+            if entry["video_id"] in needed:
+                continue
+
+            try:
+                os.remove(entry["path"])
+            except FileNotFoundError as _:
+                pass
+            self.song_index.remove(entry["video_id"])
+            total_size -= entry["size"]
+            file_count -= 1
+            self.evictions += 1
+            self.evicted_bytes += entry["size"]
+            logging.getLogger(LOGGER_NAME).info("Evict " + entry["video_id"] + " from the song cache")
+
+    def stats(self) -> dict:
+        """
+        Get the cache usage and the eviction counters
+
+        return -> dict = The cache statistics
+        """
+
+        entries: list = self.song_index.get_all()
+        return {
+            "files": len(entries),
+            "size": sum(entry["size"] for entry in entries),
+            "max_files": self.max_files,
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes
+        }
+
+    def stop(self) -> None:
+        """
+        Stop the manager thread
+        """
+
+        self.running = False
+        self.wake_event.set()
+
+        # Release the songs needed by this process
+        if self.song_index.shared:
+            try:
+                self.song_index.publish_needed(self.owner, set())
+            except sqlite3.Error as _:
+                pass
+
+
+class TitleIndex:
+    """
+    TitleIndex class.
+
+    This class is an inverted index of the known video titles, it answers the searches without the Youtube API
+    when the quota is low
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, max_entries: int):
+        """
+        Create a new empty index
+
+        params :
+            - max_entries: int = The maximum number of videos, the oldest ones are dropped first
+        """
+
+        # Assign the attributes
+        self.max_entries: int = max_entries
+        self.lock: threading.Lock = threading.Lock()
+
+        # The video details by video id in their adding order and the video ids of each word
+        self.videos: collections.OrderedDict = collections.OrderedDict()
+        self.words: dict = dict()
+
+    # ----- Class methods -----
+
+    @staticmethod
+    def get_words(text: str) -> set:
+        """
+        Get the normalized words of a text
+
+        params :
+            - text: str = The text
+
+        return -> set = The lower case words
+        """
+
+        return set(re.findall(r"\w+", text.lower()))
+
+    def add(self, video_id: str, details: dict) -> None:
+        """
+        Add or replace a video in the index
+
+        params :
+            - video_id: str = The video id
+            - details: dict = The video details with the "title", "channel_title" and "duration" keys
+        """
+
+        with self.lock:
+            self.remove_locked(video_id)
+            self.videos[video_id] = details
+            for word in self.get_words(details["title"] + " " + details["channel_title"]):
+                self.words.setdefault(word, set()).add(video_id)
+
+            # Drop the oldest videos
+            while len(self.videos) > self.max_entries:
+                self.remove_locked(next(iter(self.videos)))
+
+    def remove_locked(self, video_id: str) -> None:
+        """
+        Remove a video from the index if it exists, the lock must be held
+
+        params :
+            - video_id: str = The video id
+        """
+
+        details: dict = self.videos.pop(video_id, None)
+        if details is None:
+            return
+        for word in self.get_words(details["title"] + " " + details["channel_title"]):
+            video_ids: set = self.words.get(word, None)
+            if video_ids is not None:
+                video_ids.discard(video_id)
+                if len(video_ids) == 0:
+                    del self.words[word]
+
+    def search(self, query: str, max_results: int, is_preferred=None) -> list:
+        """
+        Find the videos whose title or channel contain all the query words
+
+        params :
+            - query: str = The search phrase
+            - max_results: int = The maximum number of results
+            - is_preferred = The function telling if a video id goes first (i.e. it is downloaded) or None
+
+        return -> list = The result dicts like the Youtube searches, the most recently added videos first
+        """
+
+        words: list = sorted(self.get_words(query), key=lambda w: len(self.words.get(w, ())))
+        if len(words) == 0:
+            return list()
+
+        with self.lock:
+            # Intersect the video ids of the words from the rarest one
+            found: set = set(self.words.get(words[0], ()))
+            for word in words[1:]:
+                if len(found) == 0:
+                    break
+                found &= self.words.get(word, set())
+            ordered: list = [video_id for video_id in reversed(self.videos) if video_id in found]
+            details_list: list = [(video_id, self.videos[video_id]) for video_id in ordered]
+
+        if is_preferred is not None:
+            details_list.sort(key=lambda item: not is_preferred(item[0]))
+
+        return [
+            {
+                "id": video_id,
+                "title": details["title"],
+                "channel_title": details["channel_title"],
+                "description": "",
+                "duration": details["duration"]
+            }
+            for video_id, details in details_list[:max_results]
+        ]
+
+    def __len__(self) -> int:
+        """
+        Get the number of indexed videos
+
+        return -> int = The number of videos
+        """
+
+        return len(self.videos)
@@ -0,0 +1,282 @@
+from dj_bot import LOGGER_NAME
+
+import threading
+import logging
+import json
+import os
+
+
+class StateJournal:
+    """
+    StateJournal class.
+
+    This class persists the bot state as an append-only journal of mutations, each mutation is written as one
+    json line and the journal is compacted in a snapshot when it grows
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, journal_file: str, compact_threshold: int = 1000):
+        """
+        Create a new journal on a file
+
+        params :
+            - journal_file: str = The journal file path
+            - compact_threshold: int = The number of mutations after which the journal is compacted
+        """
+
+        # Assign the attributes
+        self.journal_file: str = journal_file
+        self.compact_threshold: int = compact_threshold
+        self.lock: threading.Lock = threading.Lock()
+        self.file = None
+        self.record_count: int = 0
+        self.compacting: bool = False
+
+        # The lines waiting for the writer thread, it is the only thread writing or replacing the file
+        self.condition: threading.Condition = threading.Condition(self.lock)
+        self.buffer: list = list()
+        self.sync_needed: bool = False
+        self.writer: threading.Thread = None
+        self.closing: bool = False
+
+        # The state rebuilt from the mutations
+        self.current: dict = None
+        self.queue: dict = dict()
+        self.banned: list = list()
+
+        # The key given to the queued songs written without queue id
+        self.last_key: int = 0
+
+    # ----- Class methods -----
+
+    def apply(self, record: dict) -> None:
+        """
+        Apply a mutation to the journal state
+
+        params :
+            - record: dict = The mutation record
+        """
+
+        op: str = record["op"]
+        if op == "snapshot":
+            self.current = record["current"]
+            self.queue = {self.get_queue_key(sng): sng for sng in record["queue"]}
+            self.banned = list(record["banned"])
+        elif op == "add":
+            self.queue[self.get_queue_key(record["song"])] = record["song"]
+        elif op == "remove":
+            if "qid" in record:
+                self.queue.pop(record["qid"], None)
+            elif 0 <= record["index"] < len(self.queue):
+                del self.queue[list(self.queue)[record["index"]]]
+        elif op == "clear":
+            self.queue.clear()
+        elif op == "play":
+            # The journals written before the queue ids play the first added song
+            key = record.get("qid", next(iter(self.queue), None))
+            if key in self.queue:
+                self.current = self.queue.pop(key)
+        elif op == "end":
+            self.current = None
+        elif op == "position":
+            if self.current is not None:
+                self.current = dict(self.current)
+                self.current["offset"] = record["offset"]
+        elif op == "ban":
+            self.banned.append(record["user"])
+        elif op == "unban":
+            self.banned = [user for user in self.banned if user != record["user"]]
+
+    def get_queue_key(self, song_dict: dict) -> int:
+        """
+        Get the key of a queued song in the journal state
+
+        params :
+            - song_dict: dict = The song dict
+
+        return -> int = The song queue id or a new negative key if the song was written without it
+        """
+
+        if song_dict.get("qid", None) is not None:
+            return song_dict["qid"]
+        self.last_key -= 1
+        return self.last_key
+
+    def load(self) -> dict:
+        """
+        Replay the journal file and open it to append the next mutations
+
+        return -> dict = The replayed state with the "current", "queue" and "banned" keys or None if there is
+                         no journal
+        """
+
+        found: bool = False
+        try:
+            with open(self.journal_file, mode="r") as journal_file:
+                found = True
+                for line in journal_file:
+                    try:
+                        self.apply(json.loads(line))
+                        self.record_count += 1
+                    except (ValueError, KeyError, TypeError) as _:
+                        # A crash can leave a partially written last line
+                        logging.getLogger(LOGGER_NAME).warning("Ignore a corrupted journal record")
+        except FileNotFoundError as _:
+            pass
+
+        self.file = open(self.journal_file, mode="a")
+        self.writer = threading.Thread(target=self.write_loop, name="dj_journal_writer", daemon=True)
+        self.writer.start()
+        if not found:
+            return None
+        return {"current": self.current, "queue": list(self.queue.values()), "banned": list(self.banned)}
+
+    def record(self, op: str, **fields) -> None:
+        """
+        Apply a mutation and queue it for the writer thread, the caller never waits for the disk
+
+        params :
+            - op: str = The mutation name
+            - fields = The mutation parameters
+        """
+
+        record: dict = {"op": op}
+        record.update(fields)
+
+        with self.lock:
+            self.apply(record)
+            if self.writer is not None:
+                self.buffer.append(json.dumps(record) + "\n")
+                # The positions are saved often and losing the last one is harmless, they are not synced alone
+                if op != "position":
+                    self.sync_needed = True
+                self.condition.notify()
+            self.record_count += 1
+
+            # Compact the journal in background when it is too long
+            if self.record_count > self.compact_threshold:
+                self.request_compaction_locked()
+
+    def request_compaction(self) -> None:
+        """
+        Ask the writer thread to replace the journal by a snapshot of its state
+        """
+
+        with self.lock:
+            self.request_compaction_locked()
+
+    def request_compaction_locked(self) -> None:
+        """
+        Ask the writer thread to compact the journal, the lock must be held
+        """
+
+        if self.writer is not None and not self.compacting:
+            self.compacting = True
+            self.condition.notify()
+
+    def write_loop(self) -> None:
+        """
+        The writer thread function, it compacts the journal when it is asked and appends the queued lines in
+        groups and syncs each group once, a requested snapshot is always written before the next lines
+        """
+
+        while True:
+            with self.lock:
+                while len(self.buffer) == 0 and not self.compacting and not self.closing:
+                    self.condition.wait()
+                compact: bool = self.compacting
+                lines: list = self.buffer
+                sync: bool = self.sync_needed
+                if not compact:
+                    self.buffer = list()
+                    self.sync_needed = False
+
+            try:
+                if compact:
+                    self.compact()
+                elif len(lines) > 0:
+                    self.file.write("".join(lines))
+                    self.file.flush()
+                    if sync:
+                        os.fsync(self.file.fileno())
+                else:
+                    # The journal is closing and every line is written
+                    self.file.close()
+                    return
+            except OSError as e:
+                logging.getLogger(LOGGER_NAME).error("Cannot write the journal " + self.journal_file + " : " + str(e))
+
+    def reset(self, current: dict, queue: list, banned: list) -> None:
+        """
+        Replace the journal state, the writer thread saves it in a snapshot before the next mutations
+
+        params :
+            - current: dict = The current song dict or None
+            - queue: list = The queued song dicts
+            - banned: list = The banned user names
+        """
+
+        with self.lock:
+            self.apply({"op": "snapshot", "current": current, "queue": queue, "banned": banned})
+            self.request_compaction_locked()
+
+    def compact(self) -> None:
+        """
+        Replace the journal by a snapshot of its state, the new file is written aside then renamed, only the
+        writer thread calls it. The state is copied under the lock and the file is written outside of it, the
+        mutations made meanwhile wait in the buffer and are appended to the new file
+        """
+
+        with self.lock:
+            snapshot: str = json.dumps({
+                "op": "snapshot",
+                "current": self.current,
+                "queue": list(self.queue.values()),
+                "banned": self.banned
+            }) + "\n"
+
+            # The waiting lines are in the snapshot
+            snapshot_count: int = len(self.buffer)
+
+        try:
+            # Write the snapshot in a temporary file
+            tmp_file: str = self.journal_file + ".tmp"
+            with open(tmp_file, mode="w") as journal_file:
+                journal_file.write(snapshot)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+            # Replace the journal and append to the new one
+            self.file.close()
+            os.replace(tmp_file, self.journal_file)
+            self.file = open(self.journal_file, mode="a")
+
+            # Only append the lines added since the snapshot
+            with self.lock:
+                del self.buffer[:snapshot_count]
+                self.record_count = 1 + len(self.buffer)
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    def close(self) -> None:
+        """
+        Stop the journal, the writer thread writes the waiting lines and closes the file without blocking the
+        caller
+        """
+
+        with self.lock:
+            self.closing = True
+            self.condition.notify()
+
+    def wait_closed(self, timeout: float = None) -> None:
+        """
+        Wait for the writer thread of a closed journal to write its last lines
+
+        params :
+            - timeout: float = The maximum waiting time in seconds, None to wait forever
+        """
+
+        if self.writer is not None:
+            self.writer.join(timeout)
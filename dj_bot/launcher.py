@@ -0,0 +1,109 @@
+from dj_bot import bot
+from dj_bot import LOGGER_NAME
+
+import multiprocessing
+import logging
+
+
+def run_shards(bot_kwargs: dict, shard_ids: list, shard_count: int, log_file: str) -> None:
+    """
+    The worker process function, it runs a bot on a range of shards
+
+    params :
+        - bot_kwargs: dict = The DJBot parameters
+        - shard_ids: list = The shards run by the process
+        - shard_count: int = The total number of shards
+        - log_file: str = The log file of the process or None to log in the console
+    """
+
+    # Configure the process logger, the spawned processes don't inherit the configuration
+    if log_file is not None:
+        log_file += "." + str(shard_ids[0])
+    logging.basicConfig(filemode="w", filename=log_file, level=logging.INFO, force=True)
+
+    # Create and start the bot
+    dj_bot = bot.DJBot(shard_ids=shard_ids, shard_count=shard_count, shared_cache=True, **bot_kwargs)
+    dj_bot.start()
+
+
+class ShardLauncher:
+    """
+    ShardLauncher class.
+
+    This class starts the bot in several processes, each process runs a range of the discord shards and all of
+    them share the song cache
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, bot_kwargs: dict, shard_count: int, process_count: int, log_file: str = None):
+        """
+        Create a new launcher
+
+        params :
+            - bot_kwargs: dict = The DJBot parameters
+            - shard_count: int = The total number of shards
+            - process_count: int = The number of processes, it is reduced to the number of shards if needed
+            - log_file: str = The log file prefix or None to log in the console
+        """
+
+        # Assign the attributes
+        self.bot_kwargs: dict = bot_kwargs
+        self.shard_count: int = shard_count
+        self.process_count: int = min(process_count, shard_count)
+        self.log_file: str = log_file
+        self.processes: list = list()
+
+    # ----- Class methods -----
+
+    def get_shard_ranges(self) -> list:
+        """
+        Split the shards in consecutive ranges of the same size, one for each process
+
+        return -> list = The list of the shard id lists
+        """
+
+        base_size, remainder = divmod(self.shard_count, self.process_count)
+        ranges: list = list()
+        start: int = 0
+        for i in range(self.process_count):
+            size: int = base_size + (1 if i < remainder else 0)
+            ranges.append(list(range(start, start + size)))
+            start += size
+        return ranges
+
+    def start(self) -> None:
+        """
+        Start the processes and wait for them to stop
+        """
+
+        # Spawn fresh interpreters, the processes don't inherit the state of the launcher
+        context = multiprocessing.get_context("spawn")
+        for shard_ids in self.get_shard_ranges():
+            process = context.Process(
+                target=run_shards,
+                args=(self.bot_kwargs, shard_ids, self.shard_count, self.log_file),
+                name="dj_shards_" + str(shard_ids[0])
+            )
+            process.start()
+            self.processes.append(process)
+            logging.getLogger(LOGGER_NAME).info(
+                "Start the shards " + str(shard_ids[0]) + " to " + str(shard_ids[-1]) + " in the process " +
+                str(process.pid))
+
+        try:
+            for process in self.processes:
+                process.join()
+        except KeyboardInterrupt as _:
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stop all processes
+        """
+
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,114 @@
+from dj_bot import LOCK_DIR
+
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    FileLock class.
+
+    This class is an exclusive lock shared between the bot processes, it is held on a file of the lock
+    directory and released by the system if the holding process dies
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, name: str, poll_delay: float = 0.5):
+        """
+        Create a new lock, the lock file is opened when the lock is acquired
+
+        params :
+            - name: str = The lock name, processes using the same name share the lock
+            - poll_delay: float = The delay in seconds between two tries when waiting for the lock
+        """
+
+        # Assign the attributes
+        self.path: str = LOCK_DIR + name + ".lock"
+        self.poll_delay: float = poll_delay
+        self.fd: int = None
+
+    # ----- Class methods -----
+
+    def try_acquire(self) -> bool:
+        """
+        Try to take the lock without waiting
+
+        return -> bool = True if the lock is taken, False if another process holds it
+        """
+
+        if self.fd is not None:
+            return True
+
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError as _:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        return True
+
+    def acquire(self, timeout: float = None, abort_func=None) -> bool:
+        """
+        Wait for the lock and take it
+
+        params :
+            - timeout: float = The maximum waiting time in seconds, None to wait forever
+            - abort_func = A function called between two tries, the waiting stops when it returns True
+
+        return -> bool = True if the lock is taken, False if the waiting timed out or was aborted
+        """
+
+        start_time: float = time.monotonic()
+        while not self.try_acquire():
+            if timeout is not None and time.monotonic() - start_time > timeout:
+                return False
+            if abort_func is not None and abort_func():
+                return False
+            time.sleep(self.poll_delay)
+        return True
+
+    def release(self) -> None:
+        """
+        Release the lock if it is held
+        """
+
+        if self.fd is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        """
+        Wait for the lock in a with statement
+        """
+
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """
+        Release the lock at the end of a with statement
+        """
+
+        self.release()
@@ -0,0 +1,358 @@
+from dj_bot import LOGGER_NAME
+
+import discord
+import collections
+import asyncio
+import logging
+import time
+
+# ----- The discord limits -----
+
+MAX_MESSAGE_LENGTH: int = 2000
+MAX_BULK_DELETE: int = 100
+
+# ----- The markdown code block delimiter -----
+
+CODE_FENCE: str = "```"
+MAX_LINE_LENGTH: int = MAX_MESSAGE_LENGTH - 200
+
+
+def split_message(message: str) -> list:
+    """
+    Split a message too long for discord at its line boundaries, a code block cut between two parts is closed
+    at the end of the first one and opened again at the start of the next one
+
+    params :
+        - message: str = The message to split
+
+    return -> list = The message parts, each one fits in a discord message
+    """
+
+    if len(message) <= MAX_MESSAGE_LENGTH:
+        return [message]
+
+    # Cut the lines that don't fit in a message alone
+    lines: list = list()
+    for line in message.split("\n"):
+        while len(line) > MAX_LINE_LENGTH:
+            lines.append(line[:MAX_LINE_LENGTH])
+            line = line[MAX_LINE_LENGTH:]
+        lines.append(line)
+
+    parts: list = list()
+    current: str = None
+    fence: str = None
+    for line in lines:
+        # Follow the code block opened before the line
+        next_fence: str = fence
+        if line.startswith(CODE_FENCE):
+            if fence is not None:
+                next_fence = None
+            elif line.count(CODE_FENCE) == 1:
+                next_fence = line
+
+        # Start a new part if the line and the closing of its code block don't fit
+        candidate: str = line if current is None else current + "\n" + line
+        closing_length: int = len(CODE_FENCE) + 1 if next_fence is not None else 0
+        if current is not None and len(candidate) + closing_length > MAX_MESSAGE_LENGTH:
+            parts.append(current + ("\n" + CODE_FENCE if fence is not None else ""))
+            current = fence + "\n" + line if fence is not None else line
+        else:
+            current = candidate
+        fence = next_fence
+
+    parts.append(current)
+    return parts
+
+
+class RateBucket:
+    """
+    RateBucket class.
+
+    This class follows a discord rate limit bucket, it allows a number of requests in a sliding period
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, capacity: int, period: float):
+        """
+        Create a new bucket
+
+        params :
+            - capacity: int = The number of requests allowed in the period
+            - period: float = The period in seconds
+        """
+
+        # Assign the attributes
+        self.period: float = period
+        self.request_times: collections.deque = collections.deque(maxlen=capacity)
+
+    # ----- Class methods -----
+
+    def get_delay(self) -> float:
+        """
+        Get the time to wait before the next request
+
+        return -> float = The delay in seconds, 0 if a request can be made now
+        """
+
+        if len(self.request_times) < self.request_times.maxlen:
+            return 0
+        return max(0.0, self.request_times[0] + self.period - time.monotonic())
+
+    async def acquire(self) -> None:
+        """
+        Wait until a request can be made and count it
+        """
+
+        delay: float = self.get_delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.get_delay()
+        self.request_times.append(time.monotonic())
+
+
+class ChannelOutbox:
+    """
+    ChannelOutbox class.
+
+    This class sends the bot messages and deletes the request messages of one channel in a single task, the
+    notices queued while the task waits for the rate limit are merged and the deletions are made in bulk
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, outbox, channel: discord.TextChannel):
+        """
+        Create a new channel outbox
+
+        params :
+            - outbox: MessageOutbox = The outbox that contains the channel outbox
+            - channel: discord.TextChannel = The channel
+        """
+
+        # Assign the attributes
+        self.outbox: MessageOutbox = outbox
+        self.channel: discord.TextChannel = channel
+        self.send_bucket: RateBucket = RateBucket(outbox.send_rate, outbox.send_period)
+        self.delete_bucket: RateBucket = RateBucket(outbox.delete_rate, outbox.delete_period)
+        self.task: asyncio.Task = None
+
+        # The waiting notices with their queuing time and the waiting messages to delete
+        self.notices: collections.deque = collections.deque()
+        self.deletions: collections.deque = collections.deque()
+
+    # ----- Class methods -----
+
+    def get_depth(self) -> int:
+        """
+        Get the number of waiting operations
+
+        return -> int = The number of notices and deletions
+        """
+
+        return len(self.notices) + len(self.deletions)
+
+    def wake(self) -> None:
+        """
+        Start the task of the channel if it isn't running
+        """
+
+        if self.task is None:
+            self.task = self.outbox.loop.create_task(self.run())
+
+    async def run(self) -> None:
+        """
+        The channel task function, it sends the notices before deleting the messages so the answers are not
+        delayed by the cleaning and it stops when there is nothing left to do
+        """
+
+        try:
+            while len(self.notices) > 0 or len(self.deletions) > 0:
+                if len(self.notices) > 0:
+                    await self.send_bucket.acquire()
+                    await self.send_notices()
+                else:
+                    await self.delete_bucket.acquire()
+                    await self.delete_messages()
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).error("The outbox of " + str(self.channel) + " failed", exc_info=e)
+        finally:
+            self.task = None
+
+    def merge_notices(self) -> tuple:
+        """
+        Take the first waiting notices that fit in one message
+
+        return -> tuple = The merged message and the queuing times of its notices
+        """
+
+        text, queue_time = self.notices.popleft()
+        queue_times: list = [queue_time]
+        while len(self.notices) > 0 and len(text) + 1 + len(self.notices[0][0]) <= MAX_MESSAGE_LENGTH:
+            next_text, queue_time = self.notices.popleft()
+            text += "\n" + next_text
+            queue_times.append(queue_time)
+        return text, queue_times
+
+    async def send_notices(self) -> None:
+        """
+        Send the first waiting notices merged in one message
+        """
+
+        text, queue_times = self.merge_notices()
+        try:
+            await self.channel.send(content=text)
+        except discord.Forbidden as _:
+            logging.getLogger(LOGGER_NAME).warning("Cannot send message in " + str(self.channel) + " : Forbidden")
+            return
+        except discord.HTTPException as e:
+            logging.getLogger(LOGGER_NAME).warning("Cannot send message in " + str(self.channel) + " : " + str(e))
+            return
+
+        # Record the delay between the queuing and the sending of each notice
+        now: float = time.monotonic()
+        for queue_time in queue_times:
+            self.outbox.latencies.append(now - queue_time)
+        self.outbox.sent_count += len(queue_times)
+        self.outbox.message_count += 1
+
+    async def delete_messages(self) -> None:
+        """
+        Delete the waiting messages, several messages are deleted with one bulk request
+        """
+
+        messages: list = list()
+        while len(self.deletions) > 0 and len(messages) < MAX_BULK_DELETE:
+            messages.append(self.deletions.popleft())
+
+        try:
+            if len(messages) == 1:
+                await messages[0].delete()
+            else:
+                await self.channel.delete_messages(messages)
+        except discord.Forbidden as _:
+            logging.getLogger(LOGGER_NAME).warning("Cannot remove message from the listening channel : Forbidden")
+        except discord.NotFound as _:
+            pass
+        except discord.HTTPException as _:
+            logging.getLogger(LOGGER_NAME).warning("Cannot remove message from the listening channel : HTTPError")
+
+
+class MessageOutbox:
+    """
+    MessageOutbox class.
+
+    This class queues the outbound messages of the bot per channel to stay in the discord rate limits instead
+    of starting one request task per message
+    """
+
+    # ----- Constructor -----
+
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            send_rate: int = 5,
+            send_period: float = 5,
+            delete_rate: int = 5,
+            delete_period: float = 5,
+            max_latencies: int = 200
+    ):
+        """
+        Create a new outbox
+
+        params :
+            - loop: asyncio.AbstractEventLoop = The event loop running the channel tasks
+            - send_rate: int = The number of messages sent in a channel per period
+            - send_period: float = The send rate limit period in seconds
+            - delete_rate: int = The number of delete requests in a channel per period
+            - delete_period: float = The delete rate limit period in seconds
+            - max_latencies: int = The number of send latencies kept for the statistics
+        """
+
+        # Assign the attributes
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.send_rate: int = send_rate
+        self.send_period: float = send_period
+        self.delete_rate: int = delete_rate
+        self.delete_period: float = delete_period
+        self.channels: dict = dict()
+
+        # The statistics
+        self.latencies: collections.deque = collections.deque(maxlen=max_latencies)
+        self.sent_count: int = 0
+        self.message_count: int = 0
+
+    # ----- Class methods -----
+
+    def get_channel(self, channel: discord.TextChannel) -> ChannelOutbox:
+        """
+        Get the outbox of a channel and create it if needed
+
+        params :
+            - channel: discord.TextChannel = The channel
+
+        return -> ChannelOutbox = The channel outbox
+        """
+
+        channel_outbox: ChannelOutbox = self.channels.get(channel.id, None)
+        if channel_outbox is None:
+            channel_outbox = ChannelOutbox(self, channel)
+            self.channels[channel.id] = channel_outbox
+        return channel_outbox
+
+    def send(self, channel: discord.TextChannel, message: str) -> None:
+        """
+        Queue a message to send, this method must be called from the event loop
+
+        params :
+            - channel: discord.TextChannel = The channel to send the message in
+            - message: str = The message to send
+        """
+
+        channel_outbox: ChannelOutbox = self.get_channel(channel)
+        queue_time: float = time.monotonic()
+        for part in split_message(message):
+            channel_outbox.notices.append((part, queue_time))
+        channel_outbox.wake()
+
+    def delete(self, message: discord.Message) -> None:
+        """
+        Queue a message to delete, this method must be called from the event loop
+
+        params :
+            - message: discord.Message = The message to delete
+        """
+
+        channel_outbox: ChannelOutbox = self.get_channel(message.channel)
+        channel_outbox.deletions.append(message)
+        channel_outbox.wake()
+
+    def remove_channel(self, channel_id: int) -> None:
+        """
+        Drop the outbox of a channel and its waiting operations
+
+        params :
+            - channel_id: int = The channel id
+        """
+
+        channel_outbox: ChannelOutbox = self.channels.pop(channel_id, None)
+        if channel_outbox is not None and channel_outbox.task is not None:
+            channel_outbox.task.cancel()
+
+    def stats(self) -> dict:
+        """
+        Get the outbox statistics
+
+        return -> dict = The number of waiting operations, of sent notices and messages and the average and
+                         maximum send latencies in seconds
+        """
+
+        latencies: list = list(self.latencies)
+        return {
+            "queued": sum(channel_outbox.get_depth() for channel_outbox in self.channels.values()),
+            "sent": self.sent_count,
+            "messages": self.message_count,
+            "average": sum(latencies) / len(latencies) if len(latencies) > 0 else None,
+            "max": max(latencies) if len(latencies) > 0 else None
+        }
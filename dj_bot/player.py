@@ -0,0 +1,1162 @@
+from dj_bot import audio, bot, journal, lock, quota, session, song, song_queue, utils
+from dj_bot import SAVE_FILE, JOURNAL_FILE, LOGGER_NAME
+
+import discord
+import threading
+import json
+import time
+import os
+import logging
+
+# ----- DJPlayer states -----
+
+PAUSE_STATE: int = 0
+PLAY_STATE: int = 1
+IDLE_STATE: int = 2
+
+# ----- DJPlayer events -----
+
+READY_EVENT: str = "ready"
+FAILED_EVENT: str = "failed"
+END_EVENT: str = "end"
+SKIP_EVENT: str = "skip"
+PAUSE_EVENT: str = "pause"
+RESUME_EVENT: str = "resume"
+SEEK_EVENT: str = "seek"
+POP_EVENT: str = "pop"
+CLEAR_EVENT: str = "clear"
+FIRST_FRAME_EVENT: str = "first_frame"
+
+
+class DJPlayer:
+    """
+    DJPlayer class.
+
+    This class is the music player of one guild, it contains the queue, the playing state, the voice client and
+    the users data of the guild. The player state is a state machine changed only on the event loop, the
+    download and voice threads post events to it
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, dj_bot, guild_id: int, req_chan: discord.TextChannel, play_chan_client: discord.VoiceClient):
+        """
+        Create a new player for a guild
+
+        params :
+            - dj_bot: dj_bot.DJBot = The bot that contains the player
+            - guild_id: int = The id of the guild
+            - req_chan: discord.TextChannel = The request channel of the guild
+            - play_chan_client: discord.VoiceClient = The voice client connected to the playing channel
+        """
+
+        # Assign the attributes
+        self.dj_bot: bot.DJBot = dj_bot
+        self.guild_id: int = guild_id
+        self.req_chan: discord.TextChannel = req_chan
+        self.play_chan_client: discord.VoiceClient = play_chan_client
+
+        self.state: int = IDLE_STATE
+        self.song_queue: song_queue.SongQueue = song_queue.SongQueue(dj_bot.round_robin_queue)
+        self.current_song: song.Song = None
+        self.banned_user: list = list()
+        self.journal: journal.StateJournal = journal.StateJournal(JOURNAL_FILE + "_" + str(guild_id))
+        self.restore_time: float = None
+        self.closed: bool = False
+
+        # The number of the played song, the end events of the previous songs are ignored
+        self.play_count: int = 0
+
+        # The source of the next song opened while the current one is playing
+        self.next_song: song.Song = None
+        self.next_source: audio.PrimedAudioSource = None
+        self.next_lock: threading.Lock = threading.Lock()
+
+        # The source of the playing song, it counts the frames to know the position
+        self.current_source: audio.MeteredAudioSource = None
+
+        # The current song waiting to be ready again because its streamed file is gone
+        self.waiting_song: song.Song = None
+
+    # ----- Class methods -----
+
+    # --- Internal methods
+
+    def is_banned(self, user: discord.Member) -> bool:
+        """
+        Get if a user is banned or not
+
+        params :
+            - user: discord.Member = A discord member
+
+        return -> bool = True if the user is banned, False else
+        """
+
+        # Get the user real name
+        user_name = utils.get_user_fullname(user)
+
+        # Return if the user is in the banned list
+        return user_name in self.banned_user
+
+    def add_song(self, sng: song.Song, feedback=True, journal_it=True, download=True) -> None:
+        """
+        Add a song to the current queue with size verification adn download it
+
+        params :
+            - sng: dj_bot.song.Song = A song you want to add to the queue
+            - feedback: bool = If a message is sent to the request channel
+            - journal_it: bool = If the addition is written in the state journal
+            - download: bool = If the download starts now, else it starts when the song approaches the queue head
+        """
+
+        if len(self.song_queue) < self.dj_bot.queue_max_size:
+            sng.ready_func = lambda ready_sng: self.post_event(READY_EVENT, ready_sng)
+            sng.failure_func = lambda failed_sng: self.post_event(FAILED_EVENT, failed_sng)
+            if self.dj_bot.progressive_playback:
+                sng.stream_buffer_size = self.dj_bot.stream_buffer_size
+            self.song_queue.append(sng)
+            if journal_it:
+                self.journal.record("add", song=self.get_journal_dict(sng))
+            if download:
+                self.request_download(sng)
+            if feedback:
+                self.send_message("**" + sng.user + "** add the song **" + sng.title + "** to the queue  :smile:")
+        else:
+            if feedback:
+                self.send_error_message("Sorry **" + sng.user + "**, but the queue is full  :disappointed_relieved:")
+
+    def get_journal_dict(self, sng: song.Song) -> dict:
+        """
+        Get the dict of a queued song written in the state journal
+
+        params :
+            - sng: song.Song = The queued song
+
+        return -> dict = The song dict with its queue id
+        """
+
+        song_dict: dict = sng.to_dict()
+        song_dict["qid"] = sng.queue_id
+        return song_dict
+
+    def request_download(self, sng: song.Song) -> None:
+        """
+        Start the download of a song if it isn't already requested
+
+        params :
+            - sng: song.Song = The song to download
+        """
+
+        if not sng.download_requested:
+            sng.download_requested = True
+            self.dj_bot.youtube_client.download_song(sng)
+
+    def schedule_downloads(self) -> None:
+        """
+        Request the download of the songs close to the queue head and make the cached songs ready
+        """
+
+        for i, sng in enumerate(self.song_queue):
+            if not sng.download_requested:
+                if i < self.dj_bot.download_ahead or self.dj_bot.youtube_client.get_cached_song(sng.video_id) is not None:
+                    self.request_download(sng)
+
+    def get_song_priority(self, video_id: str) -> int:
+        """
+        Get the download priority of a video according to its position in the queue
+
+        params :
+            - video_id: str = The video id
+
+        return -> int = The position of the first song with this video, the lowest is downloaded first
+        """
+
+        if self.current_song is not None and self.current_song.video_id == video_id:
+            return -1
+        return self.song_queue.get_position(video_id)
+
+    def get_needed_video_ids(self) -> set:
+        """
+        Get the video ids of the songs that are playing or queued, their files must stay in the cache
+
+        return -> set = The needed video ids
+        """
+
+        needed: set = self.song_queue.get_video_ids()
+        current: song.Song = self.current_song
+        if current is not None:
+            needed.add(current.video_id)
+        return needed
+
+    def post_event(self, event: str, *args) -> None:
+        """
+        Send an event to the player state machine, this method can be called from any thread and the event is
+        handled on the event loop in the posting order
+
+        params :
+            - event: str = The event name
+            - args = The event parameters
+        """
+
+        try:
+            self.dj_bot.discord_client.loop.call_soon_threadsafe(self.handle_event, event, args)
+        except RuntimeError as _:
+            # The loop is closed, the bot is stopping
+            pass
+
+    def handle_event(self, event: str, args: tuple) -> None:
+        """
+        The player state machine, every change of the queue head, the current song and the state is made here
+
+        params :
+            - event: str = The event name
+            - args: tuple = The event parameters
+        """
+
+        if self.closed:
+            return
+
+        try:
+            if event == READY_EVENT:
+                self.on_song_ready(*args)
+            elif event == FAILED_EVENT:
+                self.on_song_failed(*args)
+            elif event == END_EVENT:
+                self.on_song_end(*args)
+            elif event == SKIP_EVENT:
+                self.skip_song()
+            elif event == PAUSE_EVENT:
+                self.on_pause()
+            elif event == RESUME_EVENT:
+                self.on_resume()
+            elif event == SEEK_EVENT:
+                self.on_seek(*args)
+            elif event == POP_EVENT:
+                self.on_pop(*args)
+            elif event == CLEAR_EVENT:
+                self.on_clear()
+            elif event == FIRST_FRAME_EVENT:
+                self.first_audio_frame(*args)
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).error("Cannot handle the player event " + event, exc_info=e)
+
+    def on_song_ready(self, sng: song.Song) -> None:
+        """
+        Handle a song that is downloaded or can be streamed
+
+        param :
+            - sng : song.Song = The song that is ready
+        """
+
+        if self.state == IDLE_STATE:
+            self.play_next()
+        elif sng is self.waiting_song and sng.is_ready:
+            # Open the current song again from its final file
+            self.waiting_song = None
+            self.play_song(sng)
+        else:
+            self.prefetch_next()
+
+    def on_song_failed(self, sng: song.Song) -> None:
+        """
+        Handle a song whose download failed, it is removed from the queue if it cannot be played
+
+        param :
+            - sng : song.Song = The failed song
+        """
+
+        # The current song cannot be ready again
+        if sng is self.waiting_song:
+            self.waiting_song = None
+            self.drop_current(RuntimeError("the download failed"))
+            self.play_next()
+            return
+
+        if sng.is_playable() or not self.song_queue.remove(sng):
+            return
+
+        self.journal.record("remove", qid=sng.queue_id)
+        self.send_message("Cannot download **" + sng.title + "**, it is removed from the queue  :confused:")
+        if self.state == IDLE_STATE:
+            self.play_next()
+        else:
+            self.schedule_downloads()
+            self.prefetch_next()
+
+    def on_song_end(self, play_id: int) -> None:
+        """
+        Handle the end of a song and play the next one
+
+        params :
+            - play_id: int = The number of the ended song
+        """
+
+        # Ignore the end of a song that was already replaced
+        if play_id != self.play_count:
+            return
+
+        if self.current_song is not None:
+            self.current_song = None
+            self.journal.record("end")
+        self.waiting_song = None
+        self.state = IDLE_STATE
+        self.play_next()
+
+    def play_next(self) -> None:
+        """
+        Play the queue head if the player is idle and the head can be played
+        """
+
+        while self.state == IDLE_STATE and self.song_queue.peek() is not None and self.song_queue.peek().is_playable():
+            self.current_song = self.song_queue.pop()
+            self.journal.record("play", qid=self.current_song.queue_id)
+            self.state = PLAY_STATE
+            try:
+                self.play_song(self.current_song)
+            except Exception as e:
+                self.drop_current(e)
+        self.schedule_downloads()
+        self.prefetch_next()
+
+    def drop_current(self, error: Exception) -> None:
+        """
+        Drop the current song that cannot be played, the caller plays the next one
+
+        params :
+            - error: Exception = The error raised when opening or playing the song
+        """
+
+        logging.getLogger(LOGGER_NAME).error("Cannot play " + self.current_song.video_id, exc_info=error)
+        self.send_message("Cannot play **" + self.current_song.title + "**  :confused:")
+        self.current_song = None
+        self.current_source = None
+        self.waiting_song = None
+        self.journal.record("end")
+        self.state = IDLE_STATE
+
+    def prefetch_next(self) -> None:
+        """
+        Open the source of the next song while the current one is playing to start it without gap
+        """
+
+        head: song.Song = self.song_queue.peek()
+        if self.state != IDLE_STATE and head is not None and head.is_ready:
+            self.prefetch_song(head)
+        else:
+            self.prefetch_song(None)
+
+    def first_audio_frame(self, sng: song.Song, frame_time: float) -> None:
+        """
+        Handle the first audio frame of a song, it records the time since the request. The frame time is taken
+        on the voice thread and posted to the event loop
+
+        params :
+            - sng: song.Song = The playing song
+            - frame_time: float = The time.monotonic() of the first frame
+        """
+
+        if self.restore_time is not None:
+            logging.getLogger(LOGGER_NAME).info(
+                "First audio frame after restore in " + "{:.2f}".format(frame_time - self.restore_time) + "s")
+            self.restore_time = None
+
+        self.dj_bot.first_audio_frame(sng, frame_time)
+
+    # --- Voice methods
+
+    def play_song(self, sng: song.Song):
+        """
+        Start opening the wanted song, it is played when its source is open
+
+        params :
+            - sng: song.Song = The song you want to play
+        """
+
+        # Start at the restored position if there is one
+        offset: float = sng.start_offset
+        sng.start_offset = 0
+        self.waiting_song = None
+
+        # The end events and the sources opened for the previous songs are ignored
+        self.play_count += 1
+        play_id: int = self.play_count
+        self.current_source = None
+
+        # Take the prefetched source if it is the wanted song and ready, a prefetch still opening is dropped
+        source: discord.AudioSource = None
+        with self.next_lock:
+            if self.next_song is sng:
+                if offset == 0:
+                    source = self.next_source
+                elif self.next_source is not None:
+                    self.next_source.cleanup()
+                self.next_song = None
+                self.next_source = None
+
+        self.dj_bot.source_executor.submit(self.open_source, sng, play_id, offset, source)
+
+    def open_source(self, sng: song.Song, play_id: int, offset: float, source: discord.AudioSource) -> None:
+        """
+        Open the source of a song in the source executor and send it to the event loop, the cache index is
+        updated here to not block the loop
+
+        params :
+            - sng: song.Song = The song to open
+            - play_id: int = The number of the played song
+            - offset: float = The position in seconds to start the song at
+            - source: discord.AudioSource = The prefetched source or None to open one
+        """
+
+        # Mark the song as recently played in the cache
+        try:
+            self.dj_bot.youtube_client.song_index.touch(sng.video_id)
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).warning("Cannot touch " + sng.video_id + " in the song index : " + str(e))
+
+        error: Exception = None
+        if source is None:
+            try:
+                source = sng.get_audio_source(offset)
+            except Exception as e:
+                error = e
+        self.call_on_loop(self.start_source, source, play_id, sng, offset, error)
+
+    def call_on_loop(self, func, source: discord.AudioSource, *args) -> None:
+        """
+        Call a function receiving a source on the event loop from another thread, the source is cleaned if the loop
+        is closed
+
+        params :
+            - func = The function to call with the source and the other arguments
+            - source: discord.AudioSource = The source given to the function
+            - args = The other arguments
+        """
+
+        try:
+            self.dj_bot.discord_client.loop.call_soon_threadsafe(func, source, *args)
+        except RuntimeError as _:
+            # The loop is closed, the bot is stopping
+            if source is not None:
+                source.cleanup()
+
+    def start_source(
+            self,
+            source: discord.AudioSource,
+            play_id: int,
+            sng: song.Song,
+            offset: float,
+            error: Exception
+    ) -> None:
+        """
+        Play the open source of the current song on the event loop
+
+        params :
+            - source: discord.AudioSource = The open source or None if it cannot be opened
+            - play_id: int = The number of the played song
+            - sng: song.Song = The played song
+            - offset: float = The position in seconds the source starts at
+            - error: Exception = The error raised when opening the source or None
+        """
+
+        # Drop the source of a song that was skipped or replaced while it was opening
+        if self.closed or play_id != self.play_count or self.state == IDLE_STATE:
+            if source is not None:
+                source.cleanup()
+            return
+
+        # Wait for the final file if the streamed one is gone, the song is opened again when it is ready
+        if isinstance(error, song.SongNotReady):
+            if sng.is_ready:
+                self.play_song(sng)
+            else:
+                logging.getLogger(LOGGER_NAME).info("Wait for the final file of " + sng.video_id + " : " + str(error))
+                sng.start_offset = offset
+                self.waiting_song = sng
+            return
+
+        try:
+            if error is not None:
+                raise error
+
+            # Wrap the source to measure the time to the first audio frame and the position, the voice thread
+            # only posts the frame time
+            self.current_source = audio.MeteredAudioSource(
+                source,
+                lambda t: self.post_event(FIRST_FRAME_EVENT, sng, t),
+                offset,
+                self.dj_bot.jitter_meter
+            )
+            self.play_chan_client.play(self.current_source, after=lambda _: self.post_event(END_EVENT, play_id))
+            if self.state == PAUSE_STATE:
+                self.pause_song()
+        except Exception as e:
+            if source is not None:
+                source.cleanup()
+            self.drop_current(e)
+            self.play_next()
+
+    def skip_song(self) -> None:
+        """
+        Skip the current song, a song whose source is still opening ends at once
+        """
+
+        if self.state != IDLE_STATE and self.current_source is None:
+            self.on_song_end(self.play_count)
+        else:
+            self.stop_song()
+
+    def seek_song(self, sng: song.Song, offset: float) -> None:
+        """
+        Move the playing song to a position, the source is opened in the source executor
+
+        params :
+            - sng: song.Song = The playing song
+            - offset: float = The wanted position in seconds
+        """
+
+        # The song is still opening, open it again at the position
+        if self.current_source is None:
+            sng.start_offset = offset
+            self.play_song(sng)
+            return
+
+        self.dj_bot.source_executor.submit(self.open_seek_source, sng, self.play_count, offset)
+
+    def open_seek_source(self, sng: song.Song, play_id: int, offset: float) -> None:
+        """
+        Open the source of the playing song at a position in the source executor and send it to the event loop
+
+        params :
+            - sng: song.Song = The playing song
+            - play_id: int = The number of the played song
+            - offset: float = The wanted position in seconds
+        """
+
+        try:
+            source: discord.AudioSource = sng.get_audio_source(offset)
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).error("Cannot seek " + sng.video_id, exc_info=e)
+            return
+        self.call_on_loop(self.replace_source, source, play_id, offset)
+
+    def replace_source(self, source: discord.AudioSource, play_id: int, offset: float) -> None:
+        """
+        Replace the source of the playing song on the event loop
+
+        params :
+            - source: discord.AudioSource = The source open at the position
+            - play_id: int = The number of the played song
+            - offset: float = The position in seconds the source starts at
+        """
+
+        # Drop the source if the song ended while it was opening
+        if self.closed or play_id != self.play_count or self.current_source is None:
+            source.cleanup()
+            return
+
+        # Replace the source without stopping the player to not trigger the next song, the old source is cleaned
+        # by the player thread because it can be reading it now
+        self.current_source.replace(source, offset)
+
+    def get_position(self) -> float:
+        """
+        Get the position of the playing song
+
+        return -> float = The position in seconds or None if no song is playing
+        """
+
+        if self.current_source is None:
+            return None
+        return self.current_source.get_position()
+
+    def prefetch_song(self, sng: song.Song) -> None:
+        """
+        Start opening and priming the source of the song that will be played after the current one
+
+        params :
+            - sng: song.Song = The next song or None to drop the prefetched source
+        """
+
+        with self.next_lock:
+            if self.next_song is sng:
+                return
+
+            # Drop the source of the previous next song
+            if self.next_source is not None:
+                self.next_source.cleanup()
+            self.next_song = None
+            self.next_source = None
+
+            if sng is not None and sng.start_offset == 0:
+                self.next_song = sng
+                self.dj_bot.source_executor.submit(self.open_next_source, sng)
+
+    def open_next_source(self, sng: song.Song) -> None:
+        """
+        Open and prime the source of the next song in the source executor and send it to the event loop
+
+        params :
+            - sng: song.Song = The next song
+        """
+
+        try:
+            source: audio.PrimedAudioSource = audio.PrimedAudioSource(sng.get_audio_source())
+        except Exception as e:
+            # The song is opened again when its turn comes
+            logging.getLogger(LOGGER_NAME).warning("Cannot prefetch " + sng.video_id + " : " + str(e))
+            return
+        self.call_on_loop(self.set_next_source, source, sng)
+
+    def set_next_source(self, source: audio.PrimedAudioSource, sng: song.Song) -> None:
+        """
+        Keep the prefetched source on the event loop if its song is still the next one
+
+        params :
+            - source: audio.PrimedAudioSource = The primed source
+            - sng: song.Song = The song of the source
+        """
+
+        with self.next_lock:
+            if not self.closed and self.next_song is sng and self.next_source is None:
+                self.next_source = source
+                return
+        source.cleanup()
+
+    def stop_song(self):
+        """
+        Stop the current song and clear the audio source
+        """
+
+        if self.play_chan_client.is_playing() or self.play_chan_client.is_paused():
+            self.play_chan_client.stop()
+
+    def pause_song(self):
+        """
+        Pause the current song
+        """
+
+        if self.play_chan_client.is_playing():
+            self.play_chan_client.pause()
+
+    def resume_song(self):
+        """
+        Resume the current song
+        """
+
+        if self.play_chan_client.is_paused():
+            self.play_chan_client.resume()
+
+    def disconnect(self):
+        """
+        Disconnect the player from the voice channel
+        """
+
+        self.stop_song()
+        self.prefetch_song(None)
+        self.play_chan_client.cleanup()
+        self.dj_bot.discord_client.loop.create_task(self.play_chan_client.disconnect())
+
+    # --- Music manipulation methods
+
+    async def add_music(self, title: str, user: discord.Member) -> None:
+        """
+        Method call by the discord client when a user add a music with the !play command
+
+        params :
+            - title: str = The title of the music to add
+            - user: discord.Member = The user who made the request
+        """
+
+        # Get the song dict by calling the youtube client
+        request_time: float = time.monotonic()
+        try:
+            song_dict: dict = await self.dj_bot.youtube_client.get_first_video(title)
+        except quota.QuotaExceeded as _:
+            self.send_quota_message()
+            return
+        if song_dict is None:
+            self.send_message("No result for **" + title + "**  :confused:")
+            return
+
+        # Create and add the song instance
+        sng: song.Song = song.Song(song_dict["title"], song_dict["id"], song_dict["duration"], user.display_name)
+        sng.request_time = request_time
+        self.add_song(sng)
+
+    async def add_playlist(self, playlist: str, user: discord.Member) -> None:
+        """
+        Method call by the discord client when a user add a playlist with the !playlist command, the songs are
+        downloaded when they approach the queue head
+
+        params :
+            - playlist: str = The playlist url or id
+            - user: discord.Member = The user who made the request
+        """
+
+        # Verify the playlist and the queue space
+        playlist_id: str = utils.parse_playlist_id(playlist)
+        if playlist_id is None:
+            self.send_message("Give a playlist like `!playlist <URL>`  :slight_smile:")
+            return
+        free_space: int = self.dj_bot.queue_max_size - len(self.song_queue)
+        if free_space <= 0:
+            self.send_error_message(
+                "Sorry **" + user.display_name + "**, but the queue is full  :disappointed_relieved:")
+            return
+
+        # Get the playlist videos that fit in the queue
+        try:
+            video_list: list = await self.dj_bot.youtube_client.get_playlist_videos(playlist_id, free_space)
+        except quota.QuotaExceeded as _:
+            self.send_quota_message()
+            return
+        except Exception as e:
+            logging.getLogger(LOGGER_NAME).warning("Cannot get the playlist " + playlist_id + " : " + str(e))
+            self.send_message("Cannot find the playlist **" + playlist + "**  :confused:")
+            return
+        if len(video_list) == 0:
+            self.send_message("No video in the playlist **" + playlist + "**  :confused:")
+            return
+
+        # Add the songs without downloading them, the queue may have grown during the request
+        added: int = 0
+        for song_dict in video_list:
+            if len(self.song_queue) >= self.dj_bot.queue_max_size:
+                break
+            sng: song.Song = song.Song(song_dict["title"], song_dict["id"], song_dict["duration"], user.display_name)
+            self.add_song(sng, feedback=False, download=False)
+            added += 1
+
+        self.schedule_downloads()
+        self.send_message(
+            "**" + user.display_name + "** add " + str(added) + " songs of the playlist to the queue  :smile:")
+
+    def choose_search(self, choose_id: str, user: discord.Member) -> None:
+        """
+        Choose a search result after an user made a search
+
+        params :
+            - choose_id: str = The id of the search option
+            - user: discord.Member = The user who made the choice
+        """
+
+        # Get the user search results or None
+        user_name = utils.get_user_fullname(user)
+        user_search: tuple = self.dj_bot.search_sessions.get(self.guild_id, user_name)
+
+        # If the user made a research provide a result, else send an error message
+        if user_search is not None:
+            if choose_id != "":
+                try:
+                    # Get the correct result and create the song instance
+                    choose_index: int = int(choose_id) - 1
+                    if choose_index < 0:
+                        raise IndexError(choose_index)
+                    result: session.SearchResult = user_search[choose_index]
+                    sng: song.Song = song.Song(result.title, result.video_id, result.get_duration(), user.display_name)
+                    sng.request_time = time.monotonic()
+                    self.add_song(sng)
+
+                    # Erase the user search
+                    self.dj_bot.search_sessions.end(self.guild_id, user_name)
+                except ValueError as _:
+                    self.send_message("Id must be an integer  :angry:")
+                except IndexError as _:
+                    self.send_message("Choose an id between 1 and " + str(len(user_search)) + " (you stupid)")
+            else:
+                self.send_message("Choose an id between 1 and " + str(len(user_search)) + " (you stupid)")
+        else:
+            self.send_message("Perform a **_!search_** before choosing an id  :slight_smile:")
+
+    def skip_music(self):
+        """
+        Skip the current playing music
+        """
+
+        self.post_event(SKIP_EVENT)
+
+    def seek_music(self, position: str) -> None:
+        """
+        Move the current song to a position
+
+        params :
+            - position: str = The wanted position in the mm:ss or hh:mm:ss format
+        """
+
+        # Verify there is a playing song
+        if self.current_song is None or self.state == IDLE_STATE:
+            self.send_message("There is no current song...")
+            return
+
+        # Verify the position
+        offset: int = utils.parse_duration_seconds(position)
+        duration: int = utils.parse_duration_seconds(self.current_song.duration)
+        if offset is None or offset < 0:
+            self.send_message("Give a position like `!seek 1:30`  :slight_smile:")
+        elif duration is not None and offset >= duration:
+            self.send_message("Choose a position before " + self.current_song.duration + " (you stupid)")
+        else:
+            self.post_event(SEEK_EVENT, self.current_song, offset)
+
+    def on_seek(self, sng: song.Song, offset: int) -> None:
+        """
+        Handle a seek of the current song
+
+        params :
+            - sng: song.Song = The song to move, nothing is done if it isn't the current song anymore
+            - offset: int = The wanted position in seconds
+        """
+
+        if sng is not self.current_song or self.state == IDLE_STATE:
+            return
+
+        self.seek_song(sng, offset)
+        self.journal.record("position", offset=offset)
+        self.send_message("Jump to **" + utils.format_seconds(offset) + "** in **" + sng.title + "**")
+
+    def save_position(self) -> None:
+        """
+        Write the position of the current song in the state journal
+        """
+
+        position: float = self.get_position()
+        if self.current_song is not None and self.state != IDLE_STATE and position is not None:
+            self.journal.record("position", offset=round(position, 2))
+
+    def pause_music(self) -> None:
+        """
+        Pause the music playing
+        """
+
+        self.post_event(PAUSE_EVENT)
+
+    def on_pause(self) -> None:
+        """
+        Handle a pause of the music playing
+        """
+
+        if self.state == PLAY_STATE:
+            self.state = PAUSE_STATE
+            self.pause_song()
+
+    def resume_music(self) -> None:
+        """
+        Resume the previously playing music
+        """
+
+        self.post_event(RESUME_EVENT)
+
+    def on_resume(self) -> None:
+        """
+        Handle the resume of the paused music
+        """
+
+        if self.state == PAUSE_STATE:
+            self.state = PLAY_STATE
+            self.resume_song()
+
+    def pop_queue(self, song_index: str):
+        """
+        Remove a song from the queue
+
+        params :
+            - song_index: str = The song index you want to remove
+        """
+
+        # Find the wanted song, it is removed by the state machine even if the queue moves before
+        try:
+            song_id = int(song_index) - 1
+            if 0 <= song_id < len(self.song_queue):
+                self.post_event(POP_EVENT, self.song_queue[song_id])
+            else:
+                self.send_message("Choose an id between 1 and " + str(len(self.song_queue)) + " (you stupid)")
+        except ValueError as _:
+            self.send_message("Choose an id between 1 and " + str(len(self.song_queue)) + " (you stupid)")
+
+    def on_pop(self, sng: song.Song) -> None:
+        """
+        Handle the removal of a song from the queue
+
+        params :
+            - sng: song.Song = The song to remove, nothing is done if it isn't in the queue anymore
+        """
+
+        if not self.song_queue.remove(sng):
+            return
+
+        self.journal.record("remove", qid=sng.queue_id)
+        self.dj_bot.youtube_client.cancel_download(sng)
+        self.schedule_downloads()
+        self.prefetch_next()
+        self.send_message("Song **" + sng.title + "** is removed from the queue")
+
+    def empty_queue(self, user: discord.Member) -> None:
+        """
+        Empty the current music queue
+
+        params :
+            - user: discord.Member = The user who made the request
+        """
+
+        # Verify that the user is an admin
+        if self.dj_bot.is_admin(user):
+            self.post_event(CLEAR_EVENT)
+        else:
+            self.send_message("You are not an admin  :middle_finger:")
+
+    def on_clear(self) -> None:
+        """
+        Handle the emptying of the queue
+        """
+
+        for sng in self.song_queue.clear():
+            self.dj_bot.youtube_client.cancel_download(sng)
+        self.journal.record("clear")
+        self.prefetch_next()
+        self.send_message("Queue has been cleaned  :thumbsup:")
+
+    # --- Interaction methods
+
+    def show_current(self) -> None:
+        """
+        Show the music that is currently playing if exists
+        """
+
+        if self.current_song is not None:
+            self.send_message("Current song is :```" + self.current_song.title + "```")
+        else:
+            self.send_message("There is no current song...")
+
+    def show_queue(self) -> None:
+        """
+        Send a message with the current queue
+        """
+
+        # Prepare the queue message
+        queue_message: str
+
+        if len(self.song_queue) > 0:
+            queue_message = "Current queue :\n"
+            queue_message += "```\n"
+
+            # Iterate over the queue
+            for i, sng in enumerate(self.song_queue):
+                queue_message += str(i + 1) + ". " + str(sng) + "\n"
+
+            queue_message += "```"
+        else:
+            queue_message = "Current queue is empty..."
+
+        # Send the queue message
+        self.send_message(queue_message)
+
+    async def show_search(self, search_q: str, user: discord.Member) -> None:
+        """
+        Send a message with the result of the research for a keyword
+
+        params :
+            - search_q: str = The search keyword
+            - user: discord.Member = The user who made the research
+        """
+
+        # Get the search result from the client
+        try:
+            search_result: list = await self.dj_bot.youtube_client.search_videos(search_q, self.dj_bot.max_result)
+        except quota.QuotaExceeded as _:
+            self.send_quota_message()
+            return
+
+        # Store the user search
+        user_name = utils.get_user_fullname(user)
+        user_search: tuple = self.dj_bot.search_sessions.start(self.guild_id, user_name, search_result)
+
+        # Create the search message
+        search_message: str = user.display_name + " here is the result for \"" + search_q + "\" :\n"
+        search_message += "```\n"
+        for i, result in enumerate(user_search):
+            search_message += str(i + 1) + ". "
+            search_message += result.title + " - " + result.channel_title
+            search_message += " [" + result.get_duration() + "]\n"
+        search_message += "```"
+        search_message += "Type `!choose <ID>` to add a song to the queue"
+
+        # Send the message
+        self.send_message(search_message)
+
+    def show_banned(self, user: discord.Member) -> None:
+        """
+        Show all banned members
+
+        params :
+            - user: discord.Member = The user who made the request
+        """
+
+        # Create the shame list
+        shame_list = "Current banned users are :"
+        shame_list += "```\n"
+        for ban in self.banned_user:
+            shame_list += ban
+        shame_list += "```"
+
+        # Send the message
+        self.send_message(shame_list)
+
+    def send_message(self, message: str) -> None:
+        """
+        Send a message to the request channel of the guild
+
+        params :
+            - message: str = The message you want to send
+        """
+
+        self.dj_bot.discord_client.send_message(self.req_chan, message)
+
+    def send_error_message(self, error: str) -> None:
+        """
+        Send an error message to the request channel of the guild
+
+        params :
+            - error: str = The error message to send
+        """
+
+        # Format and send the message
+        final_message = "**ERROR** : " + error
+        self.send_message(final_message)
+
+    def send_quota_message(self) -> None:
+        """
+        Send a message telling the Youtube quota of the day is spent
+        """
+
+        self.send_message("The Youtube quota of the day is spent, only the known songs can be found  :sleeping:")
+
+    def ban_user(self, user_name: str, user: discord.Member) -> None:
+        """
+        Exclude an user from the bot utilisation in the guild by its display name
+
+        params :
+            - user_name: str = The user name to ban from the bot
+            - user: discord.Member = The user who made the request
+        """
+
+        # Verify the user is an admin
+        if self.dj_bot.is_admin(user):
+            # Verify the user doesn't auto-ban
+            if user_name != utils.get_user_fullname(user):
+                # Add the user to the banned list
+                self.banned_user.append(user_name)
+                self.journal.record("ban", user=user_name)
+                self.send_message("**" + user_name + "**, I sentence you to jaz... to BAN !!!")
+            else:
+                self.send_message("You cannot auto-ban you stupid !")
+        else:
+            self.send_message("You are not an admin  :middle_finger:")
+
+    def unban_user(self, user_name: str, user: discord.Member):
+        """
+        Remove an user from the exclusion list of the guild
+
+        params :
+            - user_name: str = The user name to unban
+            - user: discord.Member = The user who made the request
+        """
+
+        # Verify the user is an admin
+        if self.dj_bot.is_admin(user):
+            # Search the user real name in the server
+            self.banned_user = list(filter(lambda a: a != user_name, self.banned_user))
+            self.journal.record("unban", user=user_name)
+            self.send_message("**" + user_name + "** was not an Impostor")
+        else:
+            self.send_message("You are not an admin  :middle_finger:")
+
+    # --- Persistence methods
+
+    def save(self) -> None:
+        """
+        Save the current song position and compact the state journal in background, every other mutation is
+        already saved when it happens
+        """
+
+        self.save_position()
+        self.journal.request_compaction()
+
+    def load(self) -> None:
+        """
+        Load the player state from its state journal or from the state files of the single guild versions, only
+        the songs close to the queue head and the cached ones are restored immediately
+        """
+
+        # Replay the journal
+        self.restore_time = time.monotonic()
+        save_dict: dict = self.journal.load()
+
+        # Take the state of the single guild versions if there is no journal
+        if save_dict is None:
+            save_dict = self.load_legacy_state()
+
+        if save_dict is not None:
+            # Reload the current song and the queue without downloading them
+            if save_dict["current"] is not None:
+                self.add_song(song.Song.from_dict(save_dict["current"]), False, False, False)
+            for sng_dict in save_dict["queue"]:
+                self.add_song(song.Song.from_dict(sng_dict), False, False, False)
+
+            # Reload the banned users
+            self.banned_user = save_dict["banned"]
+
+        # Start the journal from the reloaded state
+        self.journal.reset(
+            self.current_song.to_dict() if self.current_song is not None else None,
+            [self.get_journal_dict(sng) for sng in self.song_queue.get_added()],
+            list(self.banned_user)
+        )
+
+        # Start the downloads of the first songs
+        self.schedule_downloads()
+        if len(self.song_queue) == 0 and self.current_song is None:
+            self.restore_time = None
+
+    @staticmethod
+    def load_legacy_state() -> dict:
+        """
+        Read and remove the state journal or the save file written before the multi guild support, the first
+        loaded player takes this state
+
+        return -> dict = The state with the "current", "queue" and "banned" keys or None if there is no old state
+        """
+
+        with lock.FileLock("legacy"):
+            # Replay the old journal
+            if os.path.isfile(JOURNAL_FILE):
+                old_journal: journal.StateJournal = journal.StateJournal(JOURNAL_FILE)
+                save_dict: dict = old_journal.load()
+                old_journal.close()
+                old_journal.wait_closed()
+                os.remove(JOURNAL_FILE)
+                return save_dict
+
+            # Read the old save file
+            try:
+                save_file = open(SAVE_FILE, mode="r")
+                old_dict = json.loads(save_file.read())
+                save_file.close()
+                os.remove(SAVE_FILE)
+                return {
+                    "current": song.Song.deserialize(old_dict["current"]).to_dict() if old_dict["current"] else None,
+                    "queue": [song.Song.deserialize(sng_str).to_dict() for sng_str in old_dict["queue"]],
+                    "banned": old_dict["banned"]
+                }
+            except FileNotFoundError as _:
+                logging.getLogger(LOGGER_NAME).info("Save file not found, one will be created")
+                return None
+
+    def close(self) -> None:
+        """
+        Save the player state, close its journal and disconnect it
+        """
+
+        self.save()
+        self.closed = True
+        self.journal.close()
+        self.disconnect()
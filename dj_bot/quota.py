@@ -0,0 +1,278 @@
+from dj_bot import lock
+from dj_bot import LOGGER_NAME
+
+import datetime
+import threading
+import logging
+import json
+import os
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+# ----- The Youtube Data API units of each call type -----
+
+CALL_COSTS: dict = {
+    "search": 100,
+    "videos": 1,
+    "playlistItems": 1
+}
+
+
+class QuotaExceeded(Exception):
+    """
+    QuotaExceeded class.
+
+    This exception is raised when a Youtube API call doesn't fit in the remaining quota of the day
+    """
+    pass
+
+
+def get_pacific_timezone() -> datetime.tzinfo:
+    """
+    Get the Pacific timezone where the Youtube quota is reset at midnight
+
+    return -> datetime.tzinfo = The Pacific timezone, or the standard time offset if the timezone database is
+              missing
+    """
+
+    if zoneinfo is not None:
+        try:
+            return zoneinfo.ZoneInfo("America/Los_Angeles")
+        except zoneinfo.ZoneInfoNotFoundError as _:
+            pass
+    return datetime.timezone(datetime.timedelta(hours=-8))
+
+
+class QuotaMeter:
+    """
+    QuotaMeter class.
+
+    This class counts the Youtube API units spent in the current quota day, the counters are saved in a file to
+    survive restarts and are shared by the bot processes using the same key
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, daily_budget: int, low_budget: int, persist_file: str = None, shared: bool = False):
+        """
+        Create a new meter and load the counters of the day
+
+        params :
+            - daily_budget: int = The number of units of the day
+            - low_budget: int = The remaining units under which the cheaper paths are preferred
+            - persist_file: str = The file to save the counters in, None to keep them in memory only
+            - shared: bool = If other bot processes spend the same quota
+        """
+
+        # Assign the attributes
+        self.daily_budget: int = daily_budget
+        self.low_budget: int = low_budget
+        self.persist_file: str = persist_file
+        self.shared: bool = shared
+        self.timezone: datetime.tzinfo = get_pacific_timezone()
+        self.lock: threading.Lock = threading.Lock()
+
+        # The counters of the day by call type
+        self.day: str = self.get_day()
+        self.units: dict = dict()
+        self.calls: dict = dict()
+        self.load()
+
+    # ----- Class methods -----
+
+    def get_day(self) -> str:
+        """
+        Get the current quota day
+
+        return -> str = The Pacific date in the ISO format
+        """
+
+        return datetime.datetime.now(self.timezone).date().isoformat()
+
+    def get_reset_delay(self) -> float:
+        """
+        Get the time until the quota is reset
+
+        return -> float = The delay in seconds until the next Pacific midnight
+        """
+
+        now: datetime.datetime = datetime.datetime.now(self.timezone)
+        midnight: datetime.datetime = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1),
+            datetime.time(),
+            tzinfo=self.timezone
+        )
+        return (midnight - now).total_seconds()
+
+    def roll_day(self) -> None:
+        """
+        Reset the counters if the quota day changed, the lock must be held
+        """
+
+        day: str = self.get_day()
+        if day != self.day:
+            self.day = day
+            self.units = dict()
+            self.calls = dict()
+
+    def get_spent(self) -> int:
+        """
+        Get the units spent today
+
+        return -> int = The number of units
+        """
+
+        with self.lock:
+            # Take the calls of the other processes, the file is replaced atomically
+            if self.shared:
+                self.load_locked()
+            self.roll_day()
+            return sum(self.units.values())
+
+    def get_remaining(self) -> int:
+        """
+        Get the units left today
+
+        return -> int = The number of units, it can't be negative
+        """
+
+        return max(0, self.daily_budget - self.get_spent())
+
+    def can_spend(self, call_type: str, count: int = 1) -> bool:
+        """
+        Get if API calls fit in the remaining quota
+
+        params :
+            - call_type: str = The call type
+            - count: int = The number of calls
+
+        return -> bool = True if the calls can be made, False else
+        """
+
+        return CALL_COSTS[call_type] * count <= self.get_remaining()
+
+    def is_low(self) -> bool:
+        """
+        Get if the remaining quota is low and the cheaper paths must be preferred
+
+        return -> bool = True if the quota is low, False else
+        """
+
+        return self.get_remaining() < self.low_budget
+
+    def record(self, call_type: str) -> None:
+        """
+        Count an API call and save the counters
+
+        params :
+            - call_type: str = The call type
+        """
+
+        self.update(call_type, CALL_COSTS[call_type], 1)
+
+    def exhaust(self) -> None:
+        """
+        Count the quota as spent when the API refuses the calls, the meter can be behind the real usage if the
+        key is used elsewhere
+        """
+
+        self.update("unknown", None, 0)
+        logging.getLogger(LOGGER_NAME).warning("The Youtube quota is spent for today")
+
+    def update(self, call_type: str, units: int, calls: int) -> None:
+        """
+        Add units and calls to the counters of a call type and save them
+
+        params :
+            - call_type: str = The call type
+            - units: int = The number of units, None to spend all the remaining units
+            - calls: int = The number of calls
+        """
+
+        with self.lock:
+            file_lock: lock.FileLock = lock.FileLock("quota") if self.shared else None
+            if file_lock is not None:
+                file_lock.acquire()
+            try:
+                # Take the calls of the other processes
+                if self.shared:
+                    self.load_locked()
+                self.roll_day()
+                if units is None:
+                    units = max(0, self.daily_budget - sum(self.units.values()))
+                self.units[call_type] = self.units.get(call_type, 0) + units
+                self.calls[call_type] = self.calls.get(call_type, 0) + calls
+                self.save_locked()
+            finally:
+                if file_lock is not None:
+                    file_lock.release()
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the day
+
+        return -> dict = The spent and budget units, the units and calls by call type and the reset delay in
+                         seconds
+        """
+
+        with self.lock:
+            # Take the calls of the other processes
+            if self.shared:
+                self.load_locked()
+            self.roll_day()
+            return {
+                "spent": sum(self.units.values()),
+                "budget": self.daily_budget,
+                "units": dict(self.units),
+                "calls": dict(self.calls),
+                "reset": self.get_reset_delay()
+            }
+
+    # ----- Persistence -----
+
+    def load(self) -> None:
+        """
+        Load the counters of the day from the persist file if there is one
+        """
+
+        with self.lock:
+            self.load_locked()
+
+    def load_locked(self) -> None:
+        """
+        Load the counters of the day from the persist file, the lock must be held
+        """
+
+        if self.persist_file is None:
+            return
+
+        try:
+            with open(self.persist_file, mode="r") as quota_file:
+                quota_dict: dict = json.loads(quota_file.read())
+        except FileNotFoundError as _:
+            return
+        except ValueError as _:
+            logging.getLogger(LOGGER_NAME).warning("Quota file " + self.persist_file + " is corrupted, ignore it")
+            return
+
+        # The counters of a previous day are dropped
+        if quota_dict.get("day", None) == self.get_day():
+            self.day = quota_dict["day"]
+            self.units = quota_dict.get("units", dict())
+            self.calls = quota_dict.get("calls", dict())
+
+    def save_locked(self) -> None:
+        """
+        Write the counters in the persist file if there is one, the lock must be held
+        """
+
+        if self.persist_file is None:
+            return
+
+        tmp_file: str = self.persist_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, mode="w") as quota_file:
+            quota_file.write(json.dumps({"day": self.day, "units": self.units, "calls": self.calls}))
+        os.replace(tmp_file, self.persist_file)
@@ -0,0 +1,161 @@
+from dj_bot import cache, utils
+
+import asyncio
+
+
+class SearchResult:
+    """
+    SearchResult class.
+
+    This class is a compact search result kept in a search session, the duration is stored in seconds or None
+    when it is unknown
+    """
+
+    __slots__ = ("video_id", "title", "channel_title", "seconds")
+
+    # ----- Constructor -----
+
+    def __init__(self, video_id: str, title: str, channel_title: str, seconds: int):
+        """
+        Create a new search result
+
+        params :
+            - video_id: str = The video id
+            - title: str = The video title
+            - channel_title: str = The channel title
+            - seconds: int = The video duration in seconds or None
+        """
+
+        # Assign the attributes
+        self.video_id: str = video_id
+        self.title: str = title
+        self.channel_title: str = channel_title
+        self.seconds: int = seconds
+
+    # ----- Class methods -----
+
+    @classmethod
+    def from_dict(cls, result_dict: dict):
+        """
+        Return a SearchResult from a youtube client result dict, the description is dropped
+
+        params :
+            - result_dict: dict = The result dict
+        """
+
+        return cls(
+            result_dict["id"],
+            result_dict["title"],
+            result_dict["channel_title"],
+            utils.parse_duration_seconds(result_dict["duration"])
+        )
+
+    def get_duration(self) -> str:
+        """
+        Get the duration in the hh:mm:ss format
+
+        return -> str = The formatted duration
+        """
+
+        if self.seconds is None:
+            return utils.UNKNOWN_DURATION
+        return utils.format_seconds(self.seconds)
+
+
+class SearchSessionStore:
+    """
+    SearchSessionStore class.
+
+    This class keeps the last search results of each user until they choose one, the sessions expire after a
+    time to live and the least recently used ones are dropped when the store is full
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 600, purge_interval: float = 60):
+        """
+        Create a new empty store
+
+        params :
+            - max_sessions: int = The maximum number of sessions
+            - ttl: float = The time to live of a session in seconds
+            - purge_interval: float = The delay in seconds between two removals of the expired sessions
+        """
+
+        # Assign the attributes
+        self.purge_interval: float = purge_interval
+        self.sessions: cache.TTLCache = cache.TTLCache(max_sessions, ttl)
+
+    # ----- Class methods -----
+
+    @staticmethod
+    def get_key(guild_id: int, user_name: str) -> str:
+        """
+        Get the session key of a user in a guild
+
+        params :
+            - guild_id: int = The guild id
+            - user_name: str = The user full name
+
+        return -> str = The session key
+        """
+
+        return str(guild_id) + ":" + user_name
+
+    def start(self, guild_id: int, user_name: str, results: list) -> tuple:
+        """
+        Start a search session and replace the previous one of the user
+
+        params :
+            - guild_id: int = The guild id
+            - user_name: str = The user full name
+            - results: list = The youtube client result dicts
+
+        return -> tuple = The stored results
+        """
+
+        session: tuple = tuple(SearchResult.from_dict(result_dict) for result_dict in results)
+        self.sessions.put(self.get_key(guild_id, user_name), session)
+        return session
+
+    def get(self, guild_id: int, user_name: str) -> tuple:
+        """
+        Get the search session of a user
+
+        params :
+            - guild_id: int = The guild id
+            - user_name: str = The user full name
+
+        return -> tuple = The search results or None if there is no alive session
+        """
+
+        return self.sessions.get(self.get_key(guild_id, user_name))
+
+    def end(self, guild_id: int, user_name: str) -> None:
+        """
+        Remove the search session of a user
+
+        params :
+            - guild_id: int = The guild id
+            - user_name: str = The user full name
+        """
+
+        self.sessions.remove(self.get_key(guild_id, user_name))
+
+    async def purge_loop(self) -> None:
+        """
+        Remove the expired sessions regularly, the store stays small even if the users never choose
+        """
+
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            self.sessions.purge()
+
+    def __len__(self) -> int:
+        """
+        Get the number of sessions, expired ones included
+
+        return -> int = The number of sessions
+        """
+
+        return len(self.sessions)
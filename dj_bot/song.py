@@ -1,10 +1,22 @@
-from dj_bot import LOGGER_NAME, FFMPEG_DIR, DOWNLOAD_DIR
+from dj_bot import audio, utils
+from dj_bot import LOGGER_NAME, FFMPEG_DIR
 
+import threading
 import logging
 import discord
 import json
 
 
+class SongNotReady(Exception):
+    """
+    SongNotReady class.
+
+    This exception is raised when a streamed song file is gone and the final file is not known yet, the song
+    can be opened again when it is ready
+    """
+    pass
+
+
 class Song:
     """
     Song class.
@@ -22,7 +34,7 @@ class Song:
             - title: str = The song youtube title
             - video_id: str = The song video id
             - duration: str = The song duration in a string
-            - ready_func = The function to call when the song will be ready to be played
+            - user: str = The name of the user who added the song
         """
 
         # Assign the attributes
@@ -32,26 +44,60 @@ class Song:
         self.user: str = user
         self.is_ready: bool = False
         self.ready_func = None
+        self.failure_func = None
+        self.file_path: str = None
+        self.download_requested: bool = False
+        self.start_offset: float = 0
+        self.queue_id: int = None
+
+        # Progressive playback attributes
+        self.stream_buffer_size: int = None
+        self.is_streamable: bool = False
+        self.stream_path: str = None
+        self.stream_done: threading.Event = threading.Event()
+        self.request_time: float = None
 
     # ----- Serialization -----
 
-    def serialize(self) -> str:
+    def to_dict(self) -> dict:
         """
-        Serialize the song in a json string
+        Get the dict of the song parameters
 
-        return -> str = The json string of the song
+        return -> dict = The song dict
         """
 
-        # Create the dict to create the json
         song_dict: dict = {
             "title": self.title,
             "video_id": self.video_id,
             "duration": self.duration,
             "user": self.user
         }
+        if self.start_offset > 0:
+            song_dict["offset"] = self.start_offset
+        return song_dict
+
+    @classmethod
+    def from_dict(cls, song_dict: dict):
+        """
+        Return a Song with the parameters dict
+
+        params :
+            - song_dict: dict = The song dict
+        """
+
+        sng = cls(song_dict["title"], song_dict["video_id"], song_dict["duration"], song_dict["user"])
+        sng.start_offset = song_dict.get("offset", 0)
+        return sng
+
+    def serialize(self) -> str:
+        """
+        Serialize the song in a json string
+
+        return -> str = The json string of the song
+        """
 
         # Return the json string
-        return json.dumps(song_dict)
+        return json.dumps(self.to_dict())
 
     @classmethod
     def deserialize(cls, src: str):
@@ -62,11 +108,8 @@ class Song:
             - src: str = The json string
         """
 
-        # Load the dict from the string
-        song_dict = json.loads(src)
-
-        # Return a new song with the parameters
-        return cls(song_dict["title"], song_dict["video_id"], song_dict["duration"], song_dict["user"])
+        # Load the dict from the string and return a new song with the parameters
+        return cls.from_dict(json.loads(src))
 
     # ----- Class methods -----
 
@@ -80,6 +123,10 @@ class Song:
         res: str = self.title + " [" + self.duration + "] (" + self.user + ")"
         if self.is_ready:
             res += " Ready"
+        elif self.is_streamable:
+            res += " Streaming..."
+        elif not self.download_requested:
+            res += " Waiting"
         else:
             res += " Downloading..."
         return res
@@ -92,9 +139,33 @@ class Song:
             - s: dict = The download informations
         """
 
-        if s["status"] == "finished":
-            # Set the state to ready
+        if s["status"] == "downloading":
+            # Make the song streamable when enough bytes are downloaded
+            if self.stream_buffer_size is not None and not self.is_streamable and not self.is_ready:
+                downloaded: int = s.get("downloaded_bytes", 0)
+                if downloaded >= self.stream_buffer_size or downloaded == s.get("total_bytes", -1):
+                    self.stream_path = s.get("tmpfilename", s.get("filename", None))
+                    if self.stream_path is not None:
+                        self.is_streamable = True
+                        if self.ready_func is not None:
+                            self.ready_func(self)
+
+        elif s["status"] == "downloaded":
+            # Stop waiting for new bytes in the streamed file
+            self.stream_done.set()
+
+        elif s["status"] == "error":
+            # Stop waiting for new bytes in the streamed file and report the failure
+            self.stream_done.set()
+            if self.failure_func is not None:
+                self.failure_func(self)
+
+        elif s["status"] == "finished":
+            # Remember the downloaded file and set the state to ready
+            if s.get("filename", None) is not None:
+                self.file_path = s["filename"]
             self.is_ready = True
+            self.stream_done.set()
 
             # Log the song downloading success
             logging.getLogger(LOGGER_NAME).info("Song " + self.title + " - " + self.video_id + " has been downloaded")
@@ -103,10 +174,63 @@ class Song:
             if self.ready_func is not None:
                 self.ready_func(self)
 
-    def get_audio_source(self) -> discord.AudioSource:
+    def is_playable(self) -> bool:
+        """
+        Get if the song can start playing, from its file or while it is downloading
+
+        return -> bool = True if the song can be played, False else
+        """
+
+        return self.is_ready or self.is_streamable
+
+    def get_audio_source(self, offset: float = 0) -> discord.AudioSource:
         """
         Get the song audio source to play it in discord
+
+        params :
+            - offset: float = The position in seconds to start the song at
         """
 
-        source_file = DOWNLOAD_DIR + self.video_id + ".mp4"
-        return discord.FFmpegPCMAudio(source=source_file, executable=FFMPEG_DIR + "ffmpeg")
+        # Seek with the ffmpeg input option to avoid decoding the skipped part
+        before_options: str = None
+        if offset > 0:
+            before_options = "-ss " + "{:.2f}".format(offset)
+
+        # Read the downloading file through ffmpeg if the song isn't downloaded yet
+        if not self.is_ready and self.is_streamable:
+            try:
+                return discord.FFmpegPCMAudio(
+                    source=audio.GrowingFile(self.stream_path, self.stream_done),
+                    pipe=True,
+                    executable=FFMPEG_DIR + "ffmpeg",
+                    before_options=before_options
+                )
+            except FileNotFoundError as _:
+                # The download finished between the checks, the file may still be encoded and the final file is
+                # only known when the song is ready
+                self.is_streamable = False
+                raise SongNotReady("The streamed file of " + self.video_id + " is gone")
+
+        # Find the song file if the download didn't tell it
+        if self.file_path is None:
+            self.file_path = utils.find_song_file(self.video_id)
+        if self.file_path is None:
+            raise FileNotFoundError("No song file for " + self.video_id)
+
+        # Send the pre-encoded Opus packets without ffmpeg when possible, without transcoding else
+        source_file = self.file_path
+        if audio.is_opus_file(source_file):
+            try:
+                source: audio.OggOpusAudio = audio.OggOpusAudio(source_file)
+                if offset > 0:
+                    source.seek_time(offset)
+                return source
+            except audio.OggError as e:
+                logging.getLogger(LOGGER_NAME).warning("Play " + source_file + " with ffmpeg : " + str(e))
+            return discord.FFmpegOpusAudio(
+                source=source_file,
+                codec="copy",
+                executable=FFMPEG_DIR + "ffmpeg",
+                before_options=before_options
+            )
+        return discord.FFmpegPCMAudio(source=source_file, executable=FFMPEG_DIR + "ffmpeg", before_options=before_options)
@@ -0,0 +1,317 @@
+from dj_bot import song
+
+import collections
+import threading
+
+
+class SongQueue:
+    """
+    SongQueue class.
+
+    This class is the playing queue of a player, the head is popped, a song is found by its video id and removed
+    in constant time. The songs are played in their adding order or in a round robin between the users who added
+    them, so one user cannot starve the others
+
+    The removed songs stay in the order deques until they reach a deque head or the deques are compacted
+    """
+
+    # ----- Constructor -----
+
+    def __init__(self, round_robin: bool = False):
+        """
+        Create a new empty queue
+
+        params :
+            - round_robin: bool = If the users take turns, else the songs are played in their adding order
+        """
+
+        # Assign the attributes
+        self.round_robin: bool = round_robin
+        self.lock: threading.RLock = threading.RLock()
+        self.next_id: int = 0
+        self.dead_count: int = 0
+
+        # The queued songs by queue id in their adding order and the queue ids of each video
+        self.entries: dict = dict()
+        self.video_index: dict = dict()
+
+        # The queue ids in their adding order
+        self.order: collections.deque = collections.deque()
+
+        # The queue ids of each user and the users in their playing turn order
+        self.user_queues: dict = dict()
+        self.users: collections.deque = collections.deque()
+
+    # ----- Class methods -----
+
+    def append(self, sng: song.Song) -> None:
+        """
+        Add a song at the end of the queue, or at the end of its user turns in round robin
+
+        params :
+            - sng: song.Song = The song to add
+        """
+
+        with self.lock:
+            self.next_id += 1
+            sng.queue_id = self.next_id
+            self.entries[sng.queue_id] = sng
+            self.video_index.setdefault(sng.video_id, set()).add(sng.queue_id)
+
+            if self.round_robin:
+                user_queue: collections.deque = self.user_queues.get(sng.user, None)
+                if user_queue is None:
+                    user_queue = collections.deque()
+                    self.user_queues[sng.user] = user_queue
+                    self.users.append(sng.user)
+                user_queue.append(sng.queue_id)
+            else:
+                self.order.append(sng.queue_id)
+
+    def peek(self) -> song.Song:
+        """
+        Get the head of the queue without removing it
+
+        return -> song.Song = The next song to play or None if the queue is empty
+        """
+
+        with self.lock:
+            if not self.round_robin:
+                while len(self.order) > 0 and self.order[0] not in self.entries:
+                    self.order.popleft()
+                    self.dead_count -= 1
+                return self.entries[self.order[0]] if len(self.order) > 0 else None
+
+            # Find the first user with a song
+            while len(self.users) > 0:
+                user: str = self.users[0]
+                user_queue: collections.deque = self.user_queues[user]
+                while len(user_queue) > 0 and user_queue[0] not in self.entries:
+                    user_queue.popleft()
+                    self.dead_count -= 1
+                if len(user_queue) > 0:
+                    return self.entries[user_queue[0]]
+                self.users.popleft()
+                del self.user_queues[user]
+            return None
+
+    def pop(self) -> song.Song:
+        """
+        Remove and get the head of the queue, in round robin its user goes to the end of the turns
+
+        return -> song.Song = The next song to play or None if the queue is empty
+        """
+
+        with self.lock:
+            head: song.Song = self.peek()
+            if head is None:
+                return None
+
+            if self.round_robin:
+                self.user_queues[self.users[0]].popleft()
+                self.users.rotate(-1)
+            else:
+                self.order.popleft()
+            self.forget(head)
+            return head
+
+    def remove(self, sng: song.Song) -> bool:
+        """
+        Remove a song from the queue
+
+        params :
+            - sng: song.Song = The song to remove
+
+        return -> bool = True if the song was removed, False if it wasn't in the queue
+        """
+
+        with self.lock:
+            if self.entries.get(getattr(sng, "queue_id", None), None) is not sng:
+                return False
+
+            # The queue id stays in the order deques until it is skipped or compacted
+            self.forget(sng)
+            self.dead_count += 1
+            if self.dead_count > len(self.entries) + 16:
+                self.compact()
+            return True
+
+    def forget(self, sng: song.Song) -> None:
+        """
+        Remove a song from the entries and the video index, the lock must be held
+
+        params :
+            - sng: song.Song = The queued song
+        """
+
+        del self.entries[sng.queue_id]
+        video_ids: set = self.video_index[sng.video_id]
+        video_ids.discard(sng.queue_id)
+        if len(video_ids) == 0:
+            del self.video_index[sng.video_id]
+
+    def compact(self) -> None:
+        """
+        Drop the removed songs from the order deques, the lock must be held
+        """
+
+        self.order = collections.deque(queue_id for queue_id in self.order if queue_id in self.entries)
+        for user in list(self.users):
+            user_queue = collections.deque(queue_id for queue_id in self.user_queues[user] if queue_id in self.entries)
+            if len(user_queue) > 0:
+                self.user_queues[user] = user_queue
+            else:
+                self.users.remove(user)
+                del self.user_queues[user]
+        self.dead_count = 0
+
+    def clear(self) -> list:
+        """
+        Remove all songs from the queue
+
+        return -> list = The removed songs
+        """
+
+        with self.lock:
+            removed: list = list(self.entries.values())
+            self.entries.clear()
+            self.video_index.clear()
+            self.order.clear()
+            self.user_queues.clear()
+            self.users.clear()
+            self.dead_count = 0
+            return removed
+
+    def has_video(self, video_id: str) -> bool:
+        """
+        Get if a video is queued
+
+        params :
+            - video_id: str = The video id
+
+        return -> bool = True if a song of the video is queued, False else
+        """
+
+        return video_id in self.video_index
+
+    def get_video_ids(self) -> set:
+        """
+        Get the queued video ids
+
+        return -> set = The video ids
+        """
+
+        with self.lock:
+            return set(self.video_index.keys())
+
+    def get_position(self, video_id: str) -> int:
+        """
+        Get the position of the first song of a video
+
+        params :
+            - video_id: str = The video id
+
+        return -> int = The position from 0 or the queue length if the video isn't queued
+        """
+
+        with self.lock:
+            if video_id not in self.video_index:
+                return len(self.entries)
+            for i, sng in enumerate(self):
+                if sng.video_id == video_id:
+                    return i
+            return len(self.entries)
+
+    def get_added(self) -> list:
+        """
+        Get the songs in their adding order
+
+        return -> list = The queued songs
+        """
+
+        with self.lock:
+            return list(self.entries.values())
+
+    def head(self, count: int) -> list:
+        """
+        Get the first songs in the playing order
+
+        params :
+            - count: int = The maximum number of songs
+
+        return -> list = The first songs
+        """
+
+        result: list = list()
+        for sng in self:
+            if len(result) >= count:
+                break
+            result.append(sng)
+        return result
+
+    def __iter__(self):
+        """
+        Iterate over a copy of the queue in the playing order
+
+        return -> iterator = The songs iterator
+        """
+
+        with self.lock:
+            if not self.round_robin:
+                ordered: list = [self.entries[queue_id] for queue_id in self.order if queue_id in self.entries]
+            else:
+                # Interleave the songs of each user in their turn order
+                user_songs: list = [
+                    [self.entries[queue_id] for queue_id in self.user_queues[user] if queue_id in self.entries]
+                    for user in self.users
+                ]
+                ordered: list = list()
+                turn: int = 0
+                while len(ordered) < len(self.entries):
+                    for songs in user_songs:
+                        if turn < len(songs):
+                            ordered.append(songs[turn])
+                    turn += 1
+        return iter(ordered)
+
+    def __getitem__(self, index: int) -> song.Song:
+        """
+        Get the song at a position in the playing order
+
+        params :
+            - index: int = The position from 0
+
+        return -> song.Song = The song at the position
+        """
+
+        if index == 0:
+            head: song.Song = self.peek()
+            if head is None:
+                raise IndexError("The queue is empty")
+            return head
+        if index < 0 or index >= len(self.entries):
+            raise IndexError("The position " + str(index) + " is out of the queue")
+        for i, sng in enumerate(self):
+            if i == index:
+                return sng
+
+    def __contains__(self, sng: song.Song) -> bool:
+        """
+        Get if a song is in the queue
+
+        params :
+            - sng: song.Song = The song
+
+        return -> bool = True if the song is queued, False else
+        """
+
+        return self.entries.get(getattr(sng, "queue_id", None), None) is sng
+
+    def __len__(self) -> int:
+        """
+        Get the number of queued songs
+
+        return -> int = The number of songs
+        """
+
+        return len(self.entries)
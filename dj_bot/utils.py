@@ -1,4 +1,19 @@
+from dj_bot import DOWNLOAD_DIR
+
 import discord
+import urllib.parse
+import glob
+import os
+
+# ----- Song files -----
+
+# Extensions of the files youtube dl writes while downloading
+PARTIAL_EXTENSIONS: tuple = (".part", ".ytdl", ".temp", ".tmp")
+
+# ----- Durations -----
+
+# The duration of the videos whose details were not requested
+UNKNOWN_DURATION: str = "??:??"
 
 
 def parse_youtube_time(yt_time: str) -> str:
@@ -45,6 +60,42 @@ def parse_youtube_time(yt_time: str) -> str:
     return res
 
 
+def parse_duration_seconds(duration: str) -> int:
+    """
+    Parse a duration in the hh:mm:ss or mm:ss format to a number of seconds
+
+    params :
+        - duration: str = The duration string
+    return -> int = The duration in seconds or None if the string is invalid
+    """
+
+    try:
+        res: int = 0
+        for part in duration.split(":"):
+            res = res * 60 + int(part)
+        return res
+    except (ValueError, AttributeError) as _:
+        return None
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    Format a number of seconds to the hh:mm:ss format, the hours are omitted when null
+
+    params :
+        - seconds: float = The number of seconds
+    return -> str = The formatted duration
+    """
+
+    total: int = int(seconds)
+    res: str = ""
+    if total >= 3600:
+        res += "{:02d}".format(total // 3600) + ":"
+    res += "{:02d}".format(total % 3600 // 60) + ":"
+    res += "{:02d}".format(total % 60)
+    return res
+
+
 def get_user_fullname(user: discord.Member) -> str:
     """
     Get the full name of a discord user (i.e. MyName#0000)
@@ -55,3 +106,62 @@ def get_user_fullname(user: discord.Member) -> str:
     """
 
     return user.name + "#" + user.discriminator
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query to share cache entries between similar queries
+
+    params :
+        - query: str = The raw search query
+    return -> str = The normalized query
+    """
+
+    return " ".join(query.lower().split())
+
+
+def parse_playlist_id(playlist: str) -> str:
+    """
+    Get the id of a youtube playlist from its url or its id
+
+    params :
+        - playlist: str = The playlist url or id
+    return -> str = The playlist id or None if the url has no playlist
+    """
+
+    playlist = playlist.strip()
+    if "/" not in playlist and "=" not in playlist:
+        return playlist if playlist != "" else None
+
+    # Take the list parameter of the url
+    query: dict = urllib.parse.parse_qs(urllib.parse.urlparse(playlist).query)
+    if "list" in query:
+        return query["list"][0]
+    return None
+
+
+def find_song_file(video_id: str) -> str:
+    """
+    Find the downloaded file of a video in the download directory whatever its container
+
+    params :
+        - video_id: str = The video id
+    return -> str = The path of the song file or None if the video isn't downloaded
+    """
+
+    for path in glob.glob(DOWNLOAD_DIR + video_id + ".*"):
+        if not path.endswith(PARTIAL_EXTENSIONS):
+            return path
+    return None
+
+
+def get_file_video_id(file_name: str) -> str:
+    """
+    Get the video id of a file in the download directory (i.e. "id.webm.part" -> "id")
+
+    params :
+        - file_name: str = The file name
+    return -> str = The video id
+    """
+
+    return os.path.basename(file_name).split(".", 1)[0]
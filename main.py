@@ -1,4 +1,4 @@
-from dj_bot import bot
+from dj_bot import bot, launcher
 
 import logging
 import pathlib
@@ -17,8 +17,33 @@ def create_base_config():
     config_str += "ADMIN_USERS = []\n"
     config_str += "ADMIN_ROLES = []\n"
     config_str += "QUEUE_MAX_SIZE = 30\n"
+    config_str += "QUEUE_ROUND_ROBIN = False\n"
     config_str += "MAX_RESULT = 10\n"
-    config_str += "REMOVE_REQUEST_MESSAGE = False\n"
+    config_str += "REMOVE_REQUEST_MESSAGE = False\n\n"
+    config_str += "SEARCH_CACHE_SIZE = 512\n"
+    config_str += "SEARCH_CACHE_TTL = 86400\n"
+    config_str += "VIDEO_CACHE_SIZE = 4096\n"
+    config_str += "VIDEO_CACHE_TTL = 604800\n"
+    config_str += "PERSIST_SEARCH_CACHE = True\n\n"
+    config_str += "DOWNLOAD_WORKERS = 2\n"
+    config_str += "DOWNLOAD_TIMEOUT = 600\n"
+    config_str += "OPUS_BITRATE = 96\n"
+    config_str += "PROGRESSIVE_PLAYBACK = True\n"
+    config_str += "STREAM_BUFFER_SIZE = 262144\n\n"
+    config_str += "CACHE_MAX_SIZE = 2048\n"
+    config_str += "CACHE_MAX_FILES = 1000\n"
+    config_str += "CACHE_CHECK_INTERVAL = 300\n"
+    config_str += "DOWNLOAD_AHEAD = 3\n"
+    config_str += "POSITION_SAVE_INTERVAL = 5\n\n"
+    config_str += "USER_COMMAND_BURST = 5\n"
+    config_str += "USER_COMMAND_RATE = 1\n"
+    config_str += "GUILD_TASK_LIMIT = 4\n"
+    config_str += "SEARCH_SESSION_MAX = 1000\n"
+    config_str += "SEARCH_SESSION_TTL = 600\n\n"
+    config_str += "YOUTUBE_DAILY_QUOTA = 10000\n"
+    config_str += "YOUTUBE_LOW_QUOTA = 2000\n\n"
+    config_str += "SHARD_COUNT = None\n"
+    config_str += "SHARD_PROCESSES = 1\n"
     config_file.write(config_str)
 
 
@@ -41,8 +66,8 @@ def main() -> int:
     # Configure the logger
     logging.basicConfig(filemode="w", filename=config.LOG_FILE, level=logging.INFO)
 
-    # Create the discord bot
-    dj_bot = bot.DJBot(
+    # Get the bot parameters
+    bot_kwargs: dict = dict(
         discord_token=config.DISCORD_TOKEN,
         youtube_token=config.YOUTUBE_TOKEN,
         request_channel=config.REQUEST_CHANNEL,
@@ -50,11 +75,52 @@ def main() -> int:
         admin_users=config.ADMIN_USERS,
         admin_roles=config.ADMIN_ROLES,
         queue_max_size=config.QUEUE_MAX_SIZE,
+        round_robin_queue=getattr(config, "QUEUE_ROUND_ROBIN", False),
         max_result=config.MAX_RESULT,
-        remove_req=config.REMOVE_REQUEST_MESSAGE
+        remove_req=config.REMOVE_REQUEST_MESSAGE,
+        search_cache_size=getattr(config, "SEARCH_CACHE_SIZE", 512),
+        search_cache_ttl=getattr(config, "SEARCH_CACHE_TTL", 86400),
+        video_cache_size=getattr(config, "VIDEO_CACHE_SIZE", 4096),
+        video_cache_ttl=getattr(config, "VIDEO_CACHE_TTL", 604800),
+        persist_search_cache=getattr(config, "PERSIST_SEARCH_CACHE", True),
+        download_workers=getattr(config, "DOWNLOAD_WORKERS", 2),
+        download_timeout=getattr(config, "DOWNLOAD_TIMEOUT", 600),
+        opus_bitrate=getattr(config, "OPUS_BITRATE", 96),
+        progressive_playback=getattr(config, "PROGRESSIVE_PLAYBACK", True),
+        stream_buffer_size=getattr(config, "STREAM_BUFFER_SIZE", 262144),
+        cache_max_size=getattr(config, "CACHE_MAX_SIZE", 2048),
+        cache_max_files=getattr(config, "CACHE_MAX_FILES", 1000),
+        cache_check_interval=getattr(config, "CACHE_CHECK_INTERVAL", 300),
+        download_ahead=getattr(config, "DOWNLOAD_AHEAD", 3),
+        position_save_interval=getattr(config, "POSITION_SAVE_INTERVAL", 5),
+        user_command_burst=getattr(config, "USER_COMMAND_BURST", 5),
+        user_command_rate=getattr(config, "USER_COMMAND_RATE", 1),
+        guild_task_limit=getattr(config, "GUILD_TASK_LIMIT", 4),
+        search_session_max=getattr(config, "SEARCH_SESSION_MAX", 1000),
+        search_session_ttl=getattr(config, "SEARCH_SESSION_TTL", 600),
+        daily_quota=getattr(config, "YOUTUBE_DAILY_QUOTA", 10000),
+        low_quota=getattr(config, "YOUTUBE_LOW_QUOTA", 2000)
     )
 
-    # Start the bot
+    # Start the bot in several processes sharing the song cache if wanted
+    shard_count: int = getattr(config, "SHARD_COUNT", None)
+    shard_processes: int = getattr(config, "SHARD_PROCESSES", 1)
+    if shard_processes > 1:
+        shard_launcher = launcher.ShardLauncher(
+            bot_kwargs,
+            shard_count if shard_count is not None else shard_processes,
+            shard_processes,
+            config.LOG_FILE
+        )
+        shard_launcher.start()
+        return 0
+
+    # Create and start the discord bot
+    dj_bot = bot.DJBot(
+        shard_ids=list(range(shard_count)) if shard_count is not None else None,
+        shard_count=shard_count,
+        **bot_kwargs
+    )
     dj_bot.start()
 
 